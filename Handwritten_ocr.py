@@ -1,5 +1,6 @@
 import cv2
 import pytesseract
+import tesseract_backend
 from pytesseract import Output
 import os # For path joining
 
@@ -42,7 +43,7 @@ try:
     # Use image_to_data to get detailed information including bounding boxes
     # Use config for better page segmentation mode if needed (e.g., --psm 6 for assuming a single uniform block of text)
     # Increase DPI if needed for clearer text: config='--psm 6 --dpi 300'
-    ocr_data = pytesseract.image_to_data(gray_image, output_type=Output.DICT, config='--psm 6')
+    ocr_data = tesseract_backend.image_to_data(gray_image, output_type=Output.DICT, config='--psm 6')
 
     # --- Draw bounding boxes around individual words ---
     n_boxes = len(ocr_data['level'])
@@ -74,7 +75,7 @@ try:
 
 
     # --- Extract the full text using image_to_string (still useful for clean text output) ---
-    extracted_text = pytesseract.image_to_string(gray_image, config='--psm 6')
+    extracted_text = tesseract_backend.image_to_string(gray_image, config='--psm 6')
 
 except pytesseract.TesseractNotFoundError:
     print("\n-------------------- TESSERACT NOT FOUND ERROR --------------------")
@@ -1,35 +1,99 @@
-from flask import Flask, render_template, request, jsonify, url_for, send_from_directory
+from flask import Flask, Response, g, render_template, request, jsonify, url_for, send_from_directory
 import os
+import hmac
+import shutil
 from werkzeug.utils import secure_filename
 import pdf2image
 import tempfile
+from PIL import Image
+import time
+import uuid
 
-# Import OCR modules
-import pytesseract_module
-import easyocr_module
-import doctr_module
+# Import OCR engine registry/runner and background job queue
+import batch_runner
+import engine_registry
+import engine_runner
+import ingest
+import jobs
+import metrics
+import ocr_cache
+import pdf_pages
+import profiler
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['TEMP_FOLDER'] = 'static/temp'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
+app.config['OCR_EXECUTION'] = os.environ.get('OCR_EXECUTION', 'parallel')  # 'parallel' or 'sequential'
+app.config['CACHE_FOLDER'] = os.environ.get('OCR_CACHE_DIR', 'cache')
+app.config['CACHE_MEMORY_ENTRIES'] = int(os.environ.get('OCR_CACHE_MEMORY_ENTRIES', 256))
+app.config['CACHE_DISK_MB'] = int(os.environ.get('OCR_CACHE_DISK_MB', 256))
+app.config['JOBS_DB'] = os.environ.get('JOBS_DB', 'jobs/jobs.sqlite3')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 1))
+app.config['PROFILE_FOLDER'] = profiler.PROFILE_DIR
+# Profiling is off unless this token is set; X-OCR-Profile, the admin toggle and
+# the saved profiles all require it
+app.config['PROFILE_TOKEN'] = os.environ.get('OCR_PROFILE_TOKEN', '')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
 
 # Create necessary folders
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['TEMP_FOLDER'], exist_ok=True)
 
+# Content-addressed OCR result cache (in-process LRU + on-disk tier)
+result_cache = ocr_cache.OCRCache(app.config['CACHE_FOLDER'],
+                                  max_memory_entries=app.config['CACHE_MEMORY_ENTRIES'],
+                                  max_disk_bytes=app.config['CACHE_DISK_MB'] * 1024 * 1024)
+
+# Persistent job queue drained by background worker threads
+job_queue = jobs.JobQueue(app.config['JOBS_DB'], num_workers=app.config['JOB_WORKERS'],
+                          cache=result_cache)
+
+# Models load on first use unless listed in OCR_PRELOAD (e.g. "easyocr,doctr" or "all").
+# Under gunicorn preload_app this runs in the master, so workers share the weights.
+engine_registry.warm_up(engine_registry.preload_list())
+
+# Report idle engines as 0 in flight rather than leaving the series out
+for engine in engine_registry.ENGINE_NAMES:
+    metrics.set_gauge('ocr_engine_in_flight', 0, engine=engine)
+
+@app.before_request
+def start_job_workers():
+    # Worker threads are started per process (and again after a fork)
+    job_queue.ensure_workers()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Label by route rather than path so the number of series stays bounded
+    endpoint = request.endpoint or 'unmatched'
+    if 'request_start' in g:
+        metrics.observe('ocr_request_seconds', time.perf_counter() - g.request_start, endpoint=endpoint)
+    metrics.inc('ocr_requests_total', endpoint=endpoint, status=response.status_code)
+    return response
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def create_preview_image(file_path, original_filename):
+def create_preview_image(file_path, original_filename, digest=None, page_store=None):
     """Create a preview image for PDF files"""
     if original_filename.lower().endswith('.pdf'):
-        # Convert first page of PDF to image
-        images = pdf2image.convert_from_path(file_path, first_page=1, last_page=1)
+        # Previews are named by content digest so a repeated upload reuses its preview
+        preview_name = f"{digest or os.path.splitext(original_filename)[0]}_preview.jpg"
+        preview_path = os.path.join(app.config['TEMP_FOLDER'], preview_name)
+        if digest and os.path.exists(preview_path):
+            return url_for('static', filename=f"temp/{preview_name}")
+        # Reuse the first page when an engine has the PDF rendered in colour anyway,
+        # otherwise convert just the first page of the PDF to an image
+        page = page_store.first_page_image() if page_store is not None else None
+        if page is not None:
+            images = [Image.fromarray(page)]
+        else:
+            images = pdf2image.convert_from_path(file_path, first_page=1, last_page=1)
         if images:
-            preview_path = os.path.join(app.config['TEMP_FOLDER'], 
-                                      f"{os.path.splitext(original_filename)[0]}_preview.jpg")
             images[0].save(preview_path, 'JPEG')
             return url_for('static', filename=f"temp/{os.path.basename(preview_path)}")
     else:
@@ -37,6 +101,33 @@ def create_preview_image(file_path, original_filename):
         return url_for('static', filename=f"temp/{os.path.basename(file_path)}")
     return None
 
+def profile_token_ok(value):
+    # Without a configured token nothing is accepted, so profiling stays off
+    token = app.config['PROFILE_TOKEN']
+    return bool(token) and value is not None and hmac.compare_digest(value, token)
+
+def start_profile(name):
+    """
+    Start profiling this request if it carries X-OCR-Profile or the admin toggle picks it.
+
+    Returns (profile, skipped_reason); both are None for unflagged requests.
+    """
+    if not app.config['PROFILE_TOKEN']:
+        return None, None
+    flagged = profile_token_ok(request.headers.get('X-OCR-Profile'))
+    if not flagged and not profiler.wanted_by_toggle():
+        return None, None
+    profile, reason = profiler.try_start(name)
+    metrics.inc('ocr_profiles_total', outcome='recorded' if profile else 'skipped')
+    return profile, reason
+
+def finish_profile(profile):
+    """Write a profile's output and describe it for the response"""
+    summary = profiler.finish(profile, app.config['PROFILE_FOLDER'])
+    summary['collapsed_url'] = url_for('get_profile', filename=summary.pop('collapsed'))
+    summary['flamegraph_url'] = url_for('get_profile', filename=summary.pop('flamegraph'))
+    return summary
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -54,66 +145,224 @@ def process_image():
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         temp_path = os.path.join(app.config['TEMP_FOLDER'], filename)
-        
-        # Save file in both upload and temp folders
-        file.save(filepath)
-        file.seek(0)
-        file.save(temp_path)
-        
-        # Create preview image for PDF or get image URL
-        preview_url = create_preview_image(filepath, filename)
+        is_pdf = filename.lower().endswith('.pdf')
         
         # Get selected OCR method
         ocr_method = request.form.get('ocr_method', 'all')
         file_type = request.form.get('file_type', 'image')
+        execution = request.form.get('execution', app.config['OCR_EXECUTION'])
+        engines = engine_runner.selected_engines(ocr_method)
+        if not engines:
+            return jsonify({'error': f'Unknown OCR method: {ocr_method}'}), 400
         
-        results = {
-            'preview_url': preview_url
-        }
+        # Write the upload once, hashing it on the way (the digest keys the result cache),
+        # and link it into the temp folder for the preview instead of writing it again
+        with metrics.span('upload'):
+            upload = ingest.save_upload(file, filepath, keep_bytes=not is_pdf)
+            ingest.link_file(filepath, temp_path)
+        digest = upload.sha256
         
-        if ocr_method in ['all', 'pytesseract']:
-            try:
-                if file_type == 'image':
-                    results['pytesseract'] = pytesseract_module.extract_text_from_image(filepath)
-                elif file_type == 'pdf':
-                    results['pytesseract'] = pytesseract_module.extract_text_from_pdf(filepath)
-                elif file_type == 'handwriting':
-                    results['pytesseract'] = pytesseract_module.recognize_handwriting(filepath)
-                elif file_type == 'invoice':
-                    results['pytesseract'] = pytesseract_module.extract_invoice_data(filepath)
-            except Exception as e:
-                results['pytesseract'] = f"Error: {str(e)}"
+        # Decode images once, in memory, and share the array with every engine;
+        # decoding happens on the first cache miss and goes straight to grayscale
+        # when none of the selected engines needs colour
+        image = None
+        if not is_pdf and file_type != 'pdf':
+            image = ingest.lazy_decode(upload.data, engine_runner.grayscale_only(engines))
         
-        if ocr_method in ['all', 'easyocr']:
-            try:
-                if file_type == 'image':
-                    results['easyocr'] = easyocr_module.extract_text_from_image(filepath)
-                elif file_type == 'pdf':
-                    results['easyocr'] = easyocr_module.extract_text_from_pdf(filepath)
-                elif file_type == 'handwriting':
-                    results['easyocr'] = easyocr_module.recognize_handwriting(filepath)
-                elif file_type == 'invoice':
-                    results['easyocr'] = easyocr_module.extract_invoice_data(filepath)
-            except Exception as e:
-                results['easyocr'] = f"Error: {str(e)}"
+        # Optional page range for PDFs
+        first_page = request.form.get('first_page', type=int)
+        last_page = request.form.get('last_page', type=int)
+        page_range = (first_page, last_page) if first_page or last_page else None
         
-        if ocr_method in ['all', 'doctr']:
-            try:
-                if file_type == 'image':
-                    results['doctr'] = doctr_module.extract_text_from_image(filepath)
-                elif file_type == 'pdf':
-                    results['doctr'] = doctr_module.extract_text_from_pdf(filepath)
-                elif file_type == 'handwriting':
-                    results['doctr'] = doctr_module.recognize_handwriting(filepath)
-                elif file_type == 'invoice':
-                    results['doctr'] = doctr_module.extract_invoice_data(filepath)
-            except Exception as e:
-                results['doctr'] = f"Error: {str(e)}"
+        # PDFs are rasterized once per raster profile and the pages shared by every engine
+        page_store = None
+        if is_pdf:
+            page_store = pdf_pages.PageStore(filepath, first_page, last_page,
+                                             profiles=engine_runner.raster_profiles(engines))
+        
+        # Flagged requests run under the sampling profiler (see profiler.py)
+        profile, profile_skipped = start_profile(f"/process {filename}")
+        results = {}
+        try:
+            # Create preview image for PDF or get image URL
+            with metrics.span('preview'):
+                results['preview_url'] = create_preview_image(filepath, filename, digest, page_store)
+            
+            # Run the selected engines, concurrently unless sequential mode is requested
+            engine_results, timings = engine_runner.run_engines(
+                engines, file_type, filepath, parallel=(execution == 'parallel'),
+                cache=result_cache, file_digest=digest, page_range=page_range,
+                page_store=page_store, image=image)
+            results.update(engine_results)
+            results['timings'] = timings
+        finally:
+            if page_store is not None:
+                page_store.close()
+            if profile is not None:
+                results['profile'] = finish_profile(profile)
+        if profile_skipped:
+            results['profile'] = {'skipped': profile_skipped}
                 
         return jsonify(results)
     
     return jsonify({'error': 'File type not allowed'})
 
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    # Accept any number of files (and zip archives of them) under 'files' or 'file'
+    files = [file for file in request.files.getlist('files') + request.files.getlist('file') if file.filename]
+    if not files:
+        return jsonify({'error': 'No file part'}), 400
+    
+    ocr_method = request.form.get('ocr_method', 'all')
+    file_type = request.form.get('file_type', 'image')
+    if file_type not in engine_runner.FILE_TYPE_FUNCTIONS:
+        return jsonify({'error': f'Unknown file type: {file_type}'}), 400
+    execution = request.form.get('execution', app.config['OCR_EXECUTION'])
+    engines = engine_runner.selected_engines(ocr_method)
+    if not engines:
+        return jsonify({'error': f'Unknown OCR method: {ocr_method}'}), 400
+    
+    # Every batch gets its own upload directory, removed once the response is built
+    batch_dir = os.path.join(app.config['UPLOAD_FOLDER'], f"batch-{uuid.uuid4().hex}")
+    os.makedirs(batch_dir)
+    documents = []
+    try:
+        with metrics.span('upload'):
+            uploaded = []
+            skipped = {}
+            for index, file in enumerate(files):
+                filename = secure_filename(file.filename) or f"file_{index}"
+                filepath = os.path.join(batch_dir, f"{index}_{filename}")
+                if filename.lower().endswith('.zip'):
+                    file.save(filepath)
+                    archive_dir = os.path.join(batch_dir, f"{index}_archive")
+                    os.makedirs(archive_dir)
+                    try:
+                        members = ingest.extract_archive(filepath, archive_dir, ALLOWED_EXTENSIONS)
+                    except ValueError as e:
+                        return jsonify({'error': f'{filename}: {e}'}), 400
+                    uploaded.extend((f"{filename}/{member}", path) for member, path in members)
+                elif allowed_file(filename):
+                    file.save(filepath)
+                    uploaded.append((filename, filepath))
+                else:
+                    skipped[filename] = 'File type not allowed'
+        
+        # Results are keyed by file name, so repeated names get a numeric suffix
+        profiles = engine_runner.raster_profiles(engines)
+        for name, path in uploaded:
+            unique_name, copy = name, 1
+            while any(document.name == unique_name for document in documents):
+                copy += 1
+                unique_name = f"{name} ({copy})"
+            if path.lower().endswith('.pdf'):
+                documents.append(batch_runner.BatchDocument(unique_name, path, 'pdf', pdf_pages.PageStore(path, profiles=profiles)))
+            else:
+                document_type = 'image' if file_type == 'pdf' else file_type
+                documents.append(batch_runner.BatchDocument(unique_name, path, document_type, None))
+        
+        # Engines run side by side; images of all files share each engine's native batches
+        results, throughput = batch_runner.run_batch(engines, documents, parallel=(execution == 'parallel'),
+                                                     cache=result_cache)
+    finally:
+        for document in documents:
+            if document.page_store is not None:
+                document.page_store.close()
+        shutil.rmtree(batch_dir, ignore_errors=True)
+    
+    response = {'results': results, 'throughput': throughput}
+    if skipped:
+        response['skipped'] = skipped
+    return jsonify(response)
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    
+    # Validate the form before saving so a rejected job leaves no upload behind
+    ocr_method = request.form.get('ocr_method', 'all')
+    file_type = request.form.get('file_type', 'image')
+    if file_type not in engine_runner.FILE_TYPE_FUNCTIONS:
+        return jsonify({'error': f'Unknown file type: {file_type}'}), 400
+    engines = engine_runner.selected_engines(ocr_method)
+    if not engines:
+        return jsonify({'error': f'Unknown OCR method: {ocr_method}'}), 400
+    
+    # Give each job its own copy of the upload so later uploads can't overwrite it
+    filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    with metrics.span('upload'):
+        file.save(filepath)
+    
+    job_id = job_queue.enqueue(filepath, file_type, engines)
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('get_job', job_id=job_id)
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/ready')
+def readiness():
+    ready = engine_registry.is_ready()
+    return jsonify({'ready': ready, 'engines': engine_registry.status()}), 200 if ready else 503
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus text exposition format
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def profiling_denied():
+    """Error response for profiling routes: 404 while profiling is off, 403 for a wrong token"""
+    if not app.config['PROFILE_TOKEN']:
+        return jsonify({'error': 'Not found'}), 404
+    if not profile_token_ok(request.headers.get('X-OCR-Profile')):
+        return jsonify({'error': 'Invalid profiling token'}), 403
+    return None
+
+@app.route('/profiles/<path:filename>')
+def get_profile(filename):
+    # Profiles name the uploaded files, so they are served to token holders only
+    denied = profiling_denied()
+    if denied:
+        return denied
+    return send_from_directory(os.path.abspath(app.config['PROFILE_FOLDER']), filename)
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def profiling_toggle():
+    # Arm profiling of the next N /process requests and/or a random fraction of them
+    denied = profiling_denied()
+    if denied:
+        return denied
+    if request.method == 'GET':
+        return jsonify(profiler.toggle_state())
+    options = request.get_json(silent=True) or request.form
+    try:
+        state = profiler.configure(remaining=options.get('next'), sample_rate=options.get('sample_rate'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid profiling options: {e}'}), 400
+    return jsonify(state)
+
 # Clean up temporary files periodically (you might want to add a cleanup schedule)
 def cleanup_temp_files():
     temp_folder = app.config['TEMP_FOLDER']
@@ -126,4 +375,5 @@ def cleanup_temp_files():
             print(f'Error deleting {file_path}: {e}')
 
 if __name__ == '__main__':
+    job_queue.ensure_workers()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,195 @@
+import time
+from collections import namedtuple
+
+import engine_registry
+import engine_runner
+import ingest
+import metrics
+import ocr_cache
+import profiler
+import resolution
+
+# File types whose documents can share engine batches (PDFs batch their own pages, see run_engine_batch)
+BATCHABLE_TYPES = ('image',)
+
+# One document of a batch; `page_store` holds a PDF's rasterized pages (see pdf_pages.PageStore)
+BatchDocument = namedtuple('BatchDocument', ['name', 'path', 'file_type', 'page_store'])
+
+# What every engine shares for one document: the lazy decode and text height
+# of non-PDF documents (None for PDFs) and the content digest used by the cache
+Prepared = namedtuple('Prepared', ['image', 'text_height', 'digest'])
+
+def supports_batching(module):
+    """Whether an engine module can run several images in one call (extract_text_batch)"""
+    return callable(getattr(module, 'extract_text_batch', None))
+
+def _prepare(engines, documents, cache):
+    """Decode each document at most once for all engines, like engine_runner.run_engines does for one file"""
+    grayscale = engine_runner.grayscale_only(engines)
+    prepared = {}
+    for document in documents:
+        image = text_height = None
+        if document.file_type != 'pdf' and resolution.ENABLED:
+            image = ingest.lazy_decode(document.path, grayscale)
+            text_height = resolution.lazy_text_height(image)
+        digest = ocr_cache.file_digest(document.path) if cache is not None else None
+        prepared[document.name] = Prepared(image, text_height, digest)
+    return prepared
+
+def _engine_input(engine, document, prepared):
+    """The image run_engine would hand to extract_text_from_image: the shared decode, rescaled by the governor"""
+    if prepared.image is None:
+        return document.path
+    if resolution.target_for(engine):
+        return resolution.govern(prepared.image(), engine, prepared.text_height()).image
+    return prepared.image()
+
+def _run_batched(engine, module, documents, prepared):
+    """
+    Run image documents through module.extract_text_batch a few at a time.
+
+    Every image is prepared exactly as for /process, so the results match
+    it, but images of different documents share a call, so a pile of
+    single-page uploads becomes a few model calls instead of one per file.
+    Returns ({document name: result}, flushes).
+    """
+    batch_size = max(1, getattr(module, 'BATCH_PAGES', 1))
+    results = {}
+    pending = []
+    counts = {'flushes': 0}
+
+    def flush():
+        try:
+            texts = module.extract_text_batch([image for _, image in pending])
+            for (name, _), text in zip(pending, texts):
+                results[name] = text
+        except Exception as e:
+            for name, _ in pending:
+                results[name] = f"Error processing batch with {engine}: {str(e)}"
+        counts['flushes'] += 1
+        pending.clear()
+
+    for document in documents:
+        try:
+            pending.append((document.name, _engine_input(engine, document, prepared[document.name])))
+        except Exception as e:
+            results[document.name] = f"Error: {str(e)}"
+            continue
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+
+    for document in documents:
+        metrics.inc('ocr_engine_runs_total', engine=engine, file_type=document.file_type,
+                    outcome='error' if engine_runner.is_error(results[document.name]) else 'ok')
+    return results, counts['flushes']
+
+def run_engine_batch(engine, documents, prepared, cache=None):
+    """
+    Run one engine on every document of a batch.
+
+    Results are looked up in and stored to the cache like /process results.
+    Images go through the engine's native batching when it has one;
+    everything else (PDFs, whose engines batch their own pages, and engines
+    without batching) runs one document at a time through
+    engine_runner.run_engine. Returns ({document name: result}, stats);
+    stats count extract_text_batch calls as flushes, while the model calls
+    they turn into are the ocr_batch_calls_total metric.
+    """
+    start = time.perf_counter()
+    module = engine_registry.get_module(engine)
+
+    results = {}
+    keys = {}
+    pages = cached = 0
+    for document in documents:
+        if cache is None:
+            continue
+        governed = prepared[document.name].text_height is not None
+        keys[document.name] = engine_runner.cache_key(engine, document.file_type, prepared[document.name].digest,
+                                                      governed=governed)
+        hit = engine_runner.cache_lookup(cache, keys[document.name], document.file_type)
+        if hit is not None:
+            results[document.name] = hit[0]
+            cached += 1
+            metrics.inc('ocr_engine_runs_total', engine=engine, file_type=document.file_type, outcome='cached')
+
+    batched = [document for document in documents
+               if document.name not in results and document.file_type in BATCHABLE_TYPES] \
+        if supports_batching(module) else []
+    flushes = 0
+    if batched:
+        with metrics.in_flight('ocr_engine_in_flight', engine=engine):
+            batch_results, flushes = _run_batched(engine, module, batched, prepared)
+        for document in batched:
+            results[document.name] = batch_results[document.name]
+            pages += 1
+            if document.name in keys:
+                engine_runner.cache_store(cache, keys[document.name], document.file_type, results[document.name])
+
+    for document in documents:
+        if document.name in results:
+            continue
+        finished_pages = []
+        result, _ = engine_runner.run_engine(
+            engine, document.file_type, document.path, page_store=document.page_store,
+            on_page=lambda page_number, text: finished_pages.append((page_number, text)),
+            image=prepared[document.name].image, text_height=prepared[document.name].text_height)
+        if result is not None:
+            results[document.name] = result
+            pages += len(finished_pages) if document.file_type == 'pdf' else 1
+            if document.name in keys:
+                engine_runner.cache_store(cache, keys[document.name], document.file_type, result, finished_pages)
+
+    wall = time.perf_counter() - start
+    stats = {
+        'documents': len(results) - cached,
+        'cached': cached,
+        'pages': pages,
+        'flushes': flushes,
+        'batched': bool(batched),
+        'wall_ms': round(wall * 1000, 1),
+        'pages_per_sec': round(pages / wall, 2) if wall > 0 else None,
+    }
+    return results, stats
+
+def run_batch(engines, documents, parallel=True, cache=None):
+    """
+    Run several engines over a batch of documents.
+
+    Engines run concurrently on the shared engine pool (like
+    engine_runner.run_engines) and each one batches images internally.
+    Each document is decoded once for all engines and, with a cache,
+    results are reused and stored by content digest as /process does.
+    Returns (results, throughput): results maps each document name to
+    {engine: result}, throughput holds per-engine stats plus the totals of
+    the whole batch.
+    """
+    start = time.perf_counter()
+    prepared = _prepare(engines, documents, cache)
+    if parallel and len(engines) > 1:
+        futures = {engine: engine_runner.executor().submit(profiler.propagate(run_engine_batch), engine, documents,
+                                                           prepared, cache)
+                   for engine in engines}
+        outcomes = {engine: future.result() for engine, future in futures.items()}
+    else:
+        outcomes = {engine: run_engine_batch(engine, documents, prepared, cache) for engine in engines}
+
+    results = {document.name: {} for document in documents}
+    throughput = {'engines': {}}
+    for engine in engines:
+        engine_results, stats = outcomes[engine]
+        for name, result in engine_results.items():
+            results[name][engine] = result
+        throughput['engines'][engine] = stats
+
+    wall = time.perf_counter() - start
+    pages = sum(stats['pages'] for stats in throughput['engines'].values())
+    throughput.update({
+        'files': len(documents),
+        'engine_pages': pages,
+        'wall_ms': round(wall * 1000, 1),
+        'engine_pages_per_sec': round(pages / wall, 2) if wall > 0 else None,
+    })
+    return results, throughput
@@ -0,0 +1,363 @@
+"""
+Speed, memory and accuracy benchmark of the OCR engines over a corpus.
+
+Runs every engine on every document of a manifest (benchmarks/corpus by
+default) and reports p50/p95 latency, pages/sec, peak RSS and CER/WER for
+each engine x file_type. Every engine x document pair runs in a fresh
+subprocess, so peak RSS belongs to that engine alone and its model load is
+timed separately from recognition. Results are written as JSON; with
+--baseline they are compared to a saved run and regressions are flagged
+(exit status 1).
+
+    python benchmarks/engine_benchmark.py --repeat 5
+    python benchmarks/engine_benchmark.py --engines pytesseract text_box --baseline baseline.json
+    python benchmarks/engine_benchmark.py --baseline baseline.json --update-baseline
+"""
+import os
+import re
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import importlib
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_MANIFEST = os.path.join(ROOT, 'benchmarks', 'corpus', 'manifest.json')
+DEFAULT_OUTPUT = os.path.join(ROOT, 'benchmarks', 'results', 'latest.json')
+
+# Benchmarked engine -> module implementing it
+ENGINES = {
+    'pytesseract': 'pytesseract_module',
+    'text_box': 'text_box_pytesseract',
+    'sliding_window': 'sliding_window_pyteseeract',
+    'easyocr': 'easyocr_module',
+    'doctr': 'doctr_module',
+}
+
+# Entry points of engines that don't follow engine_runner.FILE_TYPE_FUNCTIONS
+HANDLER_OVERRIDES = {
+    'sliding_window': {
+        'image': 'combine_rows_and_global_approaches',
+        'handwriting': 'combine_rows_and_global_approaches',
+    },
+}
+
+# Default regression thresholds: relative for speed and memory, absolute for error rates
+LATENCY_TOLERANCE = 0.20
+MEMORY_TOLERANCE = 0.20
+ACCURACY_TOLERANCE = 0.02
+
+PAGE_MARKER = re.compile(r'^--- Page \d+ ---$', re.MULTILINE)
+
+def handler_name(engine, file_type):
+    import engine_runner
+    return HANDLER_OVERRIDES.get(engine, {}).get(file_type, engine_runner.FILE_TYPE_FUNCTIONS.get(file_type))
+
+def peak_rss_mb(who):
+    """Peak resident set size in MB (ru_maxrss is KB on Linux, bytes on macOS)"""
+    import resource
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_worker(engine, path, file_type, repeat, warmup):
+    """Time one engine on one document inside this (fresh) process"""
+    import resource
+    import engine_runner
+
+    module = importlib.import_module(ENGINES[engine])
+    handler = getattr(module, handler_name(engine, file_type) or '', None)
+    if handler is None:
+        return {'skipped': f"{engine} has no handler for {file_type}"}
+
+    load_ms = None
+    if hasattr(module, 'load_model'):
+        start = time.perf_counter()
+        module.load_model()
+        load_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    pages = 1
+    if file_type == 'pdf':
+        import pdf_pages
+        pages = pdf_pages.page_count(path)
+
+    latencies, text, error = [], None, None
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        result = handler(path)
+        elapsed = (time.perf_counter() - start) * 1000
+        if isinstance(result, dict):
+            result = result.get('text', '')
+        if engine_runner.is_error(result):
+            error = result
+            break
+        if i >= warmup:
+            latencies.append(round(elapsed, 1))
+        text = result
+
+    return {
+        'pages': pages,
+        'load_ms': load_ms,
+        'latencies_ms': latencies,
+        'text': text,
+        'error': error,
+        'peak_rss_mb': peak_rss_mb(resource.RUSAGE_SELF),
+        # Engines that shell out (the tesseract binary) use memory in child processes
+        'peak_child_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+def normalize(text):
+    """Drop page markers and collapse whitespace so layout differences don't count as errors"""
+    return " ".join(PAGE_MARKER.sub(' ', text or '').split())
+
+def edit_distance(reference, hypothesis):
+    """Levenshtein distance between two sequences of hashable tokens"""
+    if not reference or not hypothesis:
+        return max(len(reference), len(hypothesis))
+    ids = {}
+    ref = np.array([ids.setdefault(token, len(ids)) for token in reference])
+    hyp = np.array([ids.setdefault(token, len(ids)) for token in hypothesis])
+    offsets = np.arange(len(hyp) + 1)
+    row = offsets.copy()
+    for token in ref:
+        candidates = np.empty_like(row)
+        candidates[0] = row[0] + 1
+        # Substitution (or match) and deletion
+        candidates[1:] = np.minimum(row[:-1] + (hyp != token), row[1:] + 1)
+        # Insertions chain along the row: a running minimum of candidates[j] - j
+        row = np.minimum.accumulate(candidates - offsets) + offsets
+    return int(row[-1])
+
+def score(text, transcript):
+    """Character and word edit counts of an OCR result against its transcript"""
+    hypothesis, reference = normalize(text), normalize(transcript)
+    char_errors = edit_distance(reference, hypothesis)
+    word_errors = edit_distance(reference.split(), hypothesis.split())
+    ref_chars, ref_words = len(reference), len(reference.split())
+    return {
+        'char_errors': char_errors,
+        'ref_chars': ref_chars,
+        'word_errors': word_errors,
+        'ref_words': ref_words,
+        'cer': round(char_errors / ref_chars, 4) if ref_chars else None,
+        'wer': round(word_errors / ref_words, 4) if ref_words else None,
+    }
+
+def load_corpus(manifest_path):
+    """Return the manifest's documents with absolute paths and their transcripts"""
+    corpus_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    documents = []
+    for entry in manifest['documents']:
+        document = dict(entry)
+        document['abs_path'] = os.path.join(ROOT, entry['path'])
+        if entry.get('transcript'):
+            with open(os.path.join(corpus_dir, entry['transcript']), encoding='utf-8') as f:
+                document['reference'] = f.read()
+        documents.append(document)
+    return documents
+
+def run_case(engine, document, args):
+    """Run one engine x document in a subprocess and score its output"""
+    case = {'engine': engine, 'document': document['path'], 'file_type': document['file_type']}
+    env = dict(os.environ, PYTHONHASHSEED='0')
+    if args.threads:
+        env.update(OMP_NUM_THREADS=str(args.threads), OMP_THREAD_LIMIT=str(args.threads))
+
+    # A scratch working directory catches temporary files engines write next to themselves
+    with tempfile.TemporaryDirectory(prefix='ocr-bench-') as workdir:
+        result_path = os.path.join(workdir, 'result.json')
+        command = [sys.executable, os.path.abspath(__file__), '--worker', engine, document['abs_path'],
+                   document['file_type'], '--result', result_path,
+                   '--repeat', str(args.repeat), '--warmup', str(args.warmup)]
+        try:
+            process = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True,
+                                     timeout=args.timeout)
+        except subprocess.TimeoutExpired:
+            case['error'] = f"Error: timed out after {args.timeout}s"
+            return case
+        if process.returncode != 0 or not os.path.exists(result_path):
+            lines = process.stderr.strip().splitlines()
+            case['error'] = f"Error: {lines[-1] if lines else f'exit status {process.returncode}'}"
+            return case
+        with open(result_path, encoding='utf-8') as f:
+            case.update(json.load(f))
+
+    if case.get('text') is not None and document.get('reference') is not None:
+        case.update(score(case['text'], document['reference']))
+    return case
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 1) if values else None
+
+def summarize(cases):
+    """Aggregate cases per engine x file_type; error rates are micro-averaged over characters/words"""
+    groups = {}
+    for case in cases:
+        if 'skipped' not in case:
+            groups.setdefault(f"{case['engine']}/{case['file_type']}", []).append(case)
+
+    summary = {}
+    for key, group in sorted(groups.items()):
+        ok = [case for case in group if not case.get('error')]
+        latencies = [ms for case in ok for ms in case['latencies_ms']]
+        busy_seconds = sum(latencies) / 1000
+        pages = sum(case['pages'] * len(case['latencies_ms']) for case in ok)
+        scored = [case for case in ok if case.get('ref_chars')]
+        ref_chars = sum(case['ref_chars'] for case in scored)
+        ref_words = sum(case['ref_words'] for case in scored)
+        summary[key] = {
+            'documents': len(group),
+            'errors': len(group) - len(ok),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'pages_per_sec': round(pages / busy_seconds, 3) if busy_seconds else None,
+            'peak_rss_mb': max((case['peak_rss_mb'] for case in ok), default=None),
+            'load_ms': max((case['load_ms'] for case in ok if case.get('load_ms') is not None), default=None),
+            'cer': round(sum(case['char_errors'] for case in scored) / ref_chars, 4) if ref_chars else None,
+            'wer': round(sum(case['word_errors'] for case in scored) / ref_words, 4) if ref_words else None,
+        }
+    return summary
+
+def compare(summary, baseline, latency_tolerance=LATENCY_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE,
+            accuracy_tolerance=ACCURACY_TOLERANCE):
+    """Return the regressions of summary relative to a baseline summary"""
+    regressions = []
+
+    def flag(key, metric, before, after):
+        regressions.append({'group': key, 'metric': metric, 'baseline': before, 'current': after})
+
+    for key, current in summary.items():
+        previous = baseline.get(key)
+        # Only groups measured over the same documents are comparable
+        if not previous or previous['documents'] != current['documents']:
+            continue
+        if current['errors'] > previous['errors']:
+            flag(key, 'errors', previous['errors'], current['errors'])
+        for metric, tolerance in (('p50_ms', latency_tolerance), ('p95_ms', latency_tolerance),
+                                  ('peak_rss_mb', memory_tolerance)):
+            before, after = previous.get(metric), current.get(metric)
+            if before and after is not None and after > before * (1 + tolerance):
+                flag(key, metric, before, after)
+        before, after = previous.get('pages_per_sec'), current.get('pages_per_sec')
+        if before and after is not None and after < before * (1 - latency_tolerance):
+            flag(key, 'pages_per_sec', before, after)
+        for metric in ('cer', 'wer'):
+            before, after = previous.get(metric), current.get(metric)
+            if before is not None and after is not None and after > before + accuracy_tolerance:
+                flag(key, metric, before, after)
+    return regressions
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'env': {name: value for name, value in os.environ.items()
+                if name.startswith('OCR_') or name in ('OMP_NUM_THREADS', 'OMP_THREAD_LIMIT')},
+    }
+
+def print_summary(summary):
+    def cell(value, width, digits=1):
+        return f"{'-':>{width}}" if value is None else f"{value:>{width}.{digits}f}"
+
+    print(f"{'engine/file_type':<28} {'docs':>4} {'err':>3} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'pages/s':>8} {'RSS MB':>7} {'CER':>6} {'WER':>6}")
+    for key, row in summary.items():
+        print(f"{key:<28} {row['documents']:>4} {row['errors']:>3} {cell(row['p50_ms'], 9)} "
+              f"{cell(row['p95_ms'], 9)} {cell(row['pages_per_sec'], 8, 3)} {cell(row['peak_rss_mb'], 7)} "
+              f"{cell(row['cer'], 6, 3)} {cell(row['wer'], 6, 3)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='OCR engine benchmark')
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST, help='Corpus manifest (JSON)')
+    parser.add_argument('--documents', nargs='+', default=None,
+                        help='Only run these manifest paths (default: the whole corpus)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per engine x document')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed runs before timing')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Pin OMP_NUM_THREADS/OMP_THREAD_LIMIT for the engines (recommended for baselines)')
+    parser.add_argument('--timeout', type=int, default=1800, help='Seconds allowed per engine x document')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Where to write the JSON results')
+    parser.add_argument('--baseline', default=None, help='Saved results to compare against')
+    parser.add_argument('--update-baseline', action='store_true', help='Also write these results to --baseline')
+    parser.add_argument('--latency-tolerance', type=float, default=LATENCY_TOLERANCE)
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument('--accuracy-tolerance', type=float, default=ACCURACY_TOLERANCE)
+    # Internal: run one engine x document and write its measurements to --result
+    parser.add_argument('--worker', nargs=3, metavar=('ENGINE', 'PATH', 'FILE_TYPE'), help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        engine, path, file_type = args.worker
+        result = run_worker(engine, path, file_type, args.repeat, args.warmup)
+        with open(args.result, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return
+
+    documents = load_corpus(args.manifest)
+    if args.documents:
+        documents = [document for document in documents if document['path'] in args.documents]
+
+    cases = []
+    for document in documents:
+        for engine in args.engines:
+            case = run_case(engine, document, args)
+            status = case.get('error') or case.get('skipped') or f"p50 {percentile(case['latencies_ms'], 50)} ms"
+            print(f"{engine:<15} {document['path']:<20} {status}", file=sys.stderr)
+            cases.append(case)
+
+    summary = summarize(cases)
+    results = {
+        'environment': environment(),
+        'config': {'engines': args.engines, 'manifest': os.path.relpath(args.manifest, ROOT),
+                   'repeat': args.repeat, 'warmup': args.warmup, 'threads': args.threads},
+        'summary': summary,
+        'cases': cases,
+    }
+    print_summary(summary)
+
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(summary, baseline['summary'], args.latency_tolerance, args.memory_tolerance,
+                              args.accuracy_tolerance)
+        results['baseline'] = {'path': args.baseline, 'commit': baseline['environment'].get('commit'),
+                               'regressions': regressions}
+        print(f"\nCompared with {args.baseline} ({baseline['environment'].get('commit')}): "
+              f"{len(regressions)} regression(s)")
+        for regression in regressions:
+            print(f"  REGRESSION {regression['group']} {regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\nResults written to {args.output}")
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Baseline updated: {args.baseline}")
+
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark LineIndex against the full SequenceMatcher scan it replaces.
+
+Builds synthetic dense pages (row-based lines plus a noisy, locally
+reordered "global" transcript), checks that both implementations pick the
+same global line for every row line and reports their timings.
+
+    python benchmarks/line_alignment_benchmark.py --lines 100 200 400
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from line_alignment import LineIndex, similarity
+
+WORDS = ("the model attention encoder decoder layer network training results translation "
+         "sequence recurrent convolutional parallel task english german french score data "
+         "best performing mechanism simple architecture based solely dispensing entirely").split()
+
+def make_page(num_lines, seed=0, noise=0.08):
+    """Return (row_lines, global_lines) for a synthetic page"""
+    rng = random.Random(seed)
+    row_lines = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 16))) for _ in range(num_lines)]
+
+    global_lines = []
+    for line in row_lines:
+        chars = [rng.choice("abcdefghijklmnopqrstuvwxyz ") if rng.random() < noise else c for c in line]
+        global_lines.append("".join(chars))
+    # Multi-column pages come back from the global pass slightly out of order
+    for i in range(0, num_lines - 1, 5):
+        if rng.random() < 0.5:
+            global_lines[i], global_lines[i + 1] = global_lines[i + 1], global_lines[i]
+    # Some lines only exist in one transcript
+    global_lines.extend(" ".join(rng.choice(WORDS) for _ in range(6)) for _ in range(num_lines // 10))
+    return row_lines, global_lines
+
+def full_scan(row_lines, global_lines):
+    """The original quadratic matching loop"""
+    matches = []
+    for row_line in row_lines:
+        best_match, best_ratio = None, 0
+        for i, gl_line in enumerate(global_lines):
+            if not gl_line.strip():
+                continue
+            ratio = similarity(row_line, gl_line)
+            if ratio > best_ratio and ratio > 0.5:
+                best_ratio, best_match = ratio, i
+        matches.append(best_match)
+    return matches
+
+def indexed(row_lines, global_lines):
+    index = LineIndex(global_lines)
+    return [index.best_match(line, 0.5, position=k / max(1, len(row_lines) - 1))[0]
+            for k, line in enumerate(row_lines)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Line alignment benchmark')
+    parser.add_argument('--lines', type=int, nargs='+', default=[50, 100, 200, 400])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'lines':>6} {'full scan (s)':>14} {'indexed (s)':>12} {'speedup':>8} {'same':>5}")
+    for num_lines in args.lines:
+        row_lines, global_lines = make_page(num_lines, args.seed)
+
+        start = time.perf_counter()
+        expected = full_scan(row_lines, global_lines)
+        scan_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = indexed(row_lines, global_lines)
+        index_time = time.perf_counter() - start
+
+        print(f"{num_lines:>6} {scan_time:>14.3f} {index_time:>12.3f} "
+              f"{scan_time / index_time:>7.1f}x {str(expected == actual):>5}")
+
+if __name__ == "__main__":
+    main()
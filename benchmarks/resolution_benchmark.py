@@ -0,0 +1,149 @@
+"""
+Accuracy and latency of the resolution governor over a corpus.
+
+Runs every governed engine on every image document of a manifest
+(benchmarks/corpus by default) in three modes: off (the decoded upload as
+is), shrink (the default governor, which only scales large text down) and
+upscale (OCR_RESOLUTION_UPSCALE=1). Each mode reports the planned scale,
+p50 latency including the rescale, and CER/WER against the transcript, plus
+per-engine totals, so a change to TARGET_TEXT_HEIGHT or to the default mode
+has to show a net win here.
+
+    python benchmarks/resolution_benchmark.py --repeat 3
+    python benchmarks/resolution_benchmark.py --engines pytesseract --output resolution.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import engine_runner
+import ingest
+import resolution
+from engine_benchmark import DEFAULT_MANIFEST, ENGINES, load_corpus, score
+
+# Mode -> (resolution.ENABLED, resolution.UPSCALE)
+MODES = {
+    'off': (False, False),
+    'shrink': (True, False),
+    'upscale': (True, True),
+}
+
+def planned_scale(engine, image, text_height, mode):
+    """Scale the governor applies to an image in a mode"""
+    resolution.ENABLED, resolution.UPSCALE = MODES[mode]
+    return resolution.plan_scale(text_height, resolution.target_for(engine), image.shape[:2])
+
+def run_mode(engine, handler, image, text_height, mode, repeat, warmup):
+    """Time one engine on one decoded image in a governor mode; returns (latencies_ms, text or error)"""
+    resolution.ENABLED, resolution.UPSCALE = MODES[mode]
+    latencies, text = [], None
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        rescale = resolution.govern(image, engine, text_height)
+        text = handler(rescale.image)
+        elapsed = (time.perf_counter() - start) * 1000
+        if engine_runner.is_error(text):
+            break
+        if i >= warmup:
+            latencies.append(round(elapsed, 1))
+    return latencies, text
+
+def run_case(engine, document, args):
+    """Run one engine x document in every mode and score each output"""
+    case = {'engine': engine, 'document': document['path'], 'file_type': document['file_type'], 'modes': {}}
+    module = importlib.import_module(ENGINES[engine])
+    handler = getattr(module, engine_runner.FILE_TYPE_FUNCTIONS[document['file_type']], None)
+    if handler is None:
+        case['skipped'] = f"{engine} has no handler for {document['file_type']}"
+        return case
+
+    image = ingest.lazy_decode(document['abs_path'], getattr(module, 'INPUT_MODE', 'color') == 'gray')()
+    text_height = resolution.estimate_text_height(image)
+    case['text_height'] = round(text_height, 1) if text_height else None
+    for mode in MODES:
+        result = case['modes'][mode] = {'scale': round(planned_scale(engine, image, text_height, mode), 3)}
+        try:
+            latencies, text = run_mode(engine, handler, image, text_height, mode, args.repeat, args.warmup)
+        except Exception as e:
+            text = f"Error: {str(e)}"
+        if engine_runner.is_error(text):
+            result['error'] = text
+            continue
+        result.update(latencies_ms=latencies, p50_ms=round(float(np.percentile(latencies, 50)), 1))
+        if document.get('reference') is not None:
+            result.update(score(text, document['reference']))
+    return case
+
+def summarize(cases):
+    """Per engine x mode: summed p50 latency and CER/WER micro-averaged over characters/words"""
+    summary = {}
+    for case in cases:
+        for mode, result in case.get('modes', {}).items():
+            row = summary.setdefault(f"{case['engine']}/{mode}", {
+                'documents': 0, 'errors': 0, 'total_p50_ms': 0.0,
+                'char_errors': 0, 'ref_chars': 0, 'word_errors': 0, 'ref_words': 0})
+            row['documents'] += 1
+            if result.get('error'):
+                row['errors'] += 1
+                continue
+            row['total_p50_ms'] = round(row['total_p50_ms'] + result['p50_ms'], 1)
+            for key in ('char_errors', 'ref_chars', 'word_errors', 'ref_words'):
+                row[key] += result.get(key) or 0
+    for row in summary.values():
+        row['cer'] = round(row['char_errors'] / row['ref_chars'], 4) if row['ref_chars'] else None
+        row['wer'] = round(row['word_errors'] / row['ref_words'], 4) if row['ref_words'] else None
+    return summary
+
+def print_cases(cases):
+    def cell(value, width, digits=1):
+        return f"{'-':>{width}}" if value is None else f"{value:>{width}.{digits}f}"
+
+    header = " ".join(f"{mode + ' scale':>13} {'ms':>8} {'CER':>6}" for mode in MODES)
+    print(f"{'engine':<12} {'document':<18} {'height':>6} {header}")
+    for case in cases:
+        if case.get('skipped'):
+            continue
+        cells = []
+        for mode in MODES:
+            result = case['modes'][mode]
+            latency = f"{'error':>8}" if result.get('error') else cell(result.get('p50_ms'), 8)
+            cells.append(f"{cell(result['scale'], 13, 3)} {latency} {cell(result.get('cer'), 6, 3)}")
+        print(f"{case['engine']:<12} {case['document']:<18} {cell(case.get('text_height'), 6)} {' '.join(cells)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Resolution governor benchmark')
+    parser.add_argument('--engines', nargs='+', choices=sorted(resolution.TARGET_TEXT_HEIGHT),
+                        default=sorted(resolution.TARGET_TEXT_HEIGHT))
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST, help='Corpus manifest (JSON)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per engine x document x mode')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed runs before timing')
+    parser.add_argument('--output', default=None, help='Also write the JSON results here')
+    args = parser.parse_args()
+
+    documents = [document for document in load_corpus(args.manifest) if document['file_type'] != 'pdf']
+    cases = [run_case(engine, document, args) for document in documents for engine in args.engines]
+    summary = summarize(cases)
+
+    print_cases(cases)
+    print()
+    print(f"{'engine/mode':<24} {'docs':>4} {'err':>3} {'sum p50 ms':>11} {'CER':>6} {'WER':>6}")
+    for key, row in sorted(summary.items()):
+        cer = '-' if row['cer'] is None else f"{row['cer']:.3f}"
+        wer = '-' if row['wer'] is None else f"{row['wer']:.3f}"
+        print(f"{key:<24} {row['documents']:>4} {row['errors']:>3} {row['total_p50_ms']:>11.1f} {cer:>6} {wer:>6}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'cases': cases, 'summary': summary}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,104 +1,169 @@
-import os
 import cv2
 import numpy as np
 import json
 import re
-from doctr.models import ocr_predictor
-from doctr.io import DocumentFile
-import pdf2image
+import threading
 
-# Initialize the DocTR model
-# Using the default model
-model = ocr_predictor(pretrained=True)
+import metrics
+from micro_batcher import MicroBatcher, record_batch_call
+from pdf_pages import pdf_page_arrays, raster_profile
+from ingest import as_bgr, as_gray
+
+# Engine label of this module's metrics
+ENGINE_NAME = 'doctr'
+
+# Settings that affect OCR output (part of the result cache key)
+ENGINE_CONFIG = {'pretrained': True}
+
+# Bump whenever a code change can alter this engine's output, so cached results are not reused
+PIPELINE_VERSION = 1
+
+# How PDF pages are rasterized for this engine: RGB at 144 DPI, like DocTR's own PDF loader
+RASTER_PROFILE = raster_profile(dpi=144)
+
+# Most pages passed to the model per call
+BATCH_PAGES = 4
+
+# The model works on colour input, so uploads must be decoded in colour
+INPUT_MODE = 'color'
+
+# The DocTR model is created on first use (or by load_model) rather than at
+# import time, so processes that never use DocTR don't pay for the model
+_model = None
+_model_lock = threading.Lock()
+
+def load_model():
+    """Load the DocTR predictor if needed and return it"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from doctr.models import ocr_predictor
+                # Using the default model
+                _model = ocr_predictor(pretrained=ENGINE_CONFIG['pretrained'])
+    return _model
+
+def is_loaded():
+    """Whether the DocTR predictor has been loaded"""
+    return _model is not None
+
+def _predict_pages(pages):
+    """Run the model once on a list of RGB pages and return the exported page dicts"""
+    with metrics.span('inference', ENGINE_NAME):
+        exported = load_model()([np.ascontiguousarray(page) for page in pages]).export()['pages']
+    record_batch_call(ENGINE_NAME, len(pages))
+    return exported
+
+# Pages from concurrent requests are coalesced into shared model calls
+_batcher = MicroBatcher(ENGINE_NAME, _predict_pages, max_batch_size=BATCH_PAGES)
+
+def _load_document(image):
+    """Return a DocTR document (list of RGB pages) for a file path or decoded BGR array"""
+    if isinstance(image, np.ndarray):
+        return [cv2.cvtColor(as_bgr(image), cv2.COLOR_BGR2RGB)]
+    from doctr.io import DocumentFile
+    return DocumentFile.from_images(image)
+
+def _document_text(pages):
+    """Join the words of exported pages, with a newline token after each line"""
+    # Extract text from the JSON output
+    extracted_text = []
+    
+    for page in pages:
+        for block in page['blocks']:
+            for line in block['lines']:
+                for word in line['words']:
+                    extracted_text.append(word['value'])
+                extracted_text.append('\n')  # Add newline after each line
+    
+    return " ".join(extracted_text)
 
 def extract_text_from_image(image_path):
-    """Extract text from an image using DocTR"""
+    """Extract text from an image (file path or decoded array) using DocTR"""
     try:
-        # Load document using DocTR's DocumentFile
-        doc = DocumentFile.from_images(image_path)
+        # Load document (or use the decoded array)
+        with metrics.span('preprocess', ENGINE_NAME):
+            doc = _load_document(image_path)
         
-        # Run the OCR prediction
-        result = model(doc)
-        
-        # Extract text using DocTR's built-in method
-        json_output = result.export()
-        
-        # Extract text from the JSON output
-        extracted_text = []
+        # Run the OCR prediction (batched with other requests' pages)
+        pages = _batcher.map(doc)
         
-        for page in json_output['pages']:
-            for block in page['blocks']:
-                for line in block['lines']:
-                    for word in line['words']:
-                        extracted_text.append(word['value'])
-                    extracted_text.append('\n')  # Add newline after each line
-        
-        return " ".join(extracted_text)
+        return _document_text(pages)
     except Exception as e:
         return f"Error processing image with DocTR: {str(e)}"
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from a PDF using DocTR"""
-    try:
-        # Load document using DocTR's DocumentFile
-        doc = DocumentFile.from_pdf(pdf_path)
-        
-        # Run the OCR prediction
-        result = model(doc)
-        
-        # Extract text using DocTR's built-in method
-        json_output = result.export()
+def extract_text_batch(images):
+    """Extract the text of several images (file paths or decoded arrays), each as extract_text_from_image would"""
+    # Load documents (or use the decoded arrays)
+    with metrics.span('preprocess', ENGINE_NAME):
+        docs = [_load_document(image) for image in images]
+    
+    # Run the OCR prediction on the pages of all images at once
+    exported = iter(_batcher.map([page for doc in docs for page in doc]))
+    return [_document_text([next(exported) for _ in doc]) for doc in docs]
+
+def _page_text(page):
+    """Join the words of one exported page, line by line"""
+    page_text = []
+    for block in page['blocks']:
+        for line in block['lines']:
+            line_text = []
+            for word in line['words']:
+                line_text.append(word['value'])
+            page_text.append(" ".join(line_text))
+    return ' '.join(page_text)
+
+def _flush_pdf_batch(batch, all_text, on_page):
+    """Run the model on a batch of (page_number, RGB page) pairs and collect page text"""
+    texts = [_page_text(page) for page in _batcher.map([page for _, page in batch])]
+    
+    for (page_number, _), page_text in zip(batch, texts):
+        all_text.append(f"--- Page {page_number} ---\n{page_text}")
         
-        # Extract text from the JSON output
+        # Report the finished page to the caller
+        if on_page:
+            on_page(page_number, page_text)
+
+def extract_text_from_pdf(pdf_path, on_page=None, first_page=None, last_page=None, pages=None):
+    """Extract text from a PDF (optionally a page range) using DocTR"""
+    try:
         all_text = []
+        batch = []
         
-        for page_idx, page in enumerate(json_output['pages']):
-            page_text = []
-            for block in page['blocks']:
-                for line in block['lines']:
-                    line_text = []
-                    for word in line['words']:
-                        line_text.append(word['value'])
-                    page_text.append(" ".join(line_text))
-            
-            all_text.append(f"--- Page {page_idx+1} ---\n{' '.join(page_text)}")
+        # Use the shared pages if given, otherwise rasterize a small window at a time,
+        # and run the model on a few pages at a time to keep memory bounded
+        for page_number, page in pdf_page_arrays(pdf_path, first_page, last_page, RASTER_PROFILE, pages):
+            batch.append((page_number, page))
+            if len(batch) >= BATCH_PAGES:
+                _flush_pdf_batch(batch, all_text, on_page)
+                batch = []
+        if batch:
+            _flush_pdf_batch(batch, all_text, on_page)
         
         return "\n\n".join(all_text)
     except Exception as e:
         return f"Error processing PDF with DocTR: {str(e)}"
 
 def recognize_handwriting(image_path):
-    """Recognize handwritten text from an image using DocTR"""
+    """Recognize handwritten text from an image (file path or decoded array) using DocTR"""
     try:
-        # Load image
-        img = cv2.imread(image_path)
-        
         # Apply preprocessing for handwriting
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Apply adaptive thresholding
-        binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                      cv2.THRESH_BINARY, 11, 2)
+        # Load image (or use the decoded array) as grayscale
+        with metrics.span('preprocess', ENGINE_NAME):
+            gray = as_gray(image_path)
         
-        # Save the preprocessed image temporarily
-        temp_path = "temp_handwriting.png"
-        cv2.imwrite(temp_path, binary)
+            # Apply adaptive thresholding
+            binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                          cv2.THRESH_BINARY, 11, 2)
         
-        # Process with DocTR
-        doc = DocumentFile.from_images(temp_path)
-        result = model(doc)
-        
-        # Clean up the temporary file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        # Process with DocTR, passing the preprocessed image as an RGB page
+        # instead of round-tripping it through a temporary file
+        pages = _batcher.map([cv2.cvtColor(binary, cv2.COLOR_GRAY2RGB)])
         
         # Extract text
-        json_output = result.export()
-        
         extracted_text = []
         
-        for page in json_output['pages']:
+        for page in pages:
             for block in page['blocks']:
                 for line in block['lines']:
                     line_text = []
@@ -111,21 +176,19 @@ def recognize_handwriting(image_path):
         return f"Error recognizing handwriting with DocTR: {str(e)}"
 
 def extract_invoice_data(image_path):
-    """Extract structured data from an invoice image using DocTR"""
+    """Extract structured data from an invoice image (file path or decoded array) using DocTR"""
     try:
-        # Load document
-        doc = DocumentFile.from_images(image_path)
-        
-        # Run the OCR prediction
-        result = model(doc)
+        # Load document (or use the decoded array)
+        with metrics.span('preprocess', ENGINE_NAME):
+            doc = _load_document(image_path)
         
-        # Extract text using DocTR's built-in method
-        json_output = result.export()
+        # Run the OCR prediction (batched with other requests' pages)
+        pages = _batcher.map(doc)
         
         # Extract all text
         text_lines = []
         
-        for page in json_output['pages']:
+        for page in pages:
             for block in page['blocks']:
                 for line in block['lines']:
                     line_text = []
@@ -136,38 +199,39 @@ def extract_invoice_data(image_path):
         full_text = " ".join(text_lines)
         
         # Parse invoice data
-        invoice_data = {
-            'invoice_number': None,
-            'date': None,
-            'total_amount': None,
-            'vendor': None,
-            'items': []
-        }
-        
-        # Extract invoice number
-        invoice_match = re.search(r'(?i)invoice\s*(?:#|number|num|no|no\.)\s*[:\s]?\s*([a-zA-Z0-9\-]+)', full_text)
-        if invoice_match:
-            invoice_data['invoice_number'] = invoice_match.group(1)
-        
-        # Extract date
-        date_match = re.search(r'(?i)(?:date|dated)?\s*[:\s]?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})', full_text)
-        if date_match:
-            invoice_data['date'] = date_match.group(1)
-        
-        # Extract total amount
-        amount_match = re.search(r'(?i)(?:total|amount|sum)?\s*(?:due|:)?\s*[\$£€]?\s*(\d+[.,]\d{2})', full_text)
-        if amount_match:
-            invoice_data['total_amount'] = amount_match.group(1)
-        
-        # Try to extract vendor name (typically at the top of the invoice)
-        if text_lines:
-            invoice_data['vendor'] = text_lines[0]
-        
-        # Look for potential items in the invoice
-        # This is a simplified approach - a real implementation would be more complex
-        for line in text_lines:
-            if re.search(r'\d+\.\d{2}', line):  # Look for price-like patterns
-                invoice_data['items'].append(line)
+        with metrics.span('parse', ENGINE_NAME):
+            invoice_data = {
+                'invoice_number': None,
+                'date': None,
+                'total_amount': None,
+                'vendor': None,
+                'items': []
+            }
+        
+            # Extract invoice number
+            invoice_match = re.search(r'(?i)invoice\s*(?:#|number|num|no|no\.)\s*[:\s]?\s*([a-zA-Z0-9\-]+)', full_text)
+            if invoice_match:
+                invoice_data['invoice_number'] = invoice_match.group(1)
+        
+            # Extract date
+            date_match = re.search(r'(?i)(?:date|dated)?\s*[:\s]?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})', full_text)
+            if date_match:
+                invoice_data['date'] = date_match.group(1)
+        
+            # Extract total amount
+            amount_match = re.search(r'(?i)(?:total|amount|sum)?\s*(?:due|:)?\s*[\$£€]?\s*(\d+[.,]\d{2})', full_text)
+            if amount_match:
+                invoice_data['total_amount'] = amount_match.group(1)
+        
+            # Try to extract vendor name (typically at the top of the invoice)
+            if text_lines:
+                invoice_data['vendor'] = text_lines[0]
+        
+            # Look for potential items in the invoice
+            # This is a simplified approach - a real implementation would be more complex
+            for line in text_lines:
+                if re.search(r'\d+\.\d{2}', line):  # Look for price-like patterns
+                    invoice_data['items'].append(line)
         
         return json.dumps(invoice_data, indent=2)
     except Exception as e:
@@ -1,74 +1,225 @@
 import os
 import cv2
 import numpy as np
-import easyocr
-import pdf2image
+from pdf_pages import pdf_page_arrays, raster_profile
+from ingest import as_bgr, as_gray
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
-# Initialize EasyOCR reader with English language
-reader = easyocr.Reader(['en'])
+import metrics
+from micro_batcher import MicroBatcher, record_batch_call
+
+# Engine label of this module's metrics
+ENGINE_NAME = 'easyocr'
+
+# Settings that affect OCR output (part of the result cache key)
+ENGINE_CONFIG = {'languages': ['en']}
+
+# Bump whenever a code change can alter this engine's output, so cached results are not reused
+PIPELINE_VERSION = 1
+
+# How PDF pages are rasterized for this engine (RGB for the detector)
+RASTER_PROFILE = raster_profile(dpi=200)
+
+# Images per extract_text_batch call (batch_runner)
+BATCH_PAGES = 8
+
+# PDF mode: pages per batch, threads preparing the next batch's canvases, and the
+# longest side of the common canvas (EasyOCR's own canvas_size default). The
+# micro-batcher is built for the larger of the two batch sizes, so a PDF batch
+# really goes through readtext_batched in one call
+PDF_BATCH_SIZE = int(os.environ.get('OCR_EASYOCR_PDF_BATCH_SIZE', BATCH_PAGES))
+PDF_WORKERS = int(os.environ.get('OCR_EASYOCR_PDF_WORKERS', 2))
+CANVAS_MAX_SIDE = 2560
+
+# The detector works on colour input, so uploads must be decoded in colour
+INPUT_MODE = 'color'
+
+# The EasyOCR reader is created on first use (or by load_model) rather than at
+# import time, so processes that never use EasyOCR don't pay for the model
+_reader = None
+_reader_lock = threading.Lock()
+
+def load_model():
+    """Load the EasyOCR reader if needed and return it"""
+    global _reader
+    if _reader is None:
+        with _reader_lock:
+            if _reader is None:
+                import easyocr
+                # Initialize EasyOCR reader with English language
+                _reader = easyocr.Reader(ENGINE_CONFIG['languages'])
+    return _reader
+
+def is_loaded():
+    """Whether the EasyOCR reader has been loaded"""
+    return _reader is not None
+
+def _readtext_images(images):
+    """
+    Run readtext_batched on a list of images and return the results of each.
+
+    readtext_batched only takes equally sized images, so images are grouped
+    by shape and each group goes through the model in one call (and counts
+    as one call in the batch metrics).
+    """
+    groups = {}
+    for index, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(index)
+    
+    results = [None] * len(images)
+    for indices in groups.values():
+        with metrics.span('inference', ENGINE_NAME):
+            batch_results = load_model().readtext_batched([images[i] for i in indices])
+        record_batch_call(ENGINE_NAME, len(indices))
+        for index, image_results in zip(indices, batch_results):
+            results[index] = image_results
+    return results
+
+# Images from concurrent requests are coalesced into shared readtext_batched calls
+_batcher = MicroBatcher(ENGINE_NAME, _readtext_images, max_batch_size=max(BATCH_PAGES, PDF_BATCH_SIZE))
+
+def _image_text(results):
+    """Join the words of one readtext result, one per line"""
+    # Extract text
+    extracted_text = []
+    for (bbox, text, prob) in results:
+        extracted_text.append(text)
+    
+    return "\n".join(extracted_text)
 
 def extract_text_from_image(image_path):
-    """Extract text from an image using EasyOCR"""
+    """Extract text from an image (file path or decoded array) using EasyOCR"""
     try:
-        # Load image
-        img = cv2.imread(image_path)
+        # Load image (or use the decoded array)
+        with metrics.span('preprocess', ENGINE_NAME):
+            img = as_bgr(image_path)
         
         # Run EasyOCR
-        results = reader.readtext(img)
+        results = _batcher.submit(img).result()
         
-        # Extract text
-        extracted_text = []
-        for (bbox, text, prob) in results:
-            extracted_text.append(text)
-        
-        return "\n".join(extracted_text)
+        return _image_text(results)
     except Exception as e:
         return f"Error processing image with EasyOCR: {str(e)}"
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from a PDF using EasyOCR"""
-    try:
-        # Convert PDF to images
-        images = pdf2image.convert_from_path(pdf_path)
-        all_text = []
+def extract_text_batch(images):
+    """Extract the text of several images (file paths or decoded arrays), each as extract_text_from_image would"""
+    # Load images (or use the decoded arrays)
+    with metrics.span('preprocess', ENGINE_NAME):
+        imgs = [as_bgr(image) for image in images]
+    
+    # Run EasyOCR on all images at once
+    return [_image_text(results) for results in _batcher.map(imgs)]
+
+def _common_canvas(shapes):
+    """(height, width) of a canvas every page of a batch fits on, capped at CANVAS_MAX_SIDE"""
+    height = max(shape[0] for shape in shapes)
+    width = max(shape[1] for shape in shapes)
+    scale = min(1.0, CANVAS_MAX_SIDE / max(height, width))
+    return int(height * scale), int(width * scale)
+
+def _fit_to_canvas(page, canvas_shape):
+    """Scale a page down to fit the canvas, pad it with white and return (canvas, scale)"""
+    with metrics.span('preprocess', ENGINE_NAME):
+        height, width = page.shape[:2]
+        scale = min(1.0, canvas_shape[0] / height, canvas_shape[1] / width)
+        if scale < 1.0:
+            page = cv2.resize(page, (max(1, int(width * scale)), max(1, int(height * scale))),
+                              interpolation=cv2.INTER_AREA)
+        canvas = np.full(canvas_shape + page.shape[2:], 255, dtype=page.dtype)
+        canvas[:page.shape[0], :page.shape[1]] = page
+    return canvas, scale
+
+def _page_words(results, scale):
+    """Words of one readtext result with boxes mapped back to page pixels"""
+    return [{
+        'text': text,
+        'confidence': round(float(prob), 4),
+        'box': [[int(round(float(x) / scale)), int(round(float(y) / scale))] for x, y in bbox],
+    } for (bbox, text, prob) in results]
+
+def extract_pdf_pages(pdf_path, first_page=None, last_page=None, pages=None, batch_size=PDF_BATCH_SIZE,
+                      workers=PDF_WORKERS, on_page=None):
+    """
+    Run EasyOCR on a PDF in page batches and return one dict per page.
+
+    The pages of a batch are scaled down if needed and padded onto a common
+    canvas, so the whole batch goes through readtext_batched together instead
+    of paying detector and recognizer setup once per page. `workers` threads
+    prepare the next batch's canvases while the current batch is recognized.
+    Each page dict holds the page number, size, text and its words with
+    confidence and a four-point box in page pixels (at RASTER_PROFILE.dpi).
+    A batch_size above the micro-batcher's max_batch_size (set from
+    OCR_EASYOCR_PDF_BATCH_SIZE) is split into calls of that many pages.
+    """
+    page_iter = pdf_page_arrays(pdf_path, first_page, last_page, RASTER_PROFILE, pages)
+    pages_out = []
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='easyocr-canvas') as pool:
+        def next_batch():
+            batch = list(islice(page_iter, max(1, batch_size)))
+            if not batch:
+                return batch, []
+            canvas_shape = _common_canvas([page.shape for _, page in batch])
+            return batch, [pool.submit(_fit_to_canvas, page, canvas_shape) for _, page in batch]
         
-        # Process each page
-        for i, image in enumerate(images):
-            # Convert PIL image to numpy array
-            np_image = np.array(image)
+        batch, prepared = next_batch()
+        while batch:
+            canvases = [future.result() for future in prepared]
+            # Queue the next batch's canvases before recognizing this one
+            following = next_batch()
             
-            # Run EasyOCR
-            results = reader.readtext(np_image)
+            # Run EasyOCR on the whole batch at once
+            batch_results = _batcher.map([canvas for canvas, _ in canvases])
             
-            # Extract text
-            page_text = []
-            for (bbox, text, prob) in results:
-                page_text.append(text)
-            
-            all_text.append(f"--- Page {i+1} ---\n{' '.join(page_text)}")
+            for (page_number, page), (_, scale), results in zip(batch, canvases, batch_results):
+                words = _page_words(results, scale)
+                page_text = ' '.join(word['text'] for word in words)
+                pages_out.append({
+                    'page': page_number,
+                    'width': page.shape[1],
+                    'height': page.shape[0],
+                    'text': page_text,
+                    'words': words,
+                })
+                
+                # Report the finished page to the caller
+                if on_page:
+                    on_page(page_number, page_text)
+            batch, prepared = following
+    
+    return pages_out
+
+def extract_text_from_pdf(pdf_path, on_page=None, first_page=None, last_page=None, pages=None):
+    """Extract text from a PDF (optionally a page range) using EasyOCR"""
+    try:
+        # Use the shared pages if given, otherwise rasterize a small window at a time,
+        # and recognize them in batches on a common canvas
+        all_text = []
+        for page in extract_pdf_pages(pdf_path, first_page, last_page, pages, on_page=on_page):
+            all_text.append(f"--- Page {page['page']} ---\n{page['text']}")
         
         return "\n\n".join(all_text)
     except Exception as e:
         return f"Error processing PDF with EasyOCR: {str(e)}"
 
 def recognize_handwriting(image_path):
-    """Recognize handwritten text from an image using EasyOCR"""
+    """Recognize handwritten text from an image (file path or decoded array) using EasyOCR"""
     try:
-        # Load image
-        img = cv2.imread(image_path)
-        
         # Apply preprocessing for handwriting
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Load image (or use the decoded array) as grayscale
+        with metrics.span('preprocess', ENGINE_NAME):
+            gray = as_gray(image_path)
         
-        # Apply contrast enhancement
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(gray)
+            # Apply contrast enhancement
+            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            enhanced = clahe.apply(gray)
         
         # Run EasyOCR with enhanced image
-        results = reader.readtext(enhanced)
+        results = _batcher.submit(enhanced).result()
         
         # Extract text
         extracted_text = []
@@ -80,13 +231,14 @@ def recognize_handwriting(image_path):
         return f"Error recognizing handwriting with EasyOCR: {str(e)}"
 
 def extract_invoice_data(image_path):
-    """Extract structured data from an invoice image using EasyOCR"""
+    """Extract structured data from an invoice image (file path or decoded array) using EasyOCR"""
     try:
-        # Load image
-        img = cv2.imread(image_path)
+        # Load image (or use the decoded array)
+        with metrics.span('preprocess', ENGINE_NAME):
+            img = as_bgr(image_path)
         
         # Run EasyOCR
-        results = reader.readtext(img)
+        results = _batcher.submit(img).result()
         
         # Extract all text
         text_lines = []
@@ -99,42 +251,43 @@ def extract_invoice_data(image_path):
         full_text = " ".join(text_lines)
         
         # Parse invoice data
-        invoice_data = {
-            'invoice_number': None,
-            'date': None,
-            'total_amount': None,
-            'vendor': None,
-            'items': []
-        }
-        
-        # Extract invoice number
-        invoice_match = re.search(r'(?i)invoice\s*(?:#|number|num|no|no\.)\s*[:\s]?\s*([a-zA-Z0-9\-]+)', full_text)
-        if invoice_match:
-            invoice_data['invoice_number'] = invoice_match.group(1)
-        
-        # Extract date
-        date_match = re.search(r'(?i)(?:date|dated)?\s*[:\s]?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})', full_text)
-        if date_match:
-            invoice_data['date'] = date_match.group(1)
-        
-        # Extract total amount
-        amount_match = re.search(r'(?i)(?:total|amount|sum)?\s*(?:due|:)?\s*[\$£€]?\s*(\d+[.,]\d{2})', full_text)
-        if amount_match:
-            invoice_data['total_amount'] = amount_match.group(1)
-        
-        # Try to extract vendor name (typically at the top of the invoice)
-        if text_lines:
-            invoice_data['vendor'] = text_lines[0]
-        
-        # Attempt to identify items based on layout and content
-        # This is a simplified approach - real implementation would be more complex
-        # Using y-coordinate sorting to find rows
-        sorted_boxes = sorted(bbox_data, key=lambda x: (sum(point[1] for point in x[0]) / 4))
-        
-        # Look for lines that might contain prices
-        for bbox, text in sorted_boxes:
-            if re.search(r'\d+\.\d{2}', text):  # Look for price-like patterns
-                invoice_data['items'].append(text)
+        with metrics.span('parse', ENGINE_NAME):
+            invoice_data = {
+                'invoice_number': None,
+                'date': None,
+                'total_amount': None,
+                'vendor': None,
+                'items': []
+            }
+        
+            # Extract invoice number
+            invoice_match = re.search(r'(?i)invoice\s*(?:#|number|num|no|no\.)\s*[:\s]?\s*([a-zA-Z0-9\-]+)', full_text)
+            if invoice_match:
+                invoice_data['invoice_number'] = invoice_match.group(1)
+        
+            # Extract date
+            date_match = re.search(r'(?i)(?:date|dated)?\s*[:\s]?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})', full_text)
+            if date_match:
+                invoice_data['date'] = date_match.group(1)
+        
+            # Extract total amount
+            amount_match = re.search(r'(?i)(?:total|amount|sum)?\s*(?:due|:)?\s*[\$£€]?\s*(\d+[.,]\d{2})', full_text)
+            if amount_match:
+                invoice_data['total_amount'] = amount_match.group(1)
+        
+            # Try to extract vendor name (typically at the top of the invoice)
+            if text_lines:
+                invoice_data['vendor'] = text_lines[0]
+        
+            # Attempt to identify items based on layout and content
+            # This is a simplified approach - real implementation would be more complex
+            # Using y-coordinate sorting to find rows
+            sorted_boxes = sorted(bbox_data, key=lambda x: (sum(point[1] for point in x[0]) / 4))
+        
+            # Look for lines that might contain prices
+            for bbox, text in sorted_boxes:
+                if re.search(r'\d+\.\d{2}', text):  # Look for price-like patterns
+                    invoice_data['items'].append(text)
         
         return json.dumps(invoice_data, indent=2)
     except Exception as e:
@@ -146,8 +299,10 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description='EasyOCR Module')
     parser.add_argument('file', help='Path to file')
-    parser.add_argument('--type', choices=['image', 'pdf', 'handwriting', 'invoice'], 
-                        default='image', help='Type of OCR to perform')
+    parser.add_argument('--type', choices=['image', 'pdf', 'pdf_pages', 'handwriting', 'invoice'], 
+                        default='image', help='Type of OCR to perform (pdf_pages: per-page text and boxes as JSON)')
+    parser.add_argument('--batch-size', type=int, default=PDF_BATCH_SIZE, help='Pages per batch in PDF mode')
+    parser.add_argument('--workers', type=int, default=PDF_WORKERS, help='Canvas preparation threads in PDF mode')
     
     args = parser.parse_args()
     
@@ -155,6 +310,9 @@ if __name__ == "__main__":
         result = extract_text_from_image(args.file)
     elif args.type == 'pdf':
         result = extract_text_from_pdf(args.file)
+    elif args.type == 'pdf_pages':
+        result = json.dumps(extract_pdf_pages(args.file, batch_size=args.batch_size, workers=args.workers),
+                            indent=2)
     elif args.type == 'handwriting':
         result = recognize_handwriting(args.file)
     elif args.type == 'invoice':
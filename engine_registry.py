@@ -0,0 +1,80 @@
+import os
+import time
+import importlib
+import threading
+
+# Engine name -> module implementing it, in the order engines appear in responses
+ENGINE_MODULE_NAMES = {
+    'pytesseract': 'pytesseract_module',
+    'easyocr': 'easyocr_module',
+    'doctr': 'doctr_module',
+}
+
+ENGINE_NAMES = list(ENGINE_MODULE_NAMES)
+
+# Engines requested for warm-up and the outcome of each load
+_preloaded = []
+_load_errors = {}
+_load_times = {}
+_lock = threading.Lock()
+
+def get_module(engine):
+    """Return the module for an engine; the module itself loads its model lazily"""
+    return importlib.import_module(ENGINE_MODULE_NAMES[engine])
+
+def preload_list(value=None):
+    """
+    Parse a comma-separated preload list (default: the OCR_PRELOAD env var).
+
+    'all' selects every engine; unknown names are ignored.
+    """
+    value = os.environ.get('OCR_PRELOAD', '') if value is None else value
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    if 'all' in names:
+        return list(ENGINE_NAMES)
+    return [name for name in names if name in ENGINE_MODULE_NAMES]
+
+def warm_up(engines):
+    """
+    Load the models of the given engines now instead of on first use.
+
+    Call this before workers fork (e.g. with gunicorn preload_app) so the
+    loaded weights are shared copy-on-write. Load failures are recorded and
+    reported by status() rather than raised.
+    """
+    for engine in engines:
+        with _lock:
+            if engine not in _preloaded:
+                _preloaded.append(engine)
+        start = time.perf_counter()
+        try:
+            get_module(engine).load_model()
+            _load_errors.pop(engine, None)
+            _load_times[engine] = round((time.perf_counter() - start) * 1000, 1)
+        except Exception as e:
+            _load_errors[engine] = str(e)
+    return status()
+
+def status():
+    """Return the load state of every engine: 'warm', 'cold' or 'failed'"""
+    engines = {}
+    for engine in ENGINE_NAMES:
+        module = get_module(engine)
+        if module.is_loaded():
+            state = 'warm'
+        elif engine in _load_errors:
+            state = 'failed'
+        else:
+            state = 'cold'
+        engines[engine] = {
+            'state': state,
+            'preload': engine in _preloaded,
+            'load_ms': _load_times.get(engine),
+            'error': _load_errors.get(engine),
+        }
+    return engines
+
+def is_ready():
+    """Ready once every engine requested for warm-up has loaded"""
+    engines = status()
+    return all(engines[engine]['state'] == 'warm' for engine in _preloaded)
@@ -0,0 +1,239 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import engine_registry
+import ingest
+import metrics
+import micro_batcher
+import ocr_cache
+import profiler
+import resolution
+from pdf_pages import profile_for
+
+# Module function used for each document type
+FILE_TYPE_FUNCTIONS = {
+    'image': 'extract_text_from_image',
+    'pdf': 'extract_text_from_pdf',
+    'handwriting': 'recognize_handwriting',
+    'invoice': 'extract_invoice_data',
+}
+
+# Engine runs in flight at once across all requests of a process (one per engine by default)
+MAX_WORKERS = int(os.environ.get('OCR_MAX_WORKERS', len(engine_registry.ENGINE_NAMES)))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def executor():
+    """
+    The engine thread pool shared by every request of this process.
+
+    Concurrent requests queue for its MAX_WORKERS threads instead of each
+    starting their own, and the threads (with their Tesseract handles) live
+    as long as the process. Like the job workers, the pool is created again
+    after a fork.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=max(1, MAX_WORKERS), thread_name_prefix='ocr-engine')
+            _executor_pid = os.getpid()
+        return _executor
+
+def selected_engines(ocr_method):
+    """Return the engine names selected by an ocr_method form value"""
+    if ocr_method == 'all':
+        return list(engine_registry.ENGINE_NAMES)
+    if ocr_method in engine_registry.ENGINE_NAMES:
+        return [ocr_method]
+    return []
+
+def grayscale_only(engines):
+    """Whether every engine can work from a grayscale decode of the upload"""
+    return all(getattr(engine_registry.get_module(engine), 'INPUT_MODE', 'color') == 'gray'
+               for engine in engines)
+
+def raster_profiles(engines):
+    """Raster profiles the engines will ask a PageStore for"""
+    return [profile_for(engine_registry.get_module(engine)) for engine in engines]
+
+def run_engine(engine, file_type, file_path, on_page=None, page_range=None, page_store=None,
+               image=None, text_height=None):
+    """
+    Run a single engine on a file and time it.
+
+    Returns a (result, timing) tuple. Errors are caught and returned as an
+    "Error: ..." string so one failing engine never affects the others.
+    A result of None means the engine has no handler for the file type.
+    For PDFs, on_page(page_number, text) is called as each page finishes and
+    page_range=(first_page, last_page) limits which pages are processed. A
+    PageStore lets engines share pages rasterized once per RASTER_PROFILE.
+    For other file types, image is an optional zero-argument function returning
+    the already decoded image, used instead of reading file_path again, and
+    text_height an optional zero-argument function returning its measured
+    text height; with both, the image is rescaled to the engine's target
+    text height first (see resolution.py) and the timing reports the
+    estimated latency saved. cpu_ms covers this thread plus the engine's
+    share of the micro-batched model calls made for it (see micro_batcher).
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    rescale = None
+    with metrics.in_flight('ocr_engine_in_flight', engine=engine), micro_batcher.cpu_account() as batched:
+        try:
+            module = engine_registry.get_module(engine)
+            handler = getattr(module, FILE_TYPE_FUNCTIONS[file_type], None)
+            if handler is None:
+                result = None
+            elif file_type == 'pdf':
+                first_page, last_page = page_range or (None, None)
+                pages = page_store.pages(profile_for(module)) if page_store else None
+                result = handler(file_path, on_page=on_page, first_page=first_page, last_page=last_page,
+                                 pages=pages)
+            elif image is not None and text_height is not None and resolution.target_for(engine):
+                rescale_start = time.perf_counter()
+                rescale = resolution.govern(image(), engine, text_height())
+                rescale_ms = (time.perf_counter() - rescale_start) * 1000
+                handler_start = time.perf_counter()
+                result = handler(rescale.image)
+                handler_ms = (time.perf_counter() - handler_start) * 1000
+            else:
+                result = handler(image() if image is not None else file_path)
+        except Exception as e:
+            result = f"Error: {str(e)}"
+    if result is not None:
+        metrics.inc('ocr_engine_runs_total', engine=engine, file_type=file_type,
+                    outcome='error' if is_error(result) else 'ok')
+        metrics.observe('ocr_engine_seconds', time.perf_counter() - wall_start, engine=engine,
+                        file_type=file_type)
+    timing = {
+        'wall_ms': round((time.perf_counter() - wall_start) * 1000, 1),
+        'cpu_ms': round((time.thread_time() - cpu_start + batched['cpu_seconds']) * 1000, 1),
+    }
+    if rescale is not None and result is not None and not is_error(result):
+        timing['resolution'] = resolution.report(rescale, handler_ms, rescale_ms)
+    return result, timing
+
+def is_error(result):
+    """Engines report failures as strings starting with 'Error'"""
+    return isinstance(result, str) and result.startswith('Error')
+
+def cache_key(engine, file_type, file_digest, page_range=None, governed=False):
+    """
+    Result cache key of one engine run on a file.
+
+    governed tells whether the input is rescaled by the resolution governor
+    first, in which case the engine's target text height is part of the key.
+    """
+    module = engine_registry.get_module(engine)
+    config = dict(getattr(module, 'ENGINE_CONFIG', {}))
+    if page_range:
+        config['page_range'] = list(page_range)
+    if file_type == 'pdf':
+        # The thread count only changes how fast pages are rendered
+        profile = profile_for(module)
+        config['raster'] = [profile.dpi, profile.grayscale, profile.use_pdftocairo]
+    if governed and resolution.target_for(engine):
+        config['text_height_target'] = resolution.target_for(engine)
+        config['upscale'] = resolution.UPSCALE
+    return ocr_cache.make_key(file_digest, engine, file_type, config,
+                              getattr(module, 'PIPELINE_VERSION', None))
+
+def cache_lookup(cache, key, file_type):
+    """Return the (result, pages) of a cached run, or None; pages is empty except for PDFs"""
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    if file_type == 'pdf' and isinstance(cached, dict):
+        return cached['result'], cached['pages']
+    return cached, []
+
+def cache_store(cache, key, file_type, result, pages=()):
+    """Store a successful result; PDF results are stored with their (page, text) pairs"""
+    if result is None or is_error(result):
+        return
+    cache.put(key, {'result': result, 'pages': list(pages)} if file_type == 'pdf' else result)
+
+def run_engines(engines, file_type, file_path, parallel=True,
+                on_page=None, on_result=None, cache=None, file_digest=None, page_range=None,
+                page_store=None, image=None):
+    """
+    Run several engines on the same file.
+
+    With parallel=True the engine calls are fanned out to the shared engine
+    pool (see executor()) so the total latency is set by the slowest engine. Returns a
+    (results, timings) tuple of dicts keyed by engine name.
+
+    Optional callbacks report partial progress: on_page(engine, page, text)
+    for each finished PDF page and on_result(engine, result, timing) as soon
+    as an engine completes.
+
+    When a cache is given, results are looked up by the file's content digest
+    before running an engine and successful results are stored afterwards;
+    PDF results are stored with their pages, which on_page reports on a hit.
+    """
+    if file_type not in FILE_TYPE_FUNCTIONS:
+        return {}, {}
+
+    if cache is not None and file_digest is None:
+        file_digest = ocr_cache.file_digest(file_path)
+
+    # Images are decoded and their text height measured once, then rescaled per engine
+    text_height = None
+    if file_type != 'pdf' and resolution.ENABLED:
+        if image is None:
+            image = ingest.lazy_decode(file_path, grayscale_only(engines))
+        text_height = resolution.lazy_text_height(image)
+
+    def run(engine):
+        key = None
+        if cache is not None:
+            key = cache_key(engine, file_type, file_digest, page_range, governed=text_height is not None)
+            wall_start = time.perf_counter()
+            hit = cache_lookup(cache, key, file_type)
+            if hit is not None:
+                cached, pages = hit
+                # PDF entries keep their pages so on_page reports them on a hit as well
+                if on_page:
+                    for page, text in pages:
+                        on_page(engine, page, text)
+                timing = {'wall_ms': round((time.perf_counter() - wall_start) * 1000, 1),
+                          'cpu_ms': 0.0, 'cached': True}
+                metrics.inc('ocr_engine_runs_total', engine=engine, file_type=file_type, outcome='cached')
+                if on_result:
+                    on_result(engine, cached, timing)
+                return cached, timing
+
+        finished_pages = []
+
+        def page_callback(page, text):
+            finished_pages.append((page, text))
+            if on_page:
+                on_page(engine, page, text)
+
+        result, timing = run_engine(engine, file_type, file_path, on_page=page_callback,
+                                    page_range=page_range, page_store=page_store, image=image,
+                                    text_height=text_height)
+        if key is not None:
+            cache_store(cache, key, file_type, result, finished_pages)
+        if on_result and result is not None:
+            on_result(engine, result, timing)
+        return result, timing
+
+    if parallel and len(engines) > 1:
+        futures = {engine: executor().submit(profiler.propagate(run), engine) for engine in engines}
+        outcomes = {engine: future.result() for engine, future in futures.items()}
+    else:
+        outcomes = {engine: run(engine) for engine in engines}
+
+    results = {}
+    timings = {}
+    for engine in engines:
+        result, timing = outcomes[engine]
+        if result is not None:
+            results[engine] = result
+            timings[engine] = timing
+    return results, timings
@@ -1,13 +1,262 @@
 import os
 import argparse
-from PIL import Image
+from PIL import Image, GifImagePlugin
 import glob
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from row_visualizer import band_bounds, draw_row
+
+# Frames decoded and quantized ahead of the writer; bounds peak memory
+LOOKAHEAD_FRAMES = 4
+
+# Frames are shrunk by this factor before their colours are sampled for the palette
+PALETTE_SAMPLE_SCALE = 4
+
+def build_palette(frames, colors=256):
+    """Build one palette image covering the colours of a few sample frames"""
+    # Box-filter thumbnails keep the colour distribution at a fraction of the cost
+    thumbs = [frame.convert('RGB').reduce(PALETTE_SAMPLE_SCALE) for frame in frames]
+    montage = Image.new('RGB', (max(t.size[0] for t in thumbs), sum(t.size[1] for t in thumbs)))
+    top = 0
+    for thumb in thumbs:
+        montage.paste(thumb, (0, top))
+        top += thumb.size[1]
+    return montage.quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
 
 def natural_sort_key(s):
     """Sort strings with numbers in natural order (e.g., 1, 2, 10 instead of 1, 10, 2)"""
     return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
 
+class StreamingGifWriter:
+    """
+    Writes an animated GIF one frame at a time.
+
+    One palette (see build_palette) is shared by every frame and written once
+    as the global colour table. Frames are mapped onto it, and after the
+    first only the bounding box of the pixels that changed since the
+    previous frame is written (frames are not disposed, so the rest of the
+    canvas stays). Memory use is the previous frame plus the one being
+    written, however long the animation is.
+    """
+
+    def __init__(self, output_file, size, palette, duration=200, loop=0):
+        self.output_file = output_file
+        self.duration = duration
+        self.size = size
+        self.palette = palette
+        self.frame_count = 0
+        self._previous = None
+        self._file = open(output_file, 'wb')
+
+        info = {'loop': loop} if loop is not None else {}
+        header, _ = GifImagePlugin.getheader(self.palette.copy(), info=info)
+        for block in header:
+            self._file.write(block)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def quantize(self, image, fit=True):
+        """Map an image onto the shared palette (safe to call from worker threads)"""
+        image = image.convert('RGB')
+        if fit and image.size != self.size:
+            image = image.resize(self.size, Image.LANCZOS)
+        return image.quantize(palette=self.palette, dither=Image.Dither.NONE)
+
+    def write_region(self, region, offset, duration=None, disposal=3):
+        """
+        Append a frame covering only `region` (from quantize(..., fit=False)) at offset.
+
+        With the default disposal 3 ("restore to previous") the canvas goes
+        back to its prior state once the frame has been shown.
+        """
+        for block in GifImagePlugin.getdata(region, offset=offset, disposal=disposal,
+                                            duration=self.duration if duration is None else duration):
+            self._file.write(block)
+        if disposal != 3 and self._previous is not None:
+            left, top = offset
+            self._previous = self._previous.copy()
+            self._previous[top:top + region.size[1], left:left + region.size[0]] = np.asarray(region)
+        self.frame_count += 1
+
+    def write(self, frame, duration=None):
+        """Append a full frame returned by quantize(), writing only what changed"""
+        indices = np.asarray(frame)
+        box = (0, 0) + self.size
+        if self._previous is not None:
+            changed = indices != self._previous
+            rows = np.flatnonzero(changed.any(axis=1))
+            cols = np.flatnonzero(changed.any(axis=0))
+            # An unchanged frame still needs a (1x1) frame to keep its duration
+            box = (cols[0], rows[0], cols[-1] + 1, rows[-1] + 1) if rows.size else (0, 0, 1, 1)
+        region = frame.crop(box) if box != (0, 0) + self.size else frame
+        for block in GifImagePlugin.getdata(region, offset=box[:2], disposal=1,
+                                            duration=self.duration if duration is None else duration):
+            self._file.write(block)
+        self._previous = indices
+        self.frame_count += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.write(b';')  # GIF trailer
+            self._file.close()
+
+def _open_frame(source, resize=None):
+    """Decode a frame from a path or PIL image, optionally resized"""
+    image = Image.open(source) if isinstance(source, str) else source
+    image = image.convert('RGB')
+    if resize:
+        image = image.resize(resize, Image.LANCZOS)
+    return image
+
+def write_gif(sources, output_file, duration=200, loop=0, resize=None, workers=None,
+              lookahead=LOOKAHEAD_FRAMES, on_frame=None):
+    """
+    Stream frames (paths or PIL images) into an animated GIF.
+
+    Frames are decoded and quantized by a thread pool at most `lookahead`
+    frames ahead of the writer, then written in order by StreamingGifWriter.
+    The palette is sampled from the first frame, plus the middle and last
+    frames when `sources` is a list. Frames that can't be read are reported
+    and skipped. on_frame(index, source) is called after each source is
+    handled. Returns the number of frames written.
+    """
+    samples = []
+    if isinstance(sources, (list, tuple)) and len(sources) > 2:
+        for source in (sources[len(sources) // 2], sources[-1]):
+            try:
+                samples.append(_open_frame(source, resize))
+            except Exception:
+                pass
+    sources = iter(sources)
+    writer = None
+    index = 0
+
+    # The first readable frame defines the canvas size
+    for source in sources:
+        try:
+            first_frame = _open_frame(source, resize)
+            palette = build_palette([first_frame] + samples)
+            samples = None
+            writer = StreamingGifWriter(output_file, first_frame.size, palette, duration, loop)
+            writer.write(writer.quantize(first_frame))
+        except Exception as e:
+            print(f"Error processing {source}: {str(e)}")
+        if on_frame:
+            on_frame(index, source)
+        index += 1
+        if writer is not None:
+            break
+    if writer is None:
+        return 0
+
+    def prepare(source):
+        try:
+            return writer.quantize(_open_frame(source, resize)), None
+        except Exception as e:
+            return None, e
+
+    with writer, ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+
+        def flush_one():
+            nonlocal index
+            source, future = pending.popleft()
+            frame, error = future.result()
+            if error is not None:
+                print(f"Error processing {source}: {str(error)}")
+            else:
+                writer.write(frame)
+            if on_frame:
+                on_frame(index, source)
+            index += 1
+
+        for source in sources:
+            pending.append((source, pool.submit(prepare, source)))
+            if len(pending) >= lookahead:
+                flush_one()
+        while pending:
+            flush_one()
+    return writer.frame_count
+
+def _strip_rows(strips):
+    """Normalise strips to (y, end_y, row_index) tuples, numbering unlabelled ones"""
+    rows = []
+    for i, strip in enumerate(strips):
+        if isinstance(strip, dict):
+            rows.append((strip['y'], strip['end_y'], strip.get('row_index', i)))
+        elif len(strip) >= 3:
+            rows.append(tuple(strip[:3]))
+        else:
+            rows.append((strip[0], strip[1], i))
+    return rows
+
+def _highlight_rows(base, rows):
+    """Return a copy of base with every row highlighted, drawing only their bands"""
+    frame = base.copy()
+    height, width = base.shape[:2]
+    for y, end_y, index in rows:
+        top, bottom = band_bounds(y, end_y, height)
+        band = frame[top:bottom]
+        draw_row(band, band.copy(), y, end_y, width, index, offset=top)
+    return frame
+
+def strips_to_gif(base_image, strips, output_file, duration=500, loop=0, composite=None, base_duration=None):
+    """
+    Create an OCR progress GIF straight from a page and its strip rectangles.
+    
+    Parameters:
+    - base_image: The page, as an OpenCV (BGR or grayscale) array or a PIL image
+    - strips: Strip rectangles as (y, end_y), (y, end_y, row_index) or dicts with 'y'/'end_y'
+    - output_file: Path for the output GIF file
+    - duration: Duration of each strip frame in milliseconds
+    - loop: Number of times to loop the GIF (0 means infinite)
+    - composite: Optional rows to highlight together in a final frame
+    - base_duration: Duration of the opening page frame (default: duration)
+    
+    The GIF opens with the page itself; each strip is then a small frame
+    covering only its highlighted band, restored to the page after it is
+    shown, so no full-page frame is rendered, re-encoded or stored.
+    
+    Returns:
+    - Number of frames written
+    """
+    if isinstance(base_image, np.ndarray):
+        if base_image.ndim == 2:
+            base = np.stack([base_image] * 3, axis=-1)
+        else:
+            base = np.ascontiguousarray(base_image[:, :, 2::-1])
+    else:
+        base = np.asarray(base_image.convert('RGB'))
+    height, width = base.shape[:2]
+    rows = _strip_rows(strips)
+    composite_rows = _strip_rows(composite) if composite else []
+    
+    # Sample the highlight colours along with the page for the shared palette
+    sample = _highlight_rows(base, rows + composite_rows)
+    palette = build_palette([Image.fromarray(base), Image.fromarray(sample)])
+    del sample
+    
+    with StreamingGifWriter(output_file, (width, height), palette, duration, loop) as writer:
+        writer.write(writer.quantize(Image.fromarray(base)), base_duration)
+        
+        for y, end_y, index in rows:
+            top, bottom = band_bounds(y, end_y, height)
+            band = base[top:bottom].copy()
+            draw_row(band, base[top:bottom], y, end_y, width, index, offset=top)
+            writer.write_region(writer.quantize(Image.fromarray(band), fit=False), (0, top))
+        
+        if composite_rows:
+            writer.write(writer.quantize(Image.fromarray(_highlight_rows(base, composite_rows))))
+        return writer.frame_count
+
 def create_gif_from_images(input_folder, output_file, duration=200, loop=0, sort_naturally=True):
     """
     Create a GIF animation from JPG images in a folder.
@@ -35,28 +284,10 @@ def create_gif_from_images(input_folder, output_file, duration=200, loop=0, sort
         if not jpg_files:
             return f"No JPG files found in {input_folder}"
         
-        # Open all images
-        images = []
-        for file in jpg_files:
-            try:
-                img = Image.open(file)
-                images.append(img.copy())  # Create a copy to avoid "seek" issues
-            except Exception as e:
-                print(f"Error processing {file}: {str(e)}")
-        
-        if not images:
+        # Stream the images into the GIF a few frames at a time
+        if not write_gif(jpg_files, output_file, duration, loop):
             return "No valid images found"
         
-        # Save as GIF
-        images[0].save(
-            output_file, 
-            save_all=True, 
-            append_images=images[1:], 
-            duration=duration, 
-            loop=loop,
-            optimize=False  # Set to True for smaller file size but may reduce quality
-        )
-        
         return output_file
     except Exception as e:
         return f"Error creating GIF: {str(e)}"
@@ -85,45 +316,16 @@ def create_gif_with_progress(input_folder, output_file, duration=200, loop=0, re
         
         print(f"Processing {len(jpg_files)} images...")
         
-        # Open first image to get size for the GIF
-        first_img = Image.open(jpg_files[0])
-        if resize:
-            img_size = resize
-            first_img = first_img.resize(resize, Image.LANCZOS)
-        else:
-            img_size = first_img.size
-        
-        # Prepare frames
-        frames = []
         total_files = len(jpg_files)
         
-        for i, file in enumerate(jpg_files):
+        def report(i, file):
             if i % 10 == 0 or i == total_files - 1:
                 print(f"Processing image {i+1}/{total_files} ({(i+1)/total_files*100:.1f}%)")
-            
-            try:
-                img = Image.open(file)
-                if resize:
-                    img = img.resize(img_size, Image.LANCZOS)
-                frames.append(img.copy())
-            except Exception as e:
-                print(f"Error processing {file}: {str(e)}")
-        
-        if not frames:
-            return "No valid images found"
         
-        print(f"Saving GIF to {output_file}...")
-        
-        # Save as GIF
-        frames[0].save(
-            output_file, 
-            format='GIF',
-            save_all=True, 
-            append_images=frames[1:], 
-            duration=duration, 
-            loop=loop,
-            optimize=False
-        )
+        # Frames are written to the GIF as they are processed
+        print(f"Writing GIF to {output_file}...")
+        if not write_gif(jpg_files, output_file, duration, loop, resize=resize, on_frame=report):
+            return "No valid images found"
         
         print(f"GIF created successfully: {output_file}")
         return output_file
@@ -157,21 +359,9 @@ def ocr_visualization_to_gif(visualization_dir, output_file, duration=500, inclu
             if os.path.exists(composite_image):
                 row_images.append(composite_image)
         
-        # Process images
-        frames = []
-        for img_path in row_images:
-            img = Image.open(img_path)
-            frames.append(img.copy())
-        
-        # Save as GIF
-        frames[0].save(
-            output_file,
-            format='GIF',
-            save_all=True,
-            append_images=frames[1:],
-            duration=duration,
-            loop=0  # Loop forever
-        )
+        # Stream the frames into the GIF, looping forever
+        if not write_gif(row_images, output_file, duration, loop=0):
+            return "No valid images found"
         
         return output_file
     except Exception as e:
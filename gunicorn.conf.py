@@ -0,0 +1,12 @@
+import os
+
+# Import the app (and warm the models listed in OCR_PRELOAD) once in the master
+# process; forked workers then share the loaded weights copy-on-write
+preload_app = os.environ.get('GUNICORN_PRELOAD_APP', '1') == '1'
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+def post_fork(server, worker):
+    # Threads don't survive fork, so each worker starts its own job queue threads
+    from app import job_queue
+    job_queue.ensure_workers()
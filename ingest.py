@@ -0,0 +1,137 @@
+import os
+import shutil
+import hashlib
+import zipfile
+import threading
+from collections import namedtuple
+
+import cv2
+import numpy as np
+from werkzeug.utils import secure_filename
+
+import metrics
+
+# Bytes read from the request stream per chunk
+CHUNK_SIZE = 1024 * 1024
+
+# Limits on what a zip upload may expand to
+MAX_ARCHIVE_MEMBERS = int(os.environ.get('OCR_MAX_ARCHIVE_MEMBERS', 100))
+MAX_ARCHIVE_BYTES = int(os.environ.get('OCR_MAX_ARCHIVE_MB', 256)) * 1024 * 1024
+
+Upload = namedtuple('Upload', ['path', 'sha256', 'size', 'data'])
+
+def save_upload(file_storage, file_path, keep_bytes=False):
+    """
+    Stream an uploaded file to disk once, hashing it on the way.
+
+    Returns an Upload with the SHA-256 digest and size. With keep_bytes=True
+    the raw bytes are also kept in memory (uploads are capped by
+    MAX_CONTENT_LENGTH) so images can be decoded without reading the file back.
+    """
+    sha = hashlib.sha256()
+    size = 0
+    chunks = [] if keep_bytes else None
+    stream = file_storage.stream
+    with open(file_path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+            size += len(chunk)
+            f.write(chunk)
+            if keep_bytes:
+                chunks.append(chunk)
+    data = b''.join(chunks) if keep_bytes else None
+    return Upload(file_path, sha.hexdigest(), size, data)
+
+def link_file(src, dst):
+    """Expose src at dst without copying: hardlink, then symlink, then copy as a last resort"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(src), dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+    return dst
+
+def extract_archive(archive_path, output_dir, allowed_extensions):
+    """
+    Extract the members of a zip archive with an allowed extension into output_dir.
+
+    Member paths are flattened to safe base names (duplicates get a numeric
+    prefix) so nothing is written outside output_dir. Returns a list of
+    (member name, extracted path); raises ValueError when the archive is
+    invalid or exceeds the member or size limits.
+    """
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Invalid zip archive: {e}")
+    with archive:
+        members = [info for info in archive.infolist() if not info.is_dir()
+                   and os.path.splitext(info.filename)[1][1:].lower() in allowed_extensions]
+        if len(members) > MAX_ARCHIVE_MEMBERS:
+            raise ValueError(f"Archive has more than {MAX_ARCHIVE_MEMBERS} files")
+        # Sizes in the directory can lie, so the limit is also enforced while copying
+        if sum(info.file_size for info in members) > MAX_ARCHIVE_BYTES:
+            raise ValueError(f"Archive expands to more than {MAX_ARCHIVE_BYTES // (1024 * 1024)}MB")
+        extracted = []
+        remaining = MAX_ARCHIVE_BYTES
+        used = set()
+        for index, info in enumerate(members):
+            name = secure_filename(os.path.basename(info.filename)) or f"file_{index}"
+            if name in used:
+                name = f"{index}_{name}"
+            used.add(name)
+            path = os.path.join(output_dir, name)
+            with archive.open(info) as src, open(path, 'wb') as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    remaining -= len(chunk)
+                    if remaining < 0:
+                        raise ValueError(f"Archive expands to more than {MAX_ARCHIVE_BYTES // (1024 * 1024)}MB")
+                    dst.write(chunk)
+            extracted.append((info.filename, path))
+    return extracted
+
+def decode_image(data, grayscale=False):
+    """Decode encoded image bytes straight to a BGR (or grayscale) array"""
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    if img is None:
+        raise ValueError("Unable to decode image")
+    return img
+
+def lazy_decode(data, grayscale=False):
+    """
+    Return a thread-safe function that decodes the image on first call only.
+
+    data is the encoded image bytes, or a path to read them from on that call.
+    """
+    lock = threading.Lock()
+    decoded = []
+
+    def load():
+        with lock:
+            if not decoded:
+                with metrics.span('decode'):
+                    if isinstance(data, str):
+                        with open(data, 'rb') as f:
+                            decoded.append(decode_image(f.read(), grayscale))
+                    else:
+                        decoded.append(decode_image(data, grayscale))
+        return decoded[0]
+
+    return load
+
+def as_bgr(image):
+    """Return a BGR array for a file path or an already decoded array"""
+    if isinstance(image, np.ndarray):
+        return image if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return cv2.imread(image)
+
+def as_gray(image):
+    """Return a grayscale array for a file path or an already decoded array"""
+    if isinstance(image, np.ndarray):
+        return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.imread(image, cv2.IMREAD_GRAYSCALE)
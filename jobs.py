@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import engine_runner
+import pdf_pages
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    engines TEXT NOT NULL,
+    heartbeat_at REAL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_engines (
+    job_id TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    timing TEXT,
+    PRIMARY KEY (job_id, engine)
+);
+CREATE TABLE IF NOT EXISTS job_pages (
+    job_id TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text TEXT,
+    PRIMARY KEY (job_id, engine, page)
+);
+"""
+
+class JobQueue:
+    """
+    Persistent OCR job queue backed by a local SQLite database.
+
+    Jobs are drained by background worker threads inside the web process, so
+    no external broker is needed. Jobs and their partial results live in the
+    database and therefore survive a restart. A running job is kept alive by
+    a heartbeat; once its lease expires (the worker process died) the job is
+    put back in the queue and resumed with the engines that had not finished.
+    """
+
+    def __init__(self, db_path, num_workers=1, poll_interval=1.0, lease_seconds=60, cache=None):
+        self.db_path = db_path
+        self.cache = cache
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._wakeup = threading.Event()
+        self._workers = []
+        self._workers_pid = None
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connection(self):
+        # A fresh connection per operation keeps the queue safe to use from
+        # request threads, engine threads and worker threads alike
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, file_path, file_type, engines):
+        """Add a job to the queue and return its id"""
+        job_id = uuid.uuid4().hex
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, file_path, file_type, engines, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, 'queued', file_path, file_type, json.dumps(engines), time.time()))
+            conn.executemany(
+                'INSERT INTO job_engines (job_id, engine, status) VALUES (?, ?, ?)',
+                [(job_id, engine, 'pending') for engine in engines])
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Return the status and partial results of a job, or None if unknown"""
+        with self._connection() as conn:
+            job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if job is None:
+                return None
+            engine_rows = conn.execute(
+                'SELECT * FROM job_engines WHERE job_id = ?', (job_id,)).fetchall()
+            page_rows = conn.execute(
+                'SELECT * FROM job_pages WHERE job_id = ? ORDER BY page', (job_id,)).fetchall()
+
+        results = {}
+        for row in engine_rows:
+            results[row['engine']] = {
+                'status': row['status'],
+                'result': row['result'],
+                'timing': json.loads(row['timing']) if row['timing'] else None,
+                'pages': {},
+            }
+        for row in page_rows:
+            results[row['engine']]['pages'][str(row['page'])] = row['text']
+
+        # Keep the engine order the job was submitted with
+        engines = json.loads(job['engines'])
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'file_type': job['file_type'],
+            'engines': engines,
+            'error': job['error'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at'],
+            'results': {engine: results[engine] for engine in engines if engine in results},
+        }
+
+    def claim(self):
+        """Atomically take the oldest queued job, or return None"""
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            job = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if job is None:
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', heartbeat_at = ?, started_at = ? WHERE id = ?",
+                (now, now, job['id']))
+            return dict(job)
+
+    def requeue_interrupted(self):
+        """Put running jobs whose heartbeat lease has expired back in the queue"""
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'running' AND heartbeat_at < ?",
+                (time.time() - self.lease_seconds,)).fetchall()
+            stale = [row['id'] for row in rows]
+            for job_id in stale:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', heartbeat_at = NULL WHERE id = ?", (job_id,))
+                # Engines that already finished keep their results
+                conn.execute(
+                    "UPDATE job_engines SET status = 'pending' WHERE job_id = ? AND status != 'done'",
+                    (job_id,))
+        return stale
+
+    def _set_engine(self, job_id, engine, status, result=None, timing=None):
+        with self._connection() as conn:
+            conn.execute(
+                'UPDATE job_engines SET status = ?, result = ?, timing = ? '
+                'WHERE job_id = ? AND engine = ?',
+                (status, result if isinstance(result, str) or result is None else json.dumps(result),
+                 json.dumps(timing) if timing else None, job_id, engine))
+
+    def _set_page(self, job_id, engine, page, text):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO job_pages (job_id, engine, page, text) VALUES (?, ?, ?, ?)',
+                (job_id, engine, page, text))
+
+    def _heartbeat(self, job_id, stop):
+        while not stop.wait(self.lease_seconds / 3):
+            with self._connection() as conn:
+                conn.execute('UPDATE jobs SET heartbeat_at = ? WHERE id = ?', (time.time(), job_id))
+
+    def _finish(self, job_id, status, error=None):
+        with self._connection() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                (status, error, time.time(), job_id))
+
+    def run_job(self, job):
+        """Run the pending engines of a claimed job, recording partial results"""
+        job_id = job['id']
+        with self._connection() as conn:
+            pending = [row['engine'] for row in conn.execute(
+                "SELECT engine FROM job_engines WHERE job_id = ? AND status != 'done'", (job_id,))]
+        engines = [engine for engine in json.loads(job['engines']) if engine in pending]
+
+        for engine in engines:
+            self._set_engine(job_id, engine, 'running')
+
+        def on_page(engine, page, text):
+            self._set_page(job_id, engine, page, text)
+
+        def on_result(engine, result, timing):
+            self._set_engine(job_id, engine, 'done', result, timing)
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, stop), daemon=True)
+        heartbeat.start()
+        # Rasterize PDFs once and share the pages across the job's engines
+        page_store = None
+        if job['file_type'] == 'pdf':
+            page_store = pdf_pages.PageStore(job['file_path'], profiles=engine_runner.raster_profiles(engines))
+        try:
+            engine_runner.run_engines(engines, job['file_type'], job['file_path'],
+                                      on_page=on_page, on_result=on_result, cache=self.cache,
+                                      page_store=page_store)
+            self._finish(job_id, 'done')
+        except Exception as e:
+            self._finish(job_id, 'failed', str(e))
+        finally:
+            stop.set()
+            if page_store is not None:
+                page_store.close()
+
+    def _worker_loop(self):
+        while True:
+            job = self.claim()
+            if job is None:
+                # Pick up jobs abandoned by crashed workers while idle
+                self.requeue_interrupted()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self.run_job(job)
+
+    def ensure_workers(self):
+        """
+        Start the background worker threads for this process if needed.
+
+        Safe to call repeatedly; after a fork (e.g. gunicorn preload_app) the
+        child process notices the pid change and starts its own workers.
+        """
+        with self._lock:
+            if self._workers_pid == os.getpid() or self.num_workers <= 0:
+                return
+            self._wakeup = threading.Event()
+            self._workers = []
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f'ocr-job-worker-{i}',
+                                          daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            self._workers_pid = os.getpid()
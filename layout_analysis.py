@@ -0,0 +1,119 @@
+import cv2
+import numpy as np
+from collections import namedtuple
+
+# A row counts as text when at least this fraction of its pixels is ink
+MIN_INK_FRACTION = 0.002
+
+# Bands thinner than this many pixels are treated as noise (specks, scan lines)
+MIN_BAND_HEIGHT = 3
+
+# Inside a band taller than this many glyph heights, rows with less than
+# SPLIT_INK_RATIO of the band's median ink are treated as gaps between lines
+TALL_BAND_GLYPHS = 3
+SPLIT_INK_RATIO = 0.15
+
+Layout = namedtuple('Layout', ['bands', 'glyph_height', 'line_height'])
+
+def ink_mask(binary):
+    """Return a boolean mask of ink pixels, treating the minority value as ink"""
+    dark = binary < 128
+    # Light text on a dark background: the ink is the bright part
+    if dark.mean() > 0.5:
+        return ~dark
+    return dark
+
+def glyph_height(mask):
+    """Median height of glyph-sized connected components, or None if there are none"""
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    # Drop specks, rules and images that aren't characters
+    keep = (areas >= 4) & (heights >= 3) & (heights <= mask.shape[0] // 4) & (widths <= heights * 8)
+    if not keep.any():
+        return None
+    return int(np.median(heights[keep]))
+
+def _runs(rows, offset=0):
+    """Return [(start, end)] ranges of consecutive True values"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], rows.astype(np.int8), [0]))))
+    return [(start + offset, end + offset) for start, end in zip(edges[::2].tolist(), edges[1::2].tolist())]
+
+def _close_gaps(runs, max_gap):
+    bands = []
+    for top, bottom in runs:
+        if bands and top - bands[-1][1] <= max_gap:
+            bands[-1] = (bands[-1][0], bottom)
+        else:
+            bands.append((top, bottom))
+    return bands
+
+def text_line_bands(mask, max_gap=2, glyph=None):
+    """
+    Return [(top, bottom)] row ranges (bottom exclusive) that contain text.
+
+    Rows are classified from the horizontal projection profile. Gaps of up to
+    max_gap blank rows are closed so dots and accents stay with their line.
+    With a glyph height, bands spanning several lines (touching descenders,
+    slight skew, a rule or photo bridging them) are split at their low-ink rows.
+    """
+    width = mask.shape[1]
+    profile = mask.sum(axis=1)
+    bands = _close_gaps(_runs(profile >= max(1, int(width * MIN_INK_FRACTION))), max_gap)
+
+    if glyph:
+        split = []
+        for top, bottom in bands:
+            if bottom - top <= glyph * TALL_BAND_GLYPHS:
+                split.append((top, bottom))
+                continue
+            band_profile = profile[top:bottom]
+            dense = band_profile >= np.median(band_profile) * SPLIT_INK_RATIO
+            pieces = _close_gaps(_runs(dense, top), max_gap)
+            split.extend(pieces or [(top, bottom)])
+        bands = split
+    return [(top, bottom) for top, bottom in bands if bottom - top >= MIN_BAND_HEIGHT]
+
+def analyze(binary):
+    """Compute text-line bands, typical glyph height and typical line height of a binarized page"""
+    mask = ink_mask(binary)
+    glyph = glyph_height(mask)
+    bands = text_line_bands(mask, max_gap=max(2, glyph // 4) if glyph else 2, glyph=glyph)
+
+    line_height = None
+    if bands:
+        band_heights = [bottom - top for top, bottom in bands]
+        # Only bands about one glyph tall are single lines of text
+        single = [h for h in band_heights
+                  if glyph is None or glyph * 0.5 <= h <= glyph * TALL_BAND_GLYPHS]
+        line_height = int(np.median(single or band_heights))
+    return Layout(bands, glyph, line_height)
+
+def strip_bounds(layout, row_height, image_height, margin=None):
+    """
+    Pack consecutive line bands into strips of at most row_height of text.
+
+    Returns [(top, bottom)] strips that never cut through a band (a band
+    taller than row_height gets a strip of its own) and skip the blank space
+    between strips. Each strip is padded by up to `margin` pixels of
+    background, without reaching into the neighbouring strips.
+    """
+    if margin is None:
+        margin = max(4, (layout.glyph_height or 8) // 2)
+
+    groups = []
+    for top, bottom in layout.bands:
+        if groups and bottom - groups[-1][0] <= row_height:
+            groups[-1] = (groups[-1][0], bottom)
+        else:
+            groups.append((top, bottom))
+
+    strips = []
+    for i, (top, bottom) in enumerate(groups):
+        above = groups[i - 1][1] if i > 0 else 0
+        below = groups[i + 1][0] if i + 1 < len(groups) else image_height
+        pad_top = min(margin, (top - above) // 2 if i > 0 else top - above)
+        pad_bottom = min(margin, (below - bottom) // 2 if i + 1 < len(groups) else below - bottom)
+        strips.append((top - pad_top, bottom + pad_bottom))
+    return strips
@@ -0,0 +1,152 @@
+import zlib
+import numpy as np
+from difflib import SequenceMatcher
+
+# Character n-gram size used for MinHash signatures
+SHINGLE_SIZE = 3
+
+# MinHash signature length and LSH banding (BANDS * ROWS_PER_BAND == NUM_PERM)
+NUM_PERM = 32
+BANDS = 8
+ROWS_PER_BAND = NUM_PERM // BANDS
+
+# Lines on either side of a query's expected position that are always compared
+NEIGHBOURS = 2
+
+_PRIME = (1 << 61) - 1
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 31, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=NUM_PERM).astype(np.uint64)
+
+def similarity(a, b):
+    """SequenceMatcher ratio of two strings"""
+    return SequenceMatcher(None, a, b).ratio()
+
+def similar_above(a, b, threshold):
+    """
+    Whether similarity(a, b) > threshold, computed lazily.
+
+    The cheap upper bounds real_quick_ratio (lengths) and quick_ratio
+    (character counts) rule most pairs out before the full ratio is needed;
+    the answer is always the same as comparing the full ratio.
+    """
+    matcher = SequenceMatcher(None, a, b)
+    return (matcher.real_quick_ratio() > threshold and matcher.quick_ratio() > threshold
+            and matcher.ratio() > threshold)
+
+def minhash(text):
+    """MinHash signature of a string's character n-grams, or None if it is too short"""
+    grams = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    if not grams:
+        return None
+    hashes = np.array([zlib.crc32(gram.encode('utf-8')) for gram in grams], dtype=np.uint64)
+    # Universal hashing (a * h + b) mod p, one permutation per column; h < 2^32 so no overflow
+    permuted = (hashes[:, None] * _PERM_A[None, :] + _PERM_B[None, :]) % np.uint64(_PRIME)
+    return permuted.min(axis=0)
+
+class LineIndex:
+    """
+    Index over a list of lines for finding a query's most similar line.
+
+    best_match returns exactly what a full scan with SequenceMatcher would
+    (the first line with the highest ratio above a threshold) but computes
+    full ratios for only a handful of lines. Candidates from a MinHash LSH
+    index over character n-grams and from the query's expected position in
+    reading order are compared first; every other line is then ruled out by
+    a vectorised character-count upper bound on its ratio (quick_ratio), and
+    only lines whose bound still beats the best ratio found are compared.
+    """
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self._valid = [i for i, line in enumerate(self.lines) if line.strip()]
+        self._buckets = {}
+        for i in self._valid:
+            signature = minhash(self.lines[i])
+            if signature is None:
+                continue
+            for band, key in enumerate(self._band_keys(signature)):
+                self._buckets.setdefault((band, key), []).append(i)
+
+        # Per-line character counts for the quick_ratio bound
+        alphabet = sorted({char for i in self._valid for char in self.lines[i]})
+        self._char_index = {char: k for k, char in enumerate(alphabet)}
+        self._counts = np.zeros((len(self.lines), len(alphabet) + 1), dtype=np.int32)
+        for i in self._valid:
+            for char in self.lines[i]:
+                self._counts[i, self._char_index[char]] += 1
+        self._lengths = np.array([len(line) for line in self.lines], dtype=np.int64)
+
+    @staticmethod
+    def _band_keys(signature):
+        for band in range(BANDS):
+            yield signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()
+
+    def candidates(self, query, position=None):
+        """Indices of lines likely to be similar to the query"""
+        found = set()
+        signature = minhash(query)
+        if signature is not None:
+            for band, key in enumerate(self._band_keys(signature)):
+                found.update(self._buckets.get((band, key), ()))
+        if position is not None and self._valid:
+            # Lines near the query's relative position in reading order
+            center = int(round(position * (len(self._valid) - 1)))
+            low = max(0, center - NEIGHBOURS)
+            found.update(self._valid[low:center + NEIGHBOURS + 1])
+        return found
+
+    def _upper_bounds(self, query):
+        """quick_ratio of the query against every line"""
+        counts = np.zeros(self._counts.shape[1], dtype=np.int32)
+        for char in query:
+            # Characters no indexed line contains can't match; share the spare column
+            counts[self._char_index.get(char, -1)] += 1
+        counts[-1] = 0
+        matches = np.minimum(self._counts, counts[None, :]).sum(axis=1)
+        totals = self._lengths + len(query)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(totals > 0, 2.0 * matches / totals, 1.0)
+
+    def best_match(self, query, min_ratio=0.5, position=None):
+        """
+        Return (index, ratio) of the first line with the highest ratio above
+        min_ratio, or (None, 0) if there is none.
+
+        `position` is the query's relative position (0..1) in reading order,
+        used to seed the search with the lines around it.
+        """
+        best_index, best_ratio = None, 0
+
+        def beats(index, ratio):
+            # Same tie-breaking as a left-to-right scan with a strict comparison
+            if ratio <= min_ratio:
+                return False
+            return ratio > best_ratio or (ratio == best_ratio and index < best_index)
+
+        compared = set()
+
+        def compare(index):
+            nonlocal best_index, best_ratio
+            compared.add(index)
+            matcher = SequenceMatcher(None, query, self.lines[index])
+            if not beats(index, matcher.real_quick_ratio()) or not beats(index, matcher.quick_ratio()):
+                return
+            ratio = matcher.ratio()
+            if beats(index, ratio):
+                best_index, best_ratio = index, ratio
+
+        for index in sorted(self.candidates(query, position)):
+            compare(index)
+
+        if not self._valid:
+            return best_index, best_ratio
+        bounds = self._upper_bounds(query)
+        # Remaining lines in decreasing order of their bound; stop once none can win
+        order = sorted(self._valid, key=lambda i: (-bounds[i], i))
+        for index in order:
+            if not beats(index, bounds[index]):
+                break
+            if index not in compared:
+                compare(index)
+        return best_index, best_ratio
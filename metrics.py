@@ -0,0 +1,203 @@
+import os
+import time
+import bisect
+import threading
+from functools import wraps
+
+# Collect metrics unless OCR_METRICS=0; when disabled every call returns straight away
+ENABLED = os.environ.get('OCR_METRICS', '1') != '0'
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Help text of the metrics recorded by the app and the engines
+DESCRIPTIONS = {
+    'ocr_stage_seconds': 'Time spent in each processing stage (upload, decode, rasterize, '
+                         'preprocess, inference, parse, ...)',
+    'ocr_request_seconds': 'HTTP request latency by endpoint',
+    'ocr_requests_total': 'HTTP requests by endpoint and status code',
+    'ocr_engine_seconds': 'Wall time of one engine run on one document',
+    'ocr_engine_runs_total': 'Engine runs by engine and outcome',
+    'ocr_cache_lookups_total': 'Result cache lookups by outcome',
+    'ocr_engine_in_flight': 'Engine runs currently in progress',
+    'ocr_batch_calls_total': 'Model calls made for the micro-batchers (EasyOCR makes one per image size in a batch)',
+    'ocr_batch_items_total': 'Pages/images sent to the model in those calls (divide by calls for the batch size)',
+    'ocr_psm_strips_total': 'Sliding-window strips scheduled, by strip bucket',
+    'ocr_psm_engine_calls_total': 'Tesseract calls made for scheduled strips, by strip bucket',
+    'ocr_psm_wins_total': 'Winning page segmentation mode per strip bucket, and whether it exited early',
+    'ocr_profiles_total': 'Profiled requests, and flagged requests skipped by the profiling limits',
+}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, amount=1, **labels):
+    """Add to a counter"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def add_gauge(name, amount, **labels):
+    """Move a gauge up or down"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + amount
+
+def set_gauge(name, value, **labels):
+    if not ENABLED:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, value, **labels):
+    """Record one observation (in seconds for latencies) in a histogram"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    index = bisect.bisect_left(DEFAULT_BUCKETS, value)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # Per-bucket counts (the last one is +Inf), sum, count
+            histogram = _histograms[key] = [[0] * (len(DEFAULT_BUCKETS) + 1), 0.0, 0]
+        histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+class _NoOp:
+    """Shared context manager returned while metrics are disabled"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NOOP = _NoOp()
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+class _InFlight:
+    __slots__ = ('name', 'labels')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        add_gauge(self.name, 1, **self.labels)
+        return self
+
+    def __exit__(self, *exc_info):
+        add_gauge(self.name, -1, **self.labels)
+        return False
+
+def timer(name, **labels):
+    """Context manager recording the duration of its block in histogram `name`"""
+    if not ENABLED:
+        return _NOOP
+    return _Timer(name, labels)
+
+def span(stage, engine='', **labels):
+    """Context manager timing one processing stage (ocr_stage_seconds{stage, engine})"""
+    if not ENABLED:
+        return _NOOP
+    return _Timer('ocr_stage_seconds', dict(labels, stage=stage, engine=engine))
+
+def in_flight(name, **labels):
+    """Context manager holding gauge `name` one higher while its block runs"""
+    if not ENABLED:
+        return _NOOP
+    return _InFlight(name, labels)
+
+def timed(stage, engine=''):
+    """Decorator form of span()"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage, engine):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+def render():
+    """
+    Return every metric in the Prometheus text exposition format.
+
+    Values are per process; with several gunicorn workers each worker
+    reports its own series.
+    """
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: (list(buckets), total, count) for key, (buckets, total, count) in _histograms.items()}
+
+    lines = []
+
+    def header(name, kind):
+        if name in DESCRIPTIONS:
+            lines.append(f"# HELP {name} {DESCRIPTIONS[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for kind, series in (('counter', counters), ('gauge', gauges)):
+        for name in sorted({name for name, _ in series}):
+            header(name, kind)
+            for (series_name, labels), value in sorted(series.items()):
+                if series_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+
+    for name in sorted({name for name, _ in histograms}):
+        header(name, 'histogram')
+        for (series_name, labels), (buckets, total, count) in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(list(DEFAULT_BUCKETS) + ['+Inf'], buckets):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+def reset():
+    """Forget every recorded value"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
@@ -0,0 +1,147 @@
+import os
+import time
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+import metrics
+import profiler
+
+# Longest an item waits for others to share its predictor call, and the on/off switch
+MAX_WAIT = float(os.environ.get('OCR_BATCH_MAX_WAIT_MS', 10)) / 1000
+ENABLED = os.environ.get('OCR_MICRO_BATCH', '1') != '0'
+
+_local = threading.local()
+
+@contextmanager
+def cpu_account():
+    """
+    Collect the CPU time batchers spend on items submitted by this thread.
+
+    Yields a dict whose 'cpu_seconds' grows by each item's share of the
+    batch calls it went through; those run on the batcher's worker thread,
+    so the submitting thread's own thread_time() never sees them.
+    """
+    account = {'cpu_seconds': 0.0}
+    previous = getattr(_local, 'account', None)
+    _local.account = account
+    try:
+        yield account
+    finally:
+        _local.account = previous
+
+def record_batch_call(name, size):
+    """Count one model call on `size` items; run_batch functions call this for every call they make"""
+    metrics.inc('ocr_batch_calls_total', engine=name)
+    metrics.inc('ocr_batch_items_total', size, engine=name)
+
+class MicroBatcher:
+    """
+    Coalesces items submitted by concurrent callers into batched calls.
+
+    One worker thread takes the oldest waiting item, keeps collecting until
+    max_batch_size items are queued or max_wait seconds have passed since
+    that item was submitted, calls run_batch(items) once and routes each
+    result (or the call's exception) back to the Future of the caller that
+    submitted it. Under load, pages of several requests share one predictor
+    call; a lone request waits at most max_wait longer than before. The
+    queue time is recorded as the batch_wait stage; run_batch records its
+    own inference time and model calls (see record_batch_call), since it
+    may split a batch into several calls. The worker's CPU time is shared
+    out evenly between the items of a call and charged to the cpu_account()
+    of each submitter, and while a call runs the worker is sampled by the
+    profiles of the requests whose items it holds.
+
+    The worker starts on first use in each process, so batchers created
+    before a gunicorn fork work in every worker. With enabled=False,
+    map() and submit() call run_batch directly in the calling thread.
+    """
+
+    def __init__(self, name, run_batch, max_batch_size=8, max_wait=MAX_WAIT, enabled=ENABLED):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._jobs = None
+        self._pid = None
+
+    def submit(self, item):
+        """Queue one item and return a Future of its result"""
+        if not self.enabled:
+            future = Future()
+            try:
+                future.set_result(self._call([item])[0])
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        future = Future()
+        self._ensure_worker().put((item, future, time.perf_counter(),
+                                   getattr(_local, 'account', None), profiler.current()))
+        return future
+
+    def map(self, items):
+        """Run several items (e.g. the pages of one document) and return their results in order"""
+        items = list(items)
+        if not self.enabled:
+            results = []
+            for start in range(0, len(items), self.max_batch_size):
+                results.extend(self._call(items[start:start + self.max_batch_size]))
+            return results
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def _call(self, items):
+        results = self.run_batch(items)
+        if len(results) != len(items):
+            raise ValueError(f"{self.name} returned {len(results)} results for {len(items)} inputs")
+        return results
+
+    def _ensure_worker(self):
+        # Threads don't survive fork, so each process starts its own worker
+        with self._lock:
+            if self._pid != os.getpid():
+                self._jobs = queue.Queue()
+                self._pid = os.getpid()
+                worker = threading.Thread(target=self._run, args=(self._jobs,),
+                                          name=f'{self.name}-batcher', daemon=True)
+                worker.start()
+            return self._jobs
+
+    def _run(self, jobs):
+        while True:
+            batch = [jobs.get()]
+            # Items that queued up while the previous call ran go straight into this one
+            deadline = batch[0][2] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(jobs.get(timeout=max(0.0, deadline - time.perf_counter())))
+                except queue.Empty:
+                    break
+            self._execute(batch)
+
+    def _execute(self, batch):
+        started = time.perf_counter()
+        for _, _, submitted, _, _ in batch:
+            metrics.observe('ocr_stage_seconds', started - submitted, stage='batch_wait', engine=self.name)
+        profiles = {id(profile): profile for _, _, _, _, profile in batch if profile is not None}
+        for profile in profiles.values():
+            profile.attach()
+        cpu_start = time.thread_time()
+        try:
+            results = self._call([item for item, _, _, _, _ in batch])
+        except Exception as e:
+            for _, future, _, _, _ in batch:
+                future.set_exception(e)
+            return
+        finally:
+            share = (time.thread_time() - cpu_start) / len(batch)
+            for _, _, _, account, _ in batch:
+                if account is not None:
+                    account['cpu_seconds'] += share
+            for profile in profiles.values():
+                profile.detach()
+        for (_, future, _, _, _), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file's contents"""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def make_key(digest, engine, file_type, engine_config=None, pipeline_version=None):
+    """Build a cache key from the content digest, engine, file type, engine config and pipeline version"""
+    payload = json.dumps({
+        'digest': digest,
+        'engine': engine,
+        'file_type': file_type,
+        'config': engine_config or {},
+        'pipeline': pipeline_version,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class OCRCache:
+    """
+    Content-addressed cache for OCR results.
+
+    Lookups go to an in-process LRU first and then to a size-bounded on-disk
+    tier shared by every process using the same cache directory. Disk entries
+    are evicted oldest-access-first once the tier exceeds max_disk_bytes.
+    """
+
+    def __init__(self, cache_dir, max_memory_entries=256, max_disk_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _disk_entries(self):
+        """Yield (path, size, last access time) for every entry on disk"""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _remember(self, key, value):
+        # Caller holds the lock
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached value for a key, or None on a miss"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                metrics.inc('ocr_cache_lookups_total', result='memory_hit')
+                return self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            # Refresh the access time so eviction keeps recently used entries
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.counters['misses'] += 1
+            metrics.inc('ocr_cache_lookups_total', result='miss')
+            return None
+
+        with self._lock:
+            self.counters['disk_hits'] += 1
+            self._remember(key, value)
+        metrics.inc('ocr_cache_lookups_total', result='disk_hit')
+        return value
+
+    def put(self, key, value):
+        """Store a JSON-serialisable value in both tiers"""
+        data = json.dumps(value).encode('utf-8')
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write atomically so concurrent readers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._remember(key, value)
+            self.counters['stores'] += 1
+            self._disk_bytes += len(data)
+            over_limit = self._disk_bytes > self.max_disk_bytes
+        if over_limit:
+            self._evict()
+
+    def _evict(self):
+        """Drop the least recently used disk entries until the tier fits again"""
+        with self._lock:
+            # Rescan so sizes written by other processes are accounted for
+            entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            target = self.max_disk_bytes * 0.9
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.counters['evictions'] += 1
+            self._disk_bytes = total
+
+    def stats(self):
+        """Return hit/miss counters and tier sizes"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_bytes'] = self._disk_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 3) if lookups else 0.0
+        return stats
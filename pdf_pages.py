@@ -0,0 +1,310 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+
+import cv2
+import numpy as np
+import pdf2image
+
+import metrics
+import profiler
+
+# Pages rasterized per pdf2image call; bounds how many pages are held in memory
+DEFAULT_WINDOW = 2
+
+# pdf2image's default resolution, used by engines that don't declare a RASTER_PROFILE
+DEFAULT_DPI = 200
+
+# Disk a PageStore may use for stored pages; past it, consumers rasterize the rest themselves
+MAX_STORE_BYTES = int(os.environ.get('OCR_PAGE_STORE_MB', 256)) * 1024 * 1024
+
+# Rasterizer processes per pdf2image call; the pages of a window are split between them
+RASTER_THREADS = int(os.environ.get('OCR_RASTER_THREADS', min(2, os.cpu_count() or 1)))
+
+# How an engine wants its PDF pages rendered: resolution, 8-bit grayscale instead of
+# RGB, rasterizer processes per call, and pdftocairo instead of pdftoppm
+RasterProfile = namedtuple('RasterProfile', ['dpi', 'grayscale', 'thread_count', 'use_pdftocairo'])
+
+def raster_profile(dpi=DEFAULT_DPI, grayscale=False, thread_count=RASTER_THREADS, use_pdftocairo=False):
+    return RasterProfile(dpi, grayscale, thread_count, use_pdftocairo)
+
+DEFAULT_PROFILE = raster_profile()
+
+def as_profile(profile):
+    """Return a RasterProfile for a profile, a bare DPI or None (the default profile)"""
+    if profile is None:
+        return DEFAULT_PROFILE
+    if isinstance(profile, RasterProfile):
+        return profile
+    return DEFAULT_PROFILE._replace(dpi=int(profile))
+
+def profile_for(module):
+    """The raster profile an engine module declares, or the default one"""
+    return getattr(module, 'RASTER_PROFILE', DEFAULT_PROFILE)
+
+def _convert_options(profile):
+    """pdf2image.convert_from_path options of a profile"""
+    return {
+        'dpi': profile.dpi,
+        'grayscale': profile.grayscale,
+        'thread_count': profile.thread_count,
+        'use_pdftocairo': profile.use_pdftocairo,
+    }
+
+def _window(profile):
+    # Give every rasterizer process at least one page per call
+    return max(DEFAULT_WINDOW, profile.thread_count)
+
+def _rendering_key(profile):
+    # The thread count only changes how fast pages are rendered, not the pages
+    return profile.dpi, profile.grayscale, profile.use_pdftocairo
+
+def _rendering_name(profile):
+    return f"{profile.dpi}dpi{'-gray' if profile.grayscale else ''}{'-cairo' if profile.use_pdftocairo else ''}"
+
+def page_gray(page):
+    """Grayscale version of a page array; pages from grayscale profiles are returned as they are"""
+    return page if page.ndim == 2 else cv2.cvtColor(page, cv2.COLOR_RGB2GRAY)
+
+_DONE = object()
+
+def page_count(pdf_path):
+    """Return the number of pages in a PDF without rasterizing it"""
+    return int(pdf2image.pdfinfo_from_path(pdf_path)['Pages'])
+
+def _page_windows(first_page, last_page, window):
+    """Split an inclusive page range into (first, last) windows"""
+    start = first_page
+    while start <= last_page:
+        end = min(start + window - 1, last_page)
+        yield start, end
+        start = end + 1
+
+def iter_pdf_pages(pdf_path, first_page=None, last_page=None, window=DEFAULT_WINDOW,
+                   prefetch=True, **convert_kwargs):
+    """
+    Yield (page_number, PIL image) for each page of a PDF.
+
+    Pages are rasterized `window` pages at a time with pdf2image's
+    first_page/last_page options instead of converting the whole document up
+    front, so peak memory stays flat regardless of page count. With
+    prefetch=True a background thread rasterizes the next window while the
+    caller is still processing the current page. Extra keyword arguments
+    (dpi, grayscale, ...) are passed to pdf2image.convert_from_path.
+    """
+    total = page_count(pdf_path)
+    first_page = max(1, first_page or 1)
+    last_page = min(total, last_page or total)
+    if first_page > last_page:
+        return
+
+    def rasterize(start, end):
+        with metrics.span('rasterize'):
+            images = pdf2image.convert_from_path(pdf_path, first_page=start, last_page=end,
+                                                 **convert_kwargs)
+        return zip(range(start, end + 1), images)
+
+    if not prefetch:
+        for start, end in _page_windows(first_page, last_page, window):
+            yield from rasterize(start, end)
+        return
+
+    # The producer stays at most one window ahead of the consumer
+    pages = queue.Queue(maxsize=window)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for start, end in _page_windows(first_page, last_page, window):
+                for page in rasterize(start, end):
+                    if not put(page):
+                        return
+            put(_DONE)
+        except Exception as e:
+            put(e)
+
+    producer = threading.Thread(target=profiler.propagate(produce), name='pdf-rasterizer', daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = pages.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Also reached when the caller stops iterating early
+        stop.set()
+        producer.join()
+
+def pdf_page_arrays(pdf_path, first_page=None, last_page=None, profile=DEFAULT_PROFILE, pages=None):
+    """
+    Yield (page_number, ndarray) for each page of a PDF.
+
+    Pages are RGB, or 2-D grayscale for grayscale profiles (rendered that
+    way by poppler, so no colour conversion is needed). If `pages` is given
+    (e.g. from PageStore.pages) those already rasterized pages are used;
+    otherwise the PDF is streamed with iter_pdf_pages.
+    """
+    if pages is not None:
+        yield from pages
+        return
+    profile = as_profile(profile)
+    for page_number, image in iter_pdf_pages(pdf_path, first_page, last_page, window=_window(profile),
+                                             **_convert_options(profile)):
+        yield page_number, np.asarray(image)
+
+class _Rendering:
+    """Rasterization of one PDF with one profile, filled in by a background thread"""
+
+    def __init__(self):
+        self.paths = []
+        self.done = False
+        self.error = None
+        # First page left out because the store ran out of disk budget
+        self.unstored_from = None
+        self.condition = threading.Condition()
+
+class PageStore:
+    """
+    Per-request store of rasterized PDF pages shared by every engine.
+
+    Each raster profile (DPI, grayscale, backend) is rasterized at most once,
+    in the background, and each page is written to a .npy file in a private
+    temp directory as soon as it is ready. Engines iterating pages() get
+    read-only memory-mapped arrays, so several engines can consume the same
+    pages concurrently (and while rasterization is still in progress)
+    without holding the whole document in memory.
+
+    `profiles` lists the profiles the request is going to use. A grayscale
+    profile whose colour counterpart is among them is served by converting
+    the colour pages, which is cheaper than rasterizing the PDF again.
+
+    Stored pages are uncompressed, so the store stops writing once they
+    take up max_bytes; consumers then rasterize the remaining pages
+    themselves, a window at a time, as if no store had been given.
+    """
+
+    def __init__(self, pdf_path, first_page=None, last_page=None, work_dir=None, profiles=(),
+                 max_bytes=MAX_STORE_BYTES):
+        self.pdf_path = pdf_path
+        self.first_page = first_page
+        self.last_page = last_page
+        self.max_bytes = max_bytes
+        self._dir = tempfile.mkdtemp(prefix='pages-', dir=work_dir)
+        self._profiles = [as_profile(profile) for profile in profiles]
+        self._colour_keys = {_rendering_key(profile) for profile in self._profiles if not profile.grayscale}
+        self._renderings = {}
+        self._stored_bytes = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _rendering(self, profile):
+        """Return the rendering for a profile, starting it on first request"""
+        key = _rendering_key(profile)
+        with self._lock:
+            rendering = self._renderings.get(key)
+            if rendering is None:
+                rendering = _Rendering()
+                self._renderings[key] = rendering
+                worker = threading.Thread(target=profiler.propagate(self._render), args=(profile, rendering),
+                                          name=f'page-store-{_rendering_name(profile)}', daemon=True)
+                worker.start()
+        return rendering
+
+    def _render(self, profile, rendering):
+        try:
+            for page_number, image in iter_pdf_pages(self.pdf_path, self.first_page, self.last_page,
+                                                     window=_window(profile), **_convert_options(profile)):
+                if self._closed.is_set():
+                    break
+                page = np.asarray(image)
+                with self._lock:
+                    if self._stored_bytes + page.nbytes > self.max_bytes:
+                        rendering.unstored_from = page_number
+                        break
+                    self._stored_bytes += page.nbytes
+                path = os.path.join(self._dir, f"{_rendering_name(profile)}_{page_number:05d}.npy")
+                np.save(path, page)
+                with rendering.condition:
+                    rendering.paths.append((page_number, path))
+                    rendering.condition.notify_all()
+        except Exception as e:
+            rendering.error = e
+        finally:
+            with rendering.condition:
+                rendering.done = True
+                rendering.condition.notify_all()
+
+    def pages(self, profile=DEFAULT_PROFILE):
+        """Yield (page_number, read-only ndarray) as pages become available (RGB, or 2-D gray)"""
+        profile = as_profile(profile)
+        colour = profile._replace(grayscale=False)
+        if profile.grayscale and _rendering_key(colour) in self._colour_keys:
+            for page_number, page in self._stored_pages(colour, profile):
+                yield page_number, page_gray(page)
+            return
+        yield from self._stored_pages(profile, profile)
+
+    def _stored_pages(self, profile, unstored_profile):
+        """Yield the pages stored for a profile, then rasterize any left out with unstored_profile"""
+        rendering = self._rendering(profile)
+        index = 0
+        while True:
+            with rendering.condition:
+                while index >= len(rendering.paths) and not rendering.done:
+                    rendering.condition.wait()
+                if index >= len(rendering.paths):
+                    if rendering.error is not None:
+                        raise rendering.error
+                    break
+                page_number, path = rendering.paths[index]
+            yield page_number, np.load(path, mmap_mode='r')
+            index += 1
+        if rendering.unstored_from is not None:
+            yield from pdf_page_arrays(self.pdf_path, rendering.unstored_from, self.last_page, unstored_profile)
+
+    def first_page_image(self):
+        """
+        Return page 1 from a colour rendering one of the store's profiles asks for anyway.
+
+        Returns None when there is no such rendering or the page range does
+        not start at page 1, so a caller can render page 1 on its own
+        instead of starting a rasterization nobody else needs.
+        """
+        colour = [profile for profile in self._profiles if not profile.grayscale]
+        if not colour or (self.first_page or 1) != 1:
+            return None
+        for _, page in self.pages(colour[0]):
+            return page
+        return None
+
+    def close(self):
+        """Stop background rasterization and delete the stored pages"""
+        self._closed.set()
+        with self._lock:
+            renderings = list(self._renderings.values())
+        for rendering in renderings:
+            with rendering.condition:
+                while not rendering.done:
+                    rendering.condition.wait()
+        shutil.rmtree(self._dir, ignore_errors=True)
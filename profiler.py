@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import uuid
+import random
+import zlib
+import threading
+from functools import wraps
+from html import escape
+
+# Where collapsed stacks and flamegraphs are written, and how many profiles to keep
+PROFILE_DIR = os.environ.get('OCR_PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.environ.get('OCR_PROFILE_KEEP', 50))
+
+# Sampling limits: seconds between stack samples, and the most samples/seconds per profile
+SAMPLE_INTERVAL = float(os.environ.get('OCR_PROFILE_INTERVAL', 0.01))
+MAX_SAMPLES = int(os.environ.get('OCR_PROFILE_MAX_SAMPLES', 20000))
+MAX_SECONDS = float(os.environ.get('OCR_PROFILE_MAX_SECONDS', 120))
+
+# Load limits: profiles running at once, and the minimum gap between two profiles
+MAX_CONCURRENT = int(os.environ.get('OCR_PROFILE_MAX_CONCURRENT', 1))
+MIN_GAP_SECONDS = float(os.environ.get('OCR_PROFILE_MIN_GAP', 10))
+
+# Flamegraph geometry (pixels)
+SVG_WIDTH = 1200
+FRAME_HEIGHT = 16
+MIN_FRAME_WIDTH = 0.5
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+_state_lock = threading.Lock()
+_last_start = None
+_local = threading.local()
+
+# Admin toggle: profile the next `remaining` /process requests, and/or a random fraction of them
+_toggle = {'remaining': 0, 'sample_rate': 0.0}
+
+def configure(remaining=None, sample_rate=None):
+    """Arm the admin toggle and return its state"""
+    with _state_lock:
+        if remaining is not None:
+            _toggle['remaining'] = max(0, int(remaining))
+        if sample_rate is not None:
+            _toggle['sample_rate'] = min(1.0, max(0.0, float(sample_rate)))
+        return dict(_toggle)
+
+def toggle_state():
+    with _state_lock:
+        return dict(_toggle)
+
+def wanted_by_toggle():
+    """Whether the admin toggle selects the current request (consumes one of `remaining`)"""
+    with _state_lock:
+        if _toggle['remaining'] > 0:
+            _toggle['remaining'] -= 1
+            return True
+        return _toggle['sample_rate'] > 0 and random.random() < _toggle['sample_rate']
+
+def current():
+    """The profile the calling thread contributes samples to, if any"""
+    return getattr(_local, 'profile', None)
+
+def propagate(func):
+    """
+    Wrap a callable handed to another thread so that thread is sampled too.
+
+    The profile is captured when propagate() is called, so wrap at submit
+    time; without an active profile the callable is returned unchanged.
+    """
+    profile = current()
+    if profile is None:
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = current()
+        _local.profile = profile
+        profile.attach()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.detach()
+            _local.profile = previous
+    return wrapper
+
+def frame_label(code):
+    # ';' separates frames in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the threads working on one request.
+
+    The request thread is attached on start(); threads that run work for the
+    request (engine pool, PDF rasterizer) attach themselves through
+    propagate(). A background thread reads sys._current_frames() every
+    `interval` seconds and counts each attached thread's stack, rooted at the
+    thread's name. Sampling stops on its own after `max_samples` samples or
+    `max_seconds`, so a runaway request cannot grow the profile without bound.
+    """
+
+    def __init__(self, name, interval=SAMPLE_INTERVAL, max_samples=MAX_SAMPLES, max_seconds=MAX_SECONDS):
+        self.name = name
+        self.interval = interval
+        self.max_samples = max_samples
+        self.max_seconds = max_seconds
+        self.stacks = {}
+        self.samples = 0
+        self.truncated = False
+        self.duration = 0.0
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def attach(self, thread=None):
+        thread = thread or threading.current_thread()
+        with self._lock:
+            self._threads[thread.ident] = thread.name
+
+    def detach(self, thread=None):
+        thread = thread or threading.current_thread()
+        with self._lock:
+            self._threads.pop(thread.ident, None)
+
+    def start(self):
+        self._start = time.perf_counter()
+        _local.profile = self
+        self.attach()
+        self._thread = threading.Thread(target=self._run, name='ocr-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.detach()
+        if current() is self:
+            _local.profile = None
+        self.duration = time.perf_counter() - self._start
+
+    def _run(self):
+        deadline = self._start + self.max_seconds
+        while not self._stop.wait(self.interval):
+            if self.samples >= self.max_samples or time.perf_counter() > deadline:
+                self.truncated = True
+                return
+            with self._lock:
+                threads = dict(self._threads)
+            frames = sys._current_frames()
+            for ident, thread_name in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                labels.append(thread_name.replace(';', ':'))
+                stack = ';'.join(reversed(labels))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+            del frames
+
+    def collapsed(self):
+        """Stacks in the collapsed ("folded") format read by flamegraph.pl and speedscope"""
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+def _frame_color(label):
+    # Stable warm colours so a function keeps its colour across profiles
+    value = zlib.crc32(label.encode('utf-8'))
+    return f"rgb({205 + value % 50},{(value >> 8) % 180},{(value >> 16) % 55})"
+
+def flamegraph_svg(stacks, title='Flame graph'):
+    """Render {collapsed stack: count} as a standalone SVG flame graph"""
+    # Merge the stacks into a tree of [count, children]
+    root = [0, {}]
+    for stack, count in stacks.items():
+        root[0] += count
+        node = root
+        for label in stack.split(';'):
+            node = node[1].setdefault(label, [0, {}])
+            node[0] += count
+
+    def depth_of(node):
+        return 1 + max((depth_of(child) for child in node[1].values()), default=0)
+
+    depth = depth_of(root) if root[0] else 1
+    height = (depth + 2) * FRAME_HEIGHT
+    scale = SVG_WIDTH / root[0] if root[0] else 0
+
+    rects = []
+
+    def draw(label, node, x, level):
+        width = node[0] * scale
+        if width < MIN_FRAME_WIDTH:
+            return
+        y = height - (level + 1) * FRAME_HEIGHT
+        percent = 100.0 * node[0] / root[0]
+        text = escape(label)
+        # Roughly 7px per character at font-size 12
+        shown = text if len(label) * 7 < width - 6 else escape(label[:max(0, int((width - 6) / 7) - 2)] + '..')
+        rects.append(
+            f'<g><title>{text} ({node[0]} samples, {percent:.2f}%)</title>'
+            f'<rect x="{x:.2f}" y="{y}" width="{width:.2f}" height="{FRAME_HEIGHT - 1}" '
+            f'fill="{_frame_color(label)}" rx="2"/>'
+            + (f'<text x="{x + 3:.2f}" y="{y + FRAME_HEIGHT - 4}">{shown}</text>' if width > 21 else '')
+            + '</g>')
+        for child_label, child in sorted(node[1].items()):
+            draw(child_label, child, x, level + 1)
+            x += child[0] * scale
+
+    draw('all', root, 0.0, 0)
+    return (f'<?xml version="1.0" standalone="no"?>\n'
+            f'<svg version="1.1" xmlns="http://www.w3.org/2000/svg" width="{SVG_WIDTH}" height="{height}" '
+            f'font-family="Verdana, sans-serif" font-size="12">\n'
+            f'<rect width="100%" height="100%" fill="#fdfdf5"/>\n'
+            f'<text x="{SVG_WIDTH / 2}" y="{FRAME_HEIGHT}" text-anchor="middle" font-size="14">'
+            f'{escape(title)}</text>\n'
+            + '\n'.join(rects) + '\n</svg>\n')
+
+def try_start(name):
+    """
+    Start a profile unless the load limits forbid it.
+
+    Returns (profiler, None) or (None, reason) when the request has to run
+    unprofiled.
+    """
+    global _last_start
+    if not _slots.acquire(blocking=False):
+        return None, 'another profile is running'
+    with _state_lock:
+        now = time.monotonic()
+        if _last_start is not None and now - _last_start < MIN_GAP_SECONDS:
+            _slots.release()
+            return None, f'profiles are limited to one every {MIN_GAP_SECONDS:g}s'
+        _last_start = now
+    return SamplingProfiler(name).start(), None
+
+def finish(profiler, output_dir=PROFILE_DIR):
+    """Stop a profile, write <id>.collapsed and <id>.svg and return a summary"""
+    try:
+        profiler.stop()
+    finally:
+        _slots.release()
+    os.makedirs(output_dir, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    collapsed_file = f"{profile_id}.collapsed"
+    svg_file = f"{profile_id}.svg"
+    with open(os.path.join(output_dir, collapsed_file), 'w') as f:
+        f.write(profiler.collapsed())
+    title = f"{profiler.name} - {profiler.samples} samples, {profiler.duration:.2f}s"
+    with open(os.path.join(output_dir, svg_file), 'w') as f:
+        f.write(flamegraph_svg(profiler.stacks, title))
+    prune(output_dir)
+    return {
+        'id': profile_id,
+        'collapsed': collapsed_file,
+        'flamegraph': svg_file,
+        'samples': profiler.samples,
+        'interval_ms': round(profiler.interval * 1000, 2),
+        'duration_ms': round(profiler.duration * 1000, 1),
+        'truncated': profiler.truncated,
+    }
+
+def prune(output_dir=PROFILE_DIR, keep=PROFILE_KEEP):
+    """Delete all but the newest `keep` profiles"""
+    profiles = {}
+    for name in os.listdir(output_dir):
+        stem, ext = os.path.splitext(name)
+        if ext in ('.collapsed', '.svg'):
+            profiles.setdefault(stem, []).append(os.path.join(output_dir, name))
+    for stem in sorted(profiles)[:-keep or None]:
+        for path in profiles[stem]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
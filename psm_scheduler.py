@@ -0,0 +1,107 @@
+import os
+import threading
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+import metrics
+
+# Order in which page segmentation modes are tried for each kind of strip
+# (6=Block of text, 7=Single line, 3=Auto). Tune from the ocr_psm_* metrics on /metrics.
+PSM_ORDER = {
+    'single_line': [7, 6, 3],
+    'block': [6, 3, 7],
+    'sparse': [3, 6, 7],
+}
+
+# Stop trying further modes once a result's average word confidence reaches this
+EARLY_EXIT_CONF = float(os.environ.get('OCR_PSM_EARLY_EXIT_CONF', '85'))
+
+StripFeatures = namedtuple('StripFeatures', ['height', 'ink_density', 'components', 'glyph_height'])
+
+def strip_features(mask, glyph_height=None):
+    """Cheap features of a strip from its boolean ink mask"""
+    components = cv2.connectedComponents(mask.astype(np.uint8), connectivity=8)[0] - 1
+    return StripFeatures(mask.shape[0], float(mask.mean()) if mask.size else 0.0, components, glyph_height)
+
+def classify(features):
+    """Bucket a strip into one of the PSM_ORDER keys, or 'blank' if it has no ink"""
+    if features.components == 0:
+        return 'blank'
+    glyph = features.glyph_height or 10
+    if features.height <= glyph * 2.5:
+        return 'single_line'
+    # Tall regions with little ink per row are forms, photos and scattered labels
+    if features.height > glyph * 12 or features.ink_density < 0.02:
+        return 'sparse'
+    return 'block'
+
+class PSMScheduler:
+    """
+    Chooses which page segmentation modes to run on a strip, and in what order.
+
+    The order comes from the strip's bucket (see classify); callers stop as
+    soon as a result reaches the early-exit confidence. Every decision is
+    counted so the order table can be tuned from real traffic: `wins` counts
+    the winning mode of strips that ran their whole schedule, which is the
+    unbiased signal for reordering a bucket. The same counts are exported
+    as ocr_psm_strips_total, ocr_psm_engine_calls_total and
+    ocr_psm_wins_total{bucket,psm,early_exit}.
+    """
+
+    def __init__(self, order=None, early_exit_conf=EARLY_EXIT_CONF):
+        self.order = order or PSM_ORDER
+        self.early_exit_conf = early_exit_conf
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def plan(self, features):
+        """Return (bucket, [psm, ...]) for a strip; blank strips get no modes"""
+        bucket = classify(features)
+        return bucket, list(self.order.get(bucket, []))
+
+    def should_stop(self, avg_conf):
+        """Whether a result is confident enough to skip the remaining modes"""
+        return avg_conf >= self.early_exit_conf
+
+    def record(self, bucket, winner, calls, early_exit):
+        """Count the outcome of one strip"""
+        with self._lock:
+            stats = self._stats.setdefault(bucket, {'strips': 0, 'engine_calls': 0, 'early_exits': 0,
+                                                    'wins': {}, 'early_exit_wins': {}})
+            stats['strips'] += 1
+            stats['engine_calls'] += calls
+            if winner is not None:
+                key = str(winner)
+                if early_exit:
+                    stats['early_exits'] += 1
+                    stats['early_exit_wins'][key] = stats['early_exit_wins'].get(key, 0) + 1
+                else:
+                    stats['wins'][key] = stats['wins'].get(key, 0) + 1
+        metrics.inc('ocr_psm_strips_total', bucket=bucket)
+        metrics.inc('ocr_psm_engine_calls_total', calls, bucket=bucket)
+        if winner is not None:
+            metrics.inc('ocr_psm_wins_total', bucket=bucket, psm=str(winner), early_exit=str(early_exit).lower())
+
+    def stats(self):
+        """Per-bucket counters plus the average engine calls per strip"""
+        with self._lock:
+            buckets = {bucket: {**stats, 'wins': dict(stats['wins']),
+                                'early_exit_wins': dict(stats['early_exit_wins'])}
+                       for bucket, stats in self._stats.items()}
+        strips = sum(stats['strips'] for stats in buckets.values())
+        calls = sum(stats['engine_calls'] for stats in buckets.values())
+        return {
+            'buckets': buckets,
+            'strips': strips,
+            'engine_calls': calls,
+            'calls_per_strip': round(calls / strips, 3) if strips else 0.0,
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+# Shared scheduler whose statistics cover every document processed by this process
+default_scheduler = PSMScheduler()
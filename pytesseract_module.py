@@ -1,125 +1,169 @@
 import os
 import cv2
-import pytesseract
+import metrics
+import tesseract_backend
 import numpy as np
 from PIL import Image
-import pdf2image
+from pdf_pages import page_gray, pdf_page_arrays, raster_profile
+from ingest import as_gray
 import re
 import json
 
 # Set the path to tesseract executable if not in PATH
 # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'  # Uncomment and adjust for Windows
 
+# Engine label of this module's metrics
+ENGINE_NAME = 'pytesseract'
+
+# Settings that affect OCR output (part of the result cache key); every path below reads them
+ENGINE_CONFIG = {'oem': 3, 'psm': 3, 'lang': 'eng', 'binary_threshold': 150,
+                 'handwriting_block_size': 11, 'handwriting_c': 2}
+
+# Bump whenever a code change can alter this engine's output, so cached results are not reused
+PIPELINE_VERSION = 1
+
+# Tesseract options built from ENGINE_CONFIG
+TESSERACT_CONFIG = f"--oem {ENGINE_CONFIG['oem']} --psm {ENGINE_CONFIG['psm']} -l {ENGINE_CONFIG['lang']}"
+
+# How PDF pages are rasterized for this engine: every path starts from grayscale,
+# so poppler renders gray pages directly
+RASTER_PROFILE = raster_profile(dpi=200, grayscale=True)
+
+# Every preprocessing path starts from grayscale, so uploads can be decoded straight to it
+INPUT_MODE = 'gray'
+
+# Tesseract runs in-process through tesseract_backend (or as an external binary),
+# so "loading" only checks that the backend is usable
+_tesseract_version = None
+_backend_error = None
+
+def load_model():
+    """Check the Tesseract backend is available and return its version"""
+    global _tesseract_version, _backend_error
+    if _tesseract_version is None:
+        try:
+            _tesseract_version = tesseract_backend.get_version()
+        except Exception as e:
+            _backend_error = str(e)
+            raise
+        _backend_error = None
+    return _tesseract_version
+
+def is_loaded():
+    """There is no model to load, so the engine is ready unless the backend check failed"""
+    return _backend_error is None
+
 def extract_text_from_image(image_path):
-    """Extract text from an image using pytesseract"""
+    """Extract text from an image (file path or decoded array) using pytesseract"""
     try:
-        # Read image using OpenCV for preprocessing
-        img = cv2.imread(image_path)
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        # Apply threshold to get image with only black and white
-        _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
+        # Read image (or use the decoded array) directly as grayscale
+        with metrics.span('preprocess', ENGINE_NAME):
+            gray = as_gray(image_path)
+            # Apply threshold to get image with only black and white
+            _, binary = cv2.threshold(gray, ENGINE_CONFIG['binary_threshold'], 255, cv2.THRESH_BINARY)
         
         # Use pytesseract to extract text
-        custom_config = r'--oem 3 --psm 3'
-        text = pytesseract.image_to_string(binary, config=custom_config)
+        with metrics.span('inference', ENGINE_NAME):
+            text = tesseract_backend.image_to_string(binary, config=TESSERACT_CONFIG)
         
         return text.strip()
     except Exception as e:
         return f"Error processing image with PyTesseract: {str(e)}"
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from a PDF using pytesseract"""
+def extract_text_from_pdf(pdf_path, on_page=None, first_page=None, last_page=None, pages=None):
+    """Extract text from a PDF (optionally a page range) using pytesseract"""
     try:
-        # Convert PDF to images
-        images = pdf2image.convert_from_path(pdf_path)
         all_text = []
         
-        # Process each page
-        for i, image in enumerate(images):
-            # Convert PIL image to numpy array
-            opencvImage = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            # Convert to grayscale
-            gray = cv2.cvtColor(opencvImage, cv2.COLOR_BGR2GRAY)
-            # Apply threshold
-            _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
+        # Use the shared pages if given, otherwise rasterize a small window at a time
+        for page_number, image in pdf_page_arrays(pdf_path, first_page, last_page, RASTER_PROFILE, pages):
+            # Pages arrive in grayscale (converted only if shared colour pages were given)
+            with metrics.span('preprocess', ENGINE_NAME):
+                gray = page_gray(image)
+                # Apply threshold
+                _, binary = cv2.threshold(gray, ENGINE_CONFIG['binary_threshold'], 255, cv2.THRESH_BINARY)
             
             # Extract text
-            custom_config = r'--oem 3 --psm 3'
-            text = pytesseract.image_to_string(binary, config=custom_config)
-            all_text.append(f"--- Page {i+1} ---\n{text}")
+            with metrics.span('inference', ENGINE_NAME):
+                text = tesseract_backend.image_to_string(binary, config=TESSERACT_CONFIG)
+            all_text.append(f"--- Page {page_number} ---\n{text}")
+            
+            # Report the finished page to the caller
+            if on_page:
+                on_page(page_number, text)
         
         return "\n\n".join(all_text)
     except Exception as e:
         return f"Error processing PDF with PyTesseract: {str(e)}"
 
 def recognize_handwriting(image_path):
-    """Recognize handwritten text from an image using pytesseract"""
+    """Recognize handwritten text from an image (file path or decoded array) using pytesseract"""
     try:
-        # Read image
-        img = cv2.imread(image_path)
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Read image (or use the decoded array) directly as grayscale
+        with metrics.span('preprocess', ENGINE_NAME):
+            gray = as_gray(image_path)
         
-        # Apply preprocessing specifically for handwriting
-        # Apply adaptive thresholding
-        binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                      cv2.THRESH_BINARY_INV, 11, 2)
-        # Apply morphological operations to reduce noise
-        kernel = np.ones((1, 1), np.uint8)
-        binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-        binary = cv2.dilate(binary, kernel, iterations=1)
+            # Apply preprocessing specifically for handwriting
+            # Apply adaptive thresholding
+            binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                          cv2.THRESH_BINARY_INV, ENGINE_CONFIG['handwriting_block_size'],
+                                          ENGINE_CONFIG['handwriting_c'])
+            # Apply morphological operations to reduce noise
+            kernel = np.ones((1, 1), np.uint8)
+            binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+            binary = cv2.dilate(binary, kernel, iterations=1)
         
         # Recognize text with specific configuration for handwriting
-        custom_config = r'--oem 3 --psm 3 -l eng'
-        text = pytesseract.image_to_string(binary, config=custom_config)
+        with metrics.span('inference', ENGINE_NAME):
+            text = tesseract_backend.image_to_string(binary, config=TESSERACT_CONFIG)
         
         return text.strip()
     except Exception as e:
         return f"Error recognizing handwriting with PyTesseract: {str(e)}"
 
 def extract_invoice_data(image_path):
-    """Extract structured data from an invoice image using pytesseract"""
+    """Extract structured data from an invoice image (file path or decoded array) using pytesseract"""
     try:
-        # Read image
-        img = cv2.imread(image_path)
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        # Apply threshold
-        _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
+        # Read image (or use the decoded array) directly as grayscale
+        with metrics.span('preprocess', ENGINE_NAME):
+            gray = as_gray(image_path)
+            # Apply threshold
+            _, binary = cv2.threshold(gray, ENGINE_CONFIG['binary_threshold'], 255, cv2.THRESH_BINARY)
         
         # Extract all text
-        text = pytesseract.image_to_string(binary)
+        with metrics.span('inference', ENGINE_NAME):
+            text = tesseract_backend.image_to_string(binary, config=TESSERACT_CONFIG)
         
         # Parse invoice data
-        invoice_data = {
-            'invoice_number': None,
-            'date': None,
-            'total_amount': None,
-            'vendor': None,
-            'items': []
-        }
+        with metrics.span('parse', ENGINE_NAME):
+            invoice_data = {
+                'invoice_number': None,
+                'date': None,
+                'total_amount': None,
+                'vendor': None,
+                'items': []
+            }
         
-        # Extract invoice number (common formats include "Invoice #", "Invoice Number", etc.)
-        invoice_match = re.search(r'(?i)invoice\s*(?:#|number|num|no|no\.)\s*[:\s]?\s*([a-zA-Z0-9\-]+)', text)
-        if invoice_match:
-            invoice_data['invoice_number'] = invoice_match.group(1)
+            # Extract invoice number (common formats include "Invoice #", "Invoice Number", etc.)
+            invoice_match = re.search(r'(?i)invoice\s*(?:#|number|num|no|no\.)\s*[:\s]?\s*([a-zA-Z0-9\-]+)', text)
+            if invoice_match:
+                invoice_data['invoice_number'] = invoice_match.group(1)
         
-        # Extract date
-        date_match = re.search(r'(?i)(?:date|dated)?\s*[:\s]?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})', text)
-        if date_match:
-            invoice_data['date'] = date_match.group(1)
+            # Extract date
+            date_match = re.search(r'(?i)(?:date|dated)?\s*[:\s]?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})', text)
+            if date_match:
+                invoice_data['date'] = date_match.group(1)
         
-        # Extract total amount
-        amount_match = re.search(r'(?i)(?:total|amount|sum)?\s*(?:due|:)?\s*[\$£€]?\s*(\d+[.,]\d{2})', text)
-        if amount_match:
-            invoice_data['total_amount'] = amount_match.group(1)
+            # Extract total amount
+            amount_match = re.search(r'(?i)(?:total|amount|sum)?\s*(?:due|:)?\s*[\$£€]?\s*(\d+[.,]\d{2})', text)
+            if amount_match:
+                invoice_data['total_amount'] = amount_match.group(1)
         
-        # Try to extract vendor name (often at the top of the invoice)
-        lines = text.split('\n')
-        non_empty_lines = [line.strip() for line in lines if line.strip()]
-        if non_empty_lines:
-            invoice_data['vendor'] = non_empty_lines[0]
+            # Try to extract vendor name (often at the top of the invoice)
+            lines = text.split('\n')
+            non_empty_lines = [line.strip() for line in lines if line.strip()]
+            if non_empty_lines:
+                invoice_data['vendor'] = non_empty_lines[0]
         
         return json.dumps(invoice_data, indent=2)
     except Exception as e:
@@ -0,0 +1,137 @@
+import os
+import math
+import threading
+from collections import namedtuple
+
+import cv2
+
+import layout_analysis
+import metrics
+from ingest import as_gray
+
+# Rescale images so their median glyph height matches the engine's target before OCR
+ENABLED = os.environ.get('OCR_RESOLUTION_GOVERNOR', '1') != '0'
+
+# Enlarging small text is opt-in: the measured median component height is
+# close to the x-height, so most pages sit below the targets and would be
+# enlarged 1.7x-2.7x (on the sample corpus), costing latency without a shown
+# accuracy win. Run benchmarks/resolution_benchmark.py on your own documents
+# before turning it on.
+UPSCALE = os.environ.get('OCR_RESOLUTION_UPSCALE', '0') == '1'
+
+# Median glyph height (pixels) each engine recognizes best at. DocTR is left
+# out because it resizes every page to its own fixed input size anyway.
+TARGET_TEXT_HEIGHT = {
+    'pytesseract': 24,
+    'text_box': 24,
+    'easyocr': 20,
+}
+
+# Images whose text is already within this factor of the target are left alone
+TOLERANCE = 1.3
+
+# Bounds on the applied scale, and on the pixel count of an upscaled image
+MIN_SCALE = 0.2
+MAX_SCALE = 4.0
+MAX_PIXELS = 25 * 1000 * 1000
+
+# Longest side the text height is measured at (keeps the estimate cheap on huge photos)
+ESTIMATE_SIDE = 1200
+
+Rescale = namedtuple('Rescale', ['image', 'scale', 'text_height', 'target'])
+
+def _glyph_height(gray, factor):
+    if factor < 1.0:
+        gray = cv2.resize(gray, (max(1, int(gray.shape[1] * factor)), max(1, int(gray.shape[0] * factor))),
+                          interpolation=cv2.INTER_AREA)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return layout_analysis.glyph_height(layout_analysis.ink_mask(binary))
+
+def estimate_text_height(image):
+    """Median glyph height of an image (file path or array) in its own pixels, or None without text"""
+    gray = as_gray(image)
+    factor = min(1.0, ESTIMATE_SIDE / max(gray.shape[:2]))
+    height = _glyph_height(gray, factor)
+    # Small print blurs together when shrunk, so measure it again at full size
+    if factor < 1.0 and (height is None or height < 6):
+        factor = 1.0
+        height = _glyph_height(gray, factor)
+    return height / factor if height else None
+
+def lazy_text_height(image):
+    """Return a thread-safe function measuring the text height of image() on first call only"""
+    lock = threading.Lock()
+    measured = []
+
+    def load():
+        with lock:
+            if not measured:
+                measured.append(estimate_text_height(image()))
+        return measured[0]
+
+    return load
+
+def target_for(engine):
+    """Target glyph height of an engine, or None if its input is never rescaled"""
+    return TARGET_TEXT_HEIGHT.get(engine) if ENABLED else None
+
+def plan_scale(text_height, target, shape):
+    """Scale factor that brings text_height to target, within the tolerance and size limits (shrink-only unless UPSCALE)"""
+    if not text_height or not target:
+        return 1.0
+    scale = target / text_height
+    if 1 / TOLERANCE <= scale <= TOLERANCE or (scale > 1 and not UPSCALE):
+        return 1.0
+    scale = min(MAX_SCALE, max(MIN_SCALE, scale))
+    if scale > 1:
+        scale = min(scale, math.sqrt(MAX_PIXELS / (shape[0] * shape[1])))
+    return max(scale, MIN_SCALE)
+
+def govern(image, engine, text_height=None):
+    """
+    Rescale an array so its text is about the engine's target height.
+
+    text_height is measured when not given. Returns a Rescale whose image
+    is the input itself when no rescaling is needed; coordinates found on
+    it map back to the original with map_boxes(boxes, rescale.scale).
+    """
+    target = target_for(engine)
+    if target is None:
+        return Rescale(image, 1.0, text_height, None)
+    if text_height is None:
+        text_height = estimate_text_height(image)
+    height, width = image.shape[:2]
+    scale = plan_scale(text_height, target, (height, width))
+    if scale == 1.0:
+        return Rescale(image, 1.0, text_height, target)
+    with metrics.span('rescale', engine):
+        resized = cv2.resize(image, (max(1, int(round(width * scale))), max(1, int(round(height * scale)))),
+                             interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+    return Rescale(resized, scale, text_height, target)
+
+def map_boxes(boxes, scale):
+    """Map coordinates found on a rescaled image back to the original (non-numbers are kept)"""
+    if scale == 1.0:
+        return boxes
+    if isinstance(boxes, (list, tuple)):
+        mapped = [map_boxes(value, scale) for value in boxes]
+        return tuple(mapped) if isinstance(boxes, tuple) else mapped
+    if isinstance(boxes, (int, float)) and not isinstance(boxes, bool):
+        return int(round(boxes / scale))
+    return boxes
+
+def report(rescale, engine_ms, rescale_ms=0.0):
+    """
+    Describe a rescale for the response timings.
+
+    estimated_saved_ms assumes engine time grows with the pixel count, so it
+    is the time the engine would have needed at the original size minus the
+    time it took, minus the resize itself; upscaling reports a negative saving.
+    """
+    saved = engine_ms * (1 / (rescale.scale * rescale.scale) - 1) - rescale_ms
+    return {
+        'scale': round(rescale.scale, 3),
+        'text_height': round(rescale.text_height, 1) if rescale.text_height else None,
+        'target': rescale.target,
+        'estimated_saved_ms': round(saved, 1),
+    }
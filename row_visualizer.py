@@ -0,0 +1,161 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import cv2
+
+# Highlight colour and opacity of a selected row
+HIGHLIGHT_COLOR = (0, 255, 0)
+HIGHLIGHT_ALPHA = 0.3
+
+# Rows above a band that its "Row N" label can reach
+LABEL_MARGIN = 40
+
+_STOP = object()
+
+def band_bounds(y, end_y, image_height):
+    """Rows [top, bottom) touched when highlighting a band, including border and label"""
+    top = max(0, y - LABEL_MARGIN)
+    bottom = min(image_height, max(end_y + 2, y + 30))
+    return top, bottom
+
+def draw_row(target, source, y, end_y, width, index, offset=0):
+    """
+    Highlight rows y..end_y on `target`, blending over `source`.
+
+    Both arrays may be horizontal slices of the full frame starting at row
+    `offset`; the result is the same as drawing on the full frame.
+    """
+    y0, y1 = y - offset, end_y - offset
+    overlay = source.copy()
+    cv2.rectangle(overlay, (0, y0), (width, y1), HIGHLIGHT_COLOR, -1)
+    cv2.addWeighted(overlay, HIGHLIGHT_ALPHA, source, 1 - HIGHLIGHT_ALPHA, 0, target)
+    cv2.rectangle(target, (0, y0), (width, y1), HIGHLIGHT_COLOR, 2)
+    if index is not None:
+        cv2.putText(target, f"Row {index}", (10, (y - 10 if y > 20 else y + 20) - offset),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, HIGHLIGHT_COLOR, 2)
+
+class RowVisualizer:
+    """
+    Renders row visualizations on a background thread.
+
+    The OCR loop only records strip rectangles (add_row / add_composite);
+    frames are drawn into a single reused buffer in which only the band that
+    changed since the previous frame is restored and redrawn, then JPEG
+    encoded off the critical path. Frames are written to output_dir, kept in
+    memory (keep_frames=True, see `frames`), or both.
+
+    With gif_file set, close() also writes an animated GIF of the rows with
+    gif_maker.strips_to_gif, straight from the recorded rectangles; if
+    neither output_dir nor keep_frames is set no JPEG frames are rendered.
+    """
+
+    def __init__(self, image, output_dir="row_visualizations", keep_frames=False, gif_file=None,
+                 gif_duration=500):
+        self.base = image
+        self.output_dir = output_dir
+        self.keep_frames = keep_frames
+        self.gif_file = gif_file
+        self.gif_duration = gif_duration
+        self.frames = OrderedDict()
+        self.rows = []
+        self.composite_rows = None
+        self.error = None
+        self._buffer = None
+        self._dirty = None
+        self._jobs = queue.Queue()
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='row-visualizer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def path(self, name):
+        """Where a frame is written, or its in-memory name when not writing files"""
+        return os.path.join(self.output_dir, name) if self.output_dir else name
+
+    def add_row(self, y, end_y, index):
+        """Queue a frame highlighting one row and return its path"""
+        name = f"row_{index:03d}.jpg"
+        self.rows.append((y, end_y, index))
+        if self._renders_frames():
+            self._jobs.put(('row', name, (y, end_y, index)))
+        return self.path(name)
+
+    def add_composite(self, rows, name="all_selected_rows.jpg"):
+        """Queue a frame highlighting every (y, end_y, row_index) in rows and return its path"""
+        self.composite_rows = list(rows)
+        if self._renders_frames():
+            self._jobs.put(('composite', name, self.composite_rows))
+        return self.path(name)
+
+    def _renders_frames(self):
+        return bool(self.output_dir or self.keep_frames)
+
+    def close(self):
+        """Wait until every queued frame is rendered, then write the GIF if requested"""
+        if self._thread.is_alive():
+            self._jobs.put(_STOP)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+        if self.gif_file and self.rows:
+            # Imported here because gif_maker builds on this module's drawing helpers
+            import gif_maker
+            gif_maker.strips_to_gif(self.base, self.rows, self.gif_file, self.gif_duration,
+                                    composite=self.composite_rows)
+            self.gif_file, self.rows = None, []
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is _STOP:
+                return
+            if self.error is not None:
+                continue
+            try:
+                kind, name, payload = job
+                frame = self._render_row(*payload) if kind == 'row' else self._render_composite(payload)
+                self._emit(name, frame)
+            except Exception as e:
+                self.error = e
+
+    def _render_row(self, y, end_y, index):
+        height, width = self.base.shape[:2]
+        if self._buffer is None:
+            self._buffer = self.base.copy()
+        elif self._dirty is not None:
+            # Undo the previous frame's highlight
+            top, bottom = self._dirty
+            self._buffer[top:bottom] = self.base[top:bottom]
+
+        top, bottom = band_bounds(y, end_y, height)
+        draw_row(self._buffer[top:bottom], self.base[top:bottom], y, end_y, width, index, offset=top)
+        self._dirty = (top, bottom)
+        return self._buffer
+
+    def _render_composite(self, rows):
+        height, width = self.base.shape[:2]
+        composite = self.base.copy()
+        for y, end_y, index in rows:
+            top, bottom = band_bounds(y, end_y, height)
+            band = composite[top:bottom]
+            draw_row(band, band.copy(), y, end_y, width, index, offset=top)
+        return composite
+
+    def _emit(self, name, frame):
+        ok, encoded = cv2.imencode('.jpg', frame)
+        if not ok:
+            raise ValueError(f"Unable to encode visualization frame {name}")
+        data = encoded.tobytes()
+        if self.output_dir:
+            with open(os.path.join(self.output_dir, name), 'wb') as f:
+                f.write(data)
+        if self.keep_frames:
+            self.frames[name] = data
@@ -1,17 +1,35 @@
 import os
 import cv2
 import pytesseract
+import tesseract_backend
+import layout_analysis
+import line_alignment
+import metrics
+import profiler
+import psm_scheduler
+from row_visualizer import RowVisualizer
 import numpy as np
 from PIL import Image
-import pdf2image
+from pdf_pages import pdf_page_arrays, raster_profile
 import re
 import json
+import hashlib
+import threading
 from collections import defaultdict
-from difflib import SequenceMatcher
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 
-def similar(a, b):
-    """Calculate the similarity ratio between two strings"""
-    return SequenceMatcher(None, a, b).ratio()
+# Engine label of this module's metrics
+ENGINE_NAME = 'sliding_window'
+
+# PDF pages are rendered straight to grayscale; every approach thresholds them
+RASTER_PROFILE = raster_profile(grayscale=True)
+
+# Worker processes for strip/height evaluation; 1 keeps everything in the calling process
+STRIP_WORKERS = int(os.environ.get('OCR_STRIP_WORKERS', '1'))
+
+# Tesseract config of the whole-page reference pass
+GLOBAL_CONFIG = r'--oem 3 --psm 1'
 
 def clean_word_repetitions(text):
     """Clean repeated words that appear right next to each other"""
@@ -26,70 +44,301 @@ def clean_word_repetitions(text):
     
     return " ".join(cleaned_words)
 
-def save_highlighted_row(img, y, row_height, width, output_path, index):
-    """Save an image with the current row highlighted"""
-    # Create a copy of the image to draw on
-    img_copy = img.copy()
-    
-    # Calculate end y coordinate ensuring we stay within image boundaries
-    end_y = min(y + row_height, img.shape[0])
-    
-    # Define highlight color (semi-transparent green)
-    overlay = img_copy.copy()
-    cv2.rectangle(overlay, (0, y), (width, end_y), (0, 255, 0), -1)
-    
-    # Apply transparency
-    alpha = 0.3  # Transparency factor
-    cv2.addWeighted(overlay, alpha, img_copy, 1 - alpha, 0, img_copy)
-    
-    # Add border for better visibility
-    cv2.rectangle(img_copy, (0, y), (width, end_y), (0, 255, 0), 2)
-    
-    # Add text showing the row index
-    cv2.putText(img_copy, f"Row {index}", (10, y - 10 if y > 20 else y + 20), 
-                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-    
-    # Save the image
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    cv2.imwrite(output_path, img_copy)
-    
-    return output_path
+def join_words_by_line(data, indices):
+    """Join the given words of an image_to_data dict, one output line per Tesseract text line"""
+    lines = []
+    current = None
+    for i in indices:
+        line_key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        if line_key != current:
+            lines.append([])
+            current = line_key
+        lines[-1].append(data['text'][i])
+    return "\n".join(" ".join(words) for words in lines)
+
+def _score_strip_result(data):
+    """Return (text, average confidence, score) of a strip's image_to_data output, or None if empty"""
+    # Extract valid text blocks (with confidence > 40)
+    valid_indices = [i for i, conf in enumerate(data['conf']) if conf > 40 and data['text'][i].strip()]
+    if not valid_indices:
+        return None
+    row_text = join_words_by_line(data, valid_indices)
+    
+    # Calculate a score based on text length and average confidence
+    avg_conf = sum([data['conf'][i] for i in valid_indices]) / len(valid_indices)
+    return row_text, avg_conf, len(row_text) * avg_conf
+
+def _run_all_modes(strips, context, executor=None):
+    """Run PSM 6, 7 and 3 on every strip and keep each strip's best result"""
+    psm_modes = [6, 7, 3]  # 6=Block of text, 7=Single line, 3=Auto
+    configs = [f'--oem 3 --psm {psm}' for psm in psm_modes]
+    regions = [strip['rect'] for strip in strips]
+    strip_data = context.strip_data(regions, configs, executor)
+    
+    for config in configs:
+        for strip, data in zip(strips, strip_data[config]):
+            scored = _score_strip_result(data)
+            if scored and scored[2] > strip['best_score']:
+                strip['best_text'], _, strip['best_score'] = scored
+
+def _run_scheduled_modes(strips, context, scheduler, executor=None):
+    """
+    Run each strip's scheduled PSM modes until one clears the confidence threshold.
+
+    Work proceeds in rounds: round k runs the k-th scheduled mode of every
+    strip that is still undecided, batching all strips that want the same mode
+    into one call, so most strips cost a single engine call.
+    """
+    glyph_height = context.layout.glyph_height
+    ink = context.ink
+    plans = []
+    for strip in strips:
+        left, top, width, height = strip['rect']
+        features = psm_scheduler.strip_features(ink[top:top + height, left:left + width], glyph_height)
+        bucket, modes = scheduler.plan(features)
+        plans.append({'bucket': bucket, 'modes': modes, 'calls': 0, 'winner': None, 'early_exit': False})
+    
+    round_index = 0
+    while True:
+        groups = {}
+        for strip, plan in zip(strips, plans):
+            if not plan['early_exit'] and round_index < len(plan['modes']):
+                groups.setdefault(plan['modes'][round_index], []).append((strip, plan))
+        if not groups:
+            break
+        
+        for psm, members in groups.items():
+            config = f'--oem 3 --psm {psm}'
+            results = context.strip_data([strip['rect'] for strip, _ in members], [config], executor)[config]
+            for (strip, plan), data in zip(members, results):
+                plan['calls'] += 1
+                scored = _score_strip_result(data)
+                if scored is None:
+                    continue
+                row_text, avg_conf, score = scored
+                if score > strip['best_score']:
+                    strip['best_score'] = score
+                    strip['best_text'] = row_text
+                    plan['winner'] = psm
+                if scheduler.should_stop(avg_conf):
+                    plan['early_exit'] = True
+        round_index += 1
+    
+    for plan in plans:
+        scheduler.record(plan['bucket'], plan['winner'], plan['calls'], plan['early_exit'])
+
+def _recognize_strip(strip, config):
+    """Run image_to_data on one strip (executed in a worker process)"""
+    return tesseract_backend.image_to_data(strip, config=config, output_type=pytesseract.Output.DICT)
+
+def _recognize_page(binary, config):
+    """Run image_to_string on a whole page (executed in a worker process)"""
+    return tesseract_backend.image_to_string(binary, config=config)
+
+@contextmanager
+def strip_executor(workers=None):
+    """Yield a process pool for strip evaluation, or None to run serially"""
+    workers = STRIP_WORKERS if workers is None else workers
+    if workers <= 1:
+        yield None
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield executor
+
+def _completed(value):
+    """Wrap an already computed value in a finished Future"""
+    future = Future()
+    future.set_result(value)
+    return future
+
+class AnalysisContext:
+    """
+    Memoized per-image state shared by the sliding-window passes.
+
+    The decoded image, its binarization, the global OCR pass, the layout and every
+    strip's OCR output are computed once per document no matter how many
+    heights or approaches ask for them. Strip results are keyed by a hash of
+    the strip's pixels and the Tesseract config, so identical strips
+    requested by different heights are recognized only once. Results are
+    kept as Futures so concurrent heights sharing a process pool also share
+    in-flight work. A decoded BGR or grayscale array may be passed instead of
+    a path (as image_path or image).
+    """
 
-def extract_text_with_row_sliding_window(image_path, row_height=100, overlap=20, visualize=False):
-    """Extract text using a row-based sliding window approach"""
+    def __init__(self, image_path=None, image=None):
+        if isinstance(image_path, np.ndarray):
+            image_path, image = None, image_path
+        self.image_path = image_path
+        self._image = image
+        self._gray = None
+        # A grayscale page is used as is; its BGR copy is only made when asked for
+        if image is not None and image.ndim == 2:
+            self._image, self._gray = None, image
+        self._binary = None
+        self._pages = {}
+        self._strips = {}
+        self._lock = threading.RLock()
+        self.counters = {'strip_hits': 0, 'strip_misses': 0}
+
+    @property
+    def image(self):
+        """BGR image, or None if it can't be read"""
+        with self._lock:
+            if self._image is None and self._gray is not None:
+                self._image = cv2.cvtColor(self._gray, cv2.COLOR_GRAY2BGR)
+            elif self._image is None and self.image_path is not None:
+                with metrics.span('decode', ENGINE_NAME):
+                    self._image = cv2.imread(self.image_path)
+            return self._image
+
+    @property
+    def gray(self):
+        with self._lock:
+            if self._gray is None:
+                self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+            return self._gray
+
+    @property
+    def binary(self):
+        with self._lock:
+            if self._binary is None:
+                with metrics.span('preprocess', ENGINE_NAME):
+                    _, self._binary = cv2.threshold(self.gray, 150, 255, cv2.THRESH_BINARY)
+            return self._binary
+
+    @property
+    def ink(self):
+        """Boolean ink mask of the binarized image"""
+        with self._lock:
+            if 'ink' not in self._pages:
+                self._pages['ink'] = layout_analysis.ink_mask(self.binary)
+            return self._pages['ink']
+
+    @property
+    def layout(self):
+        """Text-line bands and glyph/line heights of the binarized image"""
+        with self._lock:
+            if 'layout' not in self._pages:
+                binary = self.binary
+                with metrics.span('layout', ENGINE_NAME):
+                    self._pages['layout'] = layout_analysis.analyze(binary)
+            return self._pages['layout']
+
+    def global_text(self, executor=None):
+        """Future for image_to_string of the binarized page with GLOBAL_CONFIG"""
+        with self._lock:
+            if 'text' not in self._pages:
+                if executor is not None:
+                    self._pages['text'] = executor.submit(_recognize_page, self.binary, GLOBAL_CONFIG)
+                else:
+                    binary = self.binary
+                    with metrics.span('inference', ENGINE_NAME):
+                        self._pages['text'] = _completed(
+                            tesseract_backend.image_to_string(binary, config=GLOBAL_CONFIG))
+            return self._pages['text']
+
+    def strip_data(self, regions, configs, executor=None):
+        """
+        Return {config: [image_to_data dict for each region]} for every config.
+
+        Only strips not seen before are recognized. Serially, each config is
+        one batched pass over the new strips; with an executor every new
+        (strip, config) pair becomes its own task.
+        """
+        binary = self.binary
+        keys = []
+        for left, top, width, height in regions:
+            strip = binary[top:top + height, left:left + width]
+            keys.append(hashlib.sha1(strip.tobytes() + repr(strip.shape).encode()).hexdigest())
+
+        with self._lock:
+            for config in configs:
+                missing = {}
+                for region, key in zip(regions, keys):
+                    if (key, config) in self._strips or key in missing:
+                        self.counters['strip_hits'] += 1
+                    else:
+                        missing[key] = region
+                        self.counters['strip_misses'] += 1
+                if executor is not None:
+                    for key, (left, top, width, height) in missing.items():
+                        self._strips[(key, config)] = executor.submit(
+                            _recognize_strip, binary[top:top + height, left:left + width], config)
+                elif missing:
+                    with metrics.span('inference', ENGINE_NAME):
+                        batch = tesseract_backend.image_to_data_regions(
+                            binary, list(missing.values()), config=config, output_type=pytesseract.Output.DICT)
+                    for key, (_, data) in zip(missing, batch):
+                        self._strips[(key, config)] = _completed(data)
+            futures = {config: [self._strips[(key, config)] for key in keys] for config in configs}
+        return {config: [future.result() for future in pending] for config, pending in futures.items()}
+
+def extract_text_with_row_sliding_window(image_path, row_height=100, overlap=20, visualize=False, executor=None,
+                                         context=None, placement='layout', psm_schedule='adaptive', scheduler=None):
+    """
+    Extract text using a row-based sliding window approach.
+
+    With placement='layout' strips follow the text-line bands found by
+    layout_analysis: each strip packs whole lines up to row_height and blank
+    space is never sent to the OCR engine (overlap is not used). With
+    placement='fixed' the window steps down the page by row_height - overlap.
+
+    With psm_schedule='adaptive' a PSMScheduler picks the page segmentation
+    modes for each strip from its features and stops at the first confident
+    result; psm_schedule='all' runs PSM 6, 7 and 3 on every strip.
+
+    Pass a process pool from strip_executor() as `executor` to recognize the
+    strips and PSM variants in parallel; the result is the same either way.
+    Pass an AnalysisContext to reuse work already done on the same image.
+
+    visualize=True writes row frames to row_visualizations/ and
+    visualize='memory' returns them as JPEG bytes under 'frames'; either way
+    they are rendered by a background RowVisualizer while OCR runs.
+    visualize='gif' renders no frames and instead writes
+    row_visualizations/rows.gif straight from the strip rectangles.
+    """
+    visualizer = None
     try:
+        context = context or AnalysisContext(image_path)
+        
         # Read image
-        img = cv2.imread(image_path)
+        img = context.image
         if img is None:
             return f"Error: Unable to read image at {image_path}"
             
         height, width = img.shape[:2]
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Grayscale and threshold (shared through the context)
+        binary = context.binary
         
-        # Apply threshold
-        _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
-        
-        # Get global text as reference
-        global_text = pytesseract.image_to_string(binary, config=r'--oem 3 --psm 1')
+        # Get global text as reference, in a worker process if one is available
+        global_future = context.global_text(executor)
         
         # Process the image in horizontal strips (rows)
         text_by_row = []
         
-        # Create visualization directory if needed
+        # Start the background visualization writer if needed
         if visualize:
-            visualization_dir = "row_visualizations"
-            os.makedirs(visualization_dir, exist_ok=True)
+            visualization_dir = None if visualize == 'memory' else "row_visualizations"
+            gif_file = None
+            if visualize == 'gif':
+                os.makedirs(visualization_dir, exist_ok=True)
+                gif_file = os.path.join(visualization_dir, "rows.gif")
+            visualizer = RowVisualizer(img, None if gif_file else visualization_dir,
+                                       keep_frames=visualize == 'memory', gif_file=gif_file)
         
-        # Define how many rows to process
-        step = row_height - overlap
+        # Define the rows to process
+        if placement == 'layout':
+            bounds = layout_analysis.strip_bounds(context.layout, row_height, height)
+        else:
+            step = row_height - overlap
+            # Ensure we stay within image boundaries
+            bounds = [(y, min(y + row_height, height)) for y in range(0, height - row_height + step, step)]
         row_index = 0
         
-        for y in range(0, height - row_height + step, step):
-            # Ensure we stay within image boundaries
-            end_y = min(y + row_height, height)
-            
+        # Collect the non-empty strips first so each PSM pass can recognize them in one batch
+        strips = []
+        for y, end_y in bounds:
             # Extract horizontal strip
             row_img = binary[y:end_y, 0:width]
             
@@ -99,41 +348,33 @@ def extract_text_with_row_sliding_window(image_path, row_height=100, overlap=20,
             
             # Visualize this row if requested
             if visualize:
-                vis_path = os.path.join("row_visualizations", f"row_{row_index:03d}.jpg")
-                save_highlighted_row(img, y, row_height, width, vis_path, row_index)
+                visualizer.add_row(y, end_y, row_index)
                 row_index += 1
             
-            # Process text in this row with different PSM modes
-            best_text = ""
-            best_score = 0
-            
-            psm_modes = [6, 7, 3]  # 6=Block of text, 7=Single line, 3=Auto
-            
-            for psm in psm_modes:
-                config = f'--oem 3 --psm {psm}'
-                data = pytesseract.image_to_data(row_img, config=config, output_type=pytesseract.Output.DICT)
-                
-                # Extract valid text blocks (with confidence > 40)
-                valid_indices = [i for i, conf in enumerate(data['conf']) if conf > 40 and data['text'][i].strip()]
-                row_text = " ".join([data['text'][i] for i in valid_indices])
-                
-                # Calculate a score based on text length and average confidence
-                if valid_indices:
-                    avg_conf = sum([data['conf'][i] for i in valid_indices]) / len(valid_indices)
-                    score = len(row_text) * avg_conf
-                    
-                    if score > best_score:
-                        best_score = score
-                        best_text = row_text
-            
+            strips.append({
+                'rect': (0, y, width, end_y - y),
+                'row_index': row_index - 1 if visualize else None,  # Store reference to visualization
+                'best_text': "",
+                'best_score': 0,
+            })
+        
+        # Process text in every strip with different PSM modes
+        if psm_schedule == 'adaptive':
+            _run_scheduled_modes(strips, context, scheduler or psm_scheduler.default_scheduler, executor)
+        else:
+            _run_all_modes(strips, context, executor)
+        
+        for strip in strips:
             # If we found any text in this row
-            if best_text:
-                # Clean any repeated words
-                cleaned_text = clean_word_repetitions(best_text)
+            if strip['best_text']:
+                # Clean any repeated words, keeping the strip's line breaks
+                cleaned_text = "\n".join(clean_word_repetitions(line) for line in strip['best_text'].split("\n"))
+                _, y, _, strip_height = strip['rect']
                 text_by_row.append({
                     'y': y,
+                    'end_y': y + strip_height,
                     'text': cleaned_text,
-                    'row_index': row_index - 1 if visualize else None  # Store reference to visualization
+                    'row_index': strip['row_index']
                 })
         
         # Merge overlapping rows
@@ -145,9 +386,9 @@ def extract_text_with_row_sliding_window(image_path, row_height=100, overlap=20,
             j = i + 1
             
             # Look ahead for overlapping rows
-            while j < len(text_by_row) and text_by_row[j]['y'] < current_row['y'] + row_height:
+            while j < len(text_by_row) and text_by_row[j]['y'] < current_row['end_y']:
                 # If there's significant text overlap, merge them
-                if similar(current_row['text'], text_by_row[j]['text']) > 0.5:
+                if line_alignment.similar_above(current_row['text'], text_by_row[j]['text'], 0.5):
                     # Choose the longer text
                     if len(text_by_row[j]['text']) > len(current_row['text']):
                         current_row = text_by_row[j]
@@ -158,46 +399,41 @@ def extract_text_with_row_sliding_window(image_path, row_height=100, overlap=20,
         
         # Combine all rows into final text
         result_text = "\n".join(merged_rows)
+        global_text = global_future.result()
         
         # Fallback to global text if our processing fails or gives sparse results
         if len(result_text) < len(global_text) * 0.5:
+            if visualizer:
+                visualizer.close()
             return global_text
         
         # If visualizing, create a composite image showing all selected rows
         if visualize and text_by_row:
-            # Create composite image
-            composite_path = os.path.join("row_visualizations", "all_selected_rows.jpg")
-            img_copy = img.copy()
-            
-            for row_data in text_by_row:
-                y = row_data['y']
-                end_y = min(y + row_height, height)
-                
-                # Add semi-transparent highlight
-                overlay = img_copy.copy()
-                cv2.rectangle(overlay, (0, y), (width, end_y), (0, 255, 0), -1)
-                cv2.addWeighted(overlay, 0.3, img_copy, 0.7, 0, img_copy)
-                
-                # Add border
-                cv2.rectangle(img_copy, (0, y), (width, end_y), (0, 255, 0), 2)
-                
-                # Add row index text
-                if row_data['row_index'] is not None:
-                    cv2.putText(img_copy, f"Row {row_data['row_index']}", (10, y - 10 if y > 20 else y + 20), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-            
-            cv2.imwrite(composite_path, img_copy)
+            composite_path = visualizer.add_composite(
+                (row_data['y'], row_data['end_y'], row_data['row_index']) for row_data in text_by_row)
+            visualizer.close()
             
             # Return additional info about visualization
-            return {
+            result = {
                 'text': result_text,
                 'visualization_dir': visualization_dir,
                 'composite_image': composite_path,
                 'total_rows': row_index
             }
+            if visualize == 'memory':
+                result['frames'] = visualizer.frames
+            if visualize == 'gif':
+                result['composite_image'] = None
+                result['gif'] = gif_file
+            return result
         
+        if visualizer:
+            visualizer.close()
         return result_text
     except Exception as e:
+        if visualizer:
+            visualizer.error = visualizer.gif_file = None
+            visualizer.close()
         return f"Error processing image with row-based sliding window: {str(e)}"
 
 def enhance_image_for_ocr(image_path, output_path=None):
@@ -226,24 +462,45 @@ def enhance_image_for_ocr(image_path, output_path=None):
         cv2.imwrite(temp_path, dilated)
         return temp_path
 
-def extract_text_using_multiple_strip_heights(image_path, visualize=False):
-    """Extract text using various strip heights to handle different document layouts"""
+def extract_text_using_multiple_strip_heights(image_path, visualize=False, workers=None, executor=None,
+                                              context=None):
+    """
+    Extract text using various strip heights to handle different document layouts.
+
+    With more than one worker (or an existing executor) the heights, their
+    strips and PSM variants and the global pass all run across a process pool.
+    All heights share one AnalysisContext, so the image is decoded and
+    globally recognized once.
+    """
+    if executor is None and (STRIP_WORKERS if workers is None else workers) > 1:
+        with strip_executor(workers) as executor:
+            return extract_text_using_multiple_strip_heights(image_path, visualize, executor=executor,
+                                                             context=context)
+    context = context or AnalysisContext(image_path)
+    
     # Try different strip heights and select the best result
     strip_heights = [50, 100, 150]
     results = []
     visualization_results = []
     
     # Get global text as reference
-    img = cv2.imread(image_path)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
-    global_text = pytesseract.image_to_string(binary, config=r'--oem 3 --psm 1')
+    global_future = context.global_text(executor)
     
-    # Process with different strip heights
-    for height in strip_heights:
+    def run_height(height):
         overlap = height // 3  # 1/3 overlap
-        result = extract_text_with_row_sliding_window(image_path, height, overlap, visualize)
-        
+        return extract_text_with_row_sliding_window(image_path, height, overlap, visualize, executor, context)
+    
+    # Heights only queue work on the shared pool, so they can be driven concurrently;
+    # visualizations are written to the same directory, so those stay in order
+    if executor is not None and not visualize:
+        with ThreadPoolExecutor(max_workers=len(strip_heights)) as height_pool:
+            height_results = list(height_pool.map(profiler.propagate(run_height), strip_heights))
+    else:
+        height_results = [run_height(height) for height in strip_heights]
+    global_text = global_future.result()
+    
+    # Process with different strip heights
+    for height, result in zip(strip_heights, height_results):
         if visualize and isinstance(result, dict):
             visualization_results.append({
                 'height': height,
@@ -300,17 +557,26 @@ def extract_text_using_multiple_strip_heights(image_path, visualize=False):
     
     return best_result
 
-def combine_rows_and_global_approaches(image_path, visualize=False):
-    """Combine row-based approach with global OCR for best results"""
+def combine_rows_and_global_approaches(image_path, visualize=False, workers=None, context=None, executor=None):
+    """
+    Combine row-based approach with global OCR for best results.
+
+    image_path may also be a decoded BGR or grayscale array. Pass a pool from strip_executor() as `executor` when calling this for
+    many pages; otherwise a pool is started (and stopped) for this call
+    whenever more than one worker is configured.
+    """
+    if executor is None and (STRIP_WORKERS if workers is None else workers) > 1:
+        with strip_executor(workers) as executor:
+            return combine_rows_and_global_approaches(image_path, visualize, context=context, executor=executor)
+    context = context or AnalysisContext(image_path)
+    
     # Get global text
-    img = cv2.imread(image_path)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
-    global_text = pytesseract.image_to_string(binary, config=r'--oem 3 --psm 1')
-    global_text = clean_word_repetitions(global_text)
+    global_future = context.global_text(executor)
     
     # Get row-based text (with multiple strip heights)
-    row_text_result = extract_text_using_multiple_strip_heights(image_path, visualize)
+    row_text_result = extract_text_using_multiple_strip_heights(image_path, visualize, executor=executor,
+                                                                context=context)
+    global_text = clean_word_repetitions(global_future.result())
     
     if visualize and isinstance(row_text_result, dict):
         row_text = row_text_result['text']
@@ -325,25 +591,18 @@ def combine_rows_and_global_approaches(image_path, visualize=False):
     
     # Merge lines based on similarity
     result_lines = []
+    global_index = line_alignment.LineIndex(global_lines)
     
     # Process each line from row-based text
-    for row_line in row_lines:
+    for k, row_line in enumerate(row_lines):
         if not row_line.strip():
             continue
-            
-        best_match = None
-        best_ratio = 0
-        
-        # Find the most similar line in global text
-        for gl_line in global_lines:
-            if not gl_line.strip():
-                continue
-                
-            ratio = similar(row_line, gl_line)
-            if ratio > best_ratio and ratio > 0.5:  # 0.5 similarity threshold
-                best_ratio = ratio
-                best_match = gl_line
         
+        # Find the most similar line in global text (0.5 similarity threshold),
+        # starting the search around the same position in reading order
+        match_index, _ = global_index.best_match(row_line, 0.5, position=k / max(1, len(row_lines) - 1))
+        best_match = global_lines[match_index] if match_index is not None else None
+    
         # Choose the better line
         if best_match:
             # Choose the longer line if they're similar enough
@@ -371,44 +630,34 @@ def combine_rows_and_global_approaches(image_path, visualize=False):
     
     return combined_text
 
-def extract_text_from_pdf(pdf_path, use_row_based=True, visualize=False):
-    """Extract text from a PDF using row-based sliding window approach"""
+def extract_text_from_pdf(pdf_path, use_row_based=True, visualize=False, first_page=None, last_page=None,
+                          workers=None):
+    """Extract text from a PDF (optionally a page range) using row-based sliding window approach"""
     try:
-        # Convert PDF to images
-        images = pdf2image.convert_from_path(pdf_path)
         all_text = []
         all_visualizations = []
         
-        # Process each page
-        for i, image in enumerate(images):
-            # Convert PIL image to numpy array
-            opencvImage = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            
-            # Save temporary image
-            temp_image_path = f"temp_page_{i}.jpg"
-            cv2.imwrite(temp_image_path, opencvImage)
-            
-            # Extract text
-            if use_row_based:
-                result = combine_rows_and_global_approaches(temp_image_path, visualize)
-                if visualize and isinstance(result, dict):
-                    text = result['text']
-                    all_visualizations.append({
-                        'page': i+1,
-                        'visualization': result['visualization']
-                    })
+        # Rasterize and process the pages one small window at a time; every page
+        # shares one process pool, so workers start (and load Tesseract) once
+        with strip_executor(workers if use_row_based else 1) as executor:
+            for page_number, gray in pdf_page_arrays(pdf_path, first_page, last_page, RASTER_PROFILE):
+                # Extract text from the rendered page itself
+                if use_row_based:
+                    result = combine_rows_and_global_approaches(gray, visualize, workers, executor=executor)
+                    if visualize and isinstance(result, dict):
+                        text = result['text']
+                        all_visualizations.append({
+                            'page': page_number,
+                            'visualization': result['visualization']
+                        })
+                    else:
+                        text = result
                 else:
-                    text = result
-            else:
-                # Use standard approach
-                gray = cv2.cvtColor(opencvImage, cv2.COLOR_BGR2GRAY)
-                _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
-                text = pytesseract.image_to_string(binary, config=r'--oem 3 --psm 1')
-            
-            all_text.append(f"--- Page {i+1} ---\n{text}")
-            
-            # Remove temporary image
-            os.remove(temp_image_path)
+                    # Use standard approach
+                    _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
+                    text = tesseract_backend.image_to_string(binary, config=r'--oem 3 --psm 1')
+                
+                all_text.append(f"--- Page {page_number} ---\n{text}")
         
         combined_text = "\n\n".join(all_text)
         
@@ -422,27 +671,20 @@ def extract_text_from_pdf(pdf_path, use_row_based=True, visualize=False):
     except Exception as e:
         return f"Error processing PDF: {str(e)}"
 
-def detect_optimal_row_height(image_path):
-    """Auto-detect optimal row height based on document analysis"""
+def detect_optimal_row_height(image_path, context=None):
+    """Auto-detect optimal row height from the page layout (no OCR pass needed)"""
     try:
-        # Read image
-        img = cv2.imread(image_path)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
-        
-        # Run OCR with hOCR output to get line information
-        hocr_data = pytesseract.image_to_data(binary, config='--oem 3 --psm 1', output_type=pytesseract.Output.DICT)
+        context = context or AnalysisContext(image_path)
         
-        # Calculate heights of detected text blocks
-        heights = []
-        for i in range(len(hocr_data['height'])):
-            if hocr_data['conf'][i] > 30 and hocr_data['text'][i].strip():
-                heights.append(hocr_data['height'][i])
+        # Typical text-line height from projection profiles and connected components
+        layout = context.layout
+        median_height = layout.line_height
+        if median_height is None and layout.glyph_height:
+            median_height = int(layout.glyph_height * 1.5)
         
         # If we have height data
-        if heights:
-            # Calculate median height and add some margin
-            median_height = sorted(heights)[len(heights) // 2]
+        if median_height:
+            # Add some margin
             optimal_height = int(median_height * 2.5)  # 2.5x to capture a line plus some context
             
             # Ensure height is reasonable (between 40 and 200 pixels)
@@ -474,8 +716,18 @@ if __name__ == "__main__":
                         help='Use auto-optimization for all parameters')
     parser.add_argument('--visualize', action='store_true',
                         help='Generate visualizations of rows being processed')
+    parser.add_argument('--gif', action='store_true',
+                        help='Write row_visualizations/rows.gif straight from the strips instead of JPEG frames')
+    parser.add_argument('--placement', choices=['layout', 'fixed'], default='layout',
+                        help='Place strips on detected text lines or step a fixed window')
+    parser.add_argument('--psm-schedule', choices=['adaptive', 'all'], default='adaptive',
+                        help='Pick PSM modes per strip with early exit, or always run PSM 6, 7 and 3')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes for strip evaluation (default: OCR_STRIP_WORKERS or 1)')
     
     args = parser.parse_args()
+    if args.gif:
+        args.visualize = 'gif'
     
     # Enhance image if requested
     file_path = args.file
@@ -486,17 +738,20 @@ if __name__ == "__main__":
     if args.type == 'image':
         if args.auto:
             # Use multiple strip heights and select best result
-            result = extract_text_using_multiple_strip_heights(file_path, args.visualize)
+            result = extract_text_using_multiple_strip_heights(file_path, args.visualize, args.workers)
         else:
+            context = AnalysisContext(file_path)
             # Auto-detect row height if not specified
-            row_height = args.row_height if args.row_height else detect_optimal_row_height(file_path)
+            row_height = args.row_height if args.row_height else detect_optimal_row_height(file_path, context)
             # Default overlap to 1/3 of row height if not specified
             overlap = args.overlap if args.overlap else row_height // 3
             
             print(f"Using row height: {row_height}, overlap: {overlap}")
-            result = extract_text_with_row_sliding_window(file_path, row_height, overlap, args.visualize)
+            with strip_executor(args.workers) as executor:
+                result = extract_text_with_row_sliding_window(file_path, row_height, overlap, args.visualize,
+                                                              executor, context, args.placement, args.psm_schedule)
     elif args.type == 'pdf':
-        result = extract_text_from_pdf(file_path, True, args.visualize)
+        result = extract_text_from_pdf(file_path, True, args.visualize, workers=args.workers)
     
     # Clean up temporary file if created
     if args.enhance and args.type != 'pdf' and file_path != args.file:
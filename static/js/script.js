@@ -302,6 +302,9 @@ $(document).ready(function() {
         }
     });
 
+    // Response keys that carry request metadata rather than an engine result
+    const RESPONSE_METADATA_KEYS = ['preview_url', 'timings', 'profile'];
+
     function handleOCRResponse(response) {
         if (response.error) {
             showError(response.error);
@@ -317,7 +320,7 @@ $(document).ready(function() {
         // Process OCR results
         let resultsHtml = '';
         Object.entries(response).forEach(([key, value]) => {
-            if (key !== 'preview_url') {
+            if (!RESPONSE_METADATA_KEYS.includes(key)) {
                 resultsHtml += createLibraryCard(key, value);
             }
         });
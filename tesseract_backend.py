@@ -0,0 +1,197 @@
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pytesseract
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:
+    # tesserocr is optional; without it every call goes through the pytesseract subprocess
+    tesserocr = None
+
+Output = pytesseract.Output
+
+# 'auto' uses the in-process API when tesserocr is installed; 'subprocess' forces pytesseract
+BACKEND = os.environ.get('OCR_TESSERACT_BACKEND', 'auto')
+
+# Directory containing the traineddata files (tesserocr's default when unset)
+TESSDATA_PATH = os.environ.get('TESSDATA_PREFIX')
+
+# Column names of Tesseract's TSV output, which GetTSVText returns without a header row
+TSV_HEADER = 'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext'
+
+# Initialized API handles not in use, by (lang, oem, variables), shared by every thread of the process
+_idle = {}
+_pool_lock = threading.Lock()
+_pool_pid = None
+_unavailable_reason = None if tesserocr is not None else 'tesserocr is not installed'
+
+def _parse_config(config, lang=None):
+    """
+    Split a pytesseract-style config string into (lang, oem, psm, variables).
+
+    Returns None if the config uses options the in-process API can't honour
+    (e.g. config files), so the caller falls back to the subprocess.
+    """
+    tokens = config.split()
+    lang = lang or 'eng'
+    oem = 3
+    psm = 3
+    variables = {}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        value = tokens[i + 1] if i + 1 < len(tokens) else None
+        if token == '-l' and value:
+            lang = value
+        elif token == '--oem' and value:
+            oem = int(value)
+        elif token == '--psm' and value:
+            psm = int(value)
+        elif token == '--dpi' and value:
+            variables['user_defined_dpi'] = value
+        elif token == '-c' and value and '=' in value:
+            key, val = value.split('=', 1)
+            variables[key] = val
+        else:
+            return None
+        i += 2
+    return lang, oem, psm, variables
+
+def _checkout_api(key):
+    """Take an idle API handle for a (lang, oem, variables) key, creating one if all are busy"""
+    global _idle, _pool_pid
+    with _pool_lock:
+        # Handles inherited through fork belong to the parent process
+        if _pool_pid != os.getpid():
+            _idle = {}
+            _pool_pid = os.getpid()
+        idle = _idle.setdefault(key, [])
+        if idle:
+            return idle.pop()
+    lang, oem, variables = key
+    kwargs = {'lang': lang, 'oem': oem}
+    if TESSDATA_PATH:
+        kwargs['path'] = TESSDATA_PATH
+    api = tesserocr.PyTessBaseAPI(**kwargs)
+    for name, value in variables:
+        api.SetVariable(name, str(value))
+    return api
+
+def _return_api(key, api):
+    with _pool_lock:
+        _idle.setdefault(key, []).append(api)
+
+def _set_image(api, image):
+    """Hand an image to the API, passing NumPy buffers directly without encoding"""
+    if isinstance(image, np.ndarray):
+        if image.dtype != np.uint8 or image.ndim not in (2, 3):
+            image = np.asarray(Image.fromarray(image).convert('RGB'))
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+        api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+    elif isinstance(image, Image.Image):
+        api.SetImage(image)
+    else:
+        api.SetImage(Image.open(image))
+
+@contextmanager
+def _persistent_api(config, lang):
+    """
+    Borrow (api, psm) for the in-process path, or yield None to use the subprocess.
+
+    Handles stay initialized for the life of the process and go back to the
+    pool afterwards, so traineddata is loaded once per concurrent caller
+    rather than once per thread or request.
+    """
+    global _unavailable_reason
+    parsed = None
+    if BACKEND != 'subprocess' and not _unavailable_reason:
+        parsed = _parse_config(config, lang)
+    if parsed is None:
+        yield None
+        return
+    lang, oem, psm, variables = parsed
+    key = (lang, oem, tuple(sorted(variables.items())))
+    try:
+        api = _checkout_api(key)
+    except RuntimeError as e:
+        # e.g. missing traineddata; stop trying and use the subprocess from now on
+        _unavailable_reason = str(e)
+        yield None
+        return
+    try:
+        yield api, psm
+    finally:
+        _return_api(key, api)
+
+def is_persistent():
+    """Whether calls are served by the in-process API"""
+    return BACKEND != 'subprocess' and _unavailable_reason is None
+
+def get_version():
+    """Return the Tesseract version string of the active backend"""
+    if is_persistent():
+        return tesserocr.tesseract_version().split('\n')[0]
+    return str(pytesseract.get_tesseract_version())
+
+def image_to_string(image, lang=None, config='', **kwargs):
+    """Drop-in for pytesseract.image_to_string using a persistent API handle when possible"""
+    with _persistent_api(config, lang) as handle:
+        if handle is None:
+            return pytesseract.image_to_string(image, lang=lang, config=config, **kwargs)
+        api, psm = handle
+        api.SetPageSegMode(psm)
+        _set_image(api, image)
+        # The CLI terminates each page with a form feed; keep the output identical
+        return api.GetUTF8Text() + '\f'
+
+def _tsv_output(api, output_type):
+    tsv = f"{TSV_HEADER}\n{api.GetTSVText(0)}"
+    if output_type == Output.DICT:
+        return pytesseract.pytesseract.file_to_dict(tsv, '\t', -1)
+    return tsv
+
+def image_to_data(image, lang=None, config='', output_type=Output.STRING, **kwargs):
+    """Drop-in for pytesseract.image_to_data using a persistent API handle when possible"""
+    with _persistent_api(config, lang) as handle:
+        if handle is None or output_type not in (Output.STRING, Output.DICT):
+            return pytesseract.image_to_data(image, lang=lang, config=config,
+                                             output_type=output_type, **kwargs)
+        api, psm = handle
+        api.SetPageSegMode(psm)
+        _set_image(api, image)
+        return _tsv_output(api, output_type)
+
+def image_to_data_regions(image, regions, lang=None, config='', output_type=Output.DICT, **kwargs):
+    """
+    Run image_to_data on several (left, top, width, height) regions of one image.
+
+    Returns a list of (region, data) pairs in input order, with word boxes
+    relative to the region exactly as if it had been cropped. On the
+    persistent path every region is recognized by the same API handle with
+    the page segmentation mode set once, and each region is handed over as a
+    slice of the page buffer, so there is no per-region process, temp file
+    or traineddata load. Regions are passed as slices rather than with
+    SetRectangle because LSTM recognition of sub-rectangles returned text from
+    the wrong lines in our testing with Tesseract 5.
+    """
+    page = np.asarray(image)
+    crops = [page[top:top + height, left:left + width] for left, top, width, height in regions]
+
+    with _persistent_api(config, lang) as handle:
+        if handle is None or output_type not in (Output.STRING, Output.DICT):
+            return [(region, pytesseract.image_to_data(crop, lang=lang, config=config,
+                                                       output_type=output_type, **kwargs))
+                    for region, crop in zip(regions, crops)]
+
+        api, psm = handle
+        api.SetPageSegMode(psm)
+        results = []
+        for region, crop in zip(regions, crops):
+            _set_image(api, crop)
+            results.append((region, _tsv_output(api, output_type)))
+        return results
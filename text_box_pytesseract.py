@@ -1,22 +1,32 @@
 import os
 import cv2
 import pytesseract
+import metrics
+import resolution
+import tesseract_backend
 import numpy as np
 from PIL import Image
-import pdf2image
+from pdf_pages import pdf_page_arrays, raster_profile
 import re
 import json
 
 # Set the path to tesseract executable if not in PATH
 # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
+# Engine label of this module's metrics
+ENGINE_NAME = 'text_box'
+
+# PDF pages are rendered straight to grayscale for thresholding
+RASTER_PROFILE = raster_profile(grayscale=True)
+
 def _ocr_with_boxes(img, min_conf=50, custom_config=r'--oem 3 --psm 6', return_boxes=False):
     """
     Run Tesseract's image_to_data to get word boxes and assemble lines.
     If return_boxes is True, returns list of boxes (x, y, w, h, text).
     Otherwise returns the assembled text string.
     """
-    data = pytesseract.image_to_data(img, config=custom_config, output_type=pytesseract.Output.DICT)
+    with metrics.span('inference', ENGINE_NAME):
+        data = tesseract_backend.image_to_data(img, config=custom_config, output_type=pytesseract.Output.DICT)
     n = len(data['level'])
     boxes = []
     for i in range(n):
@@ -50,26 +60,26 @@ def _ocr_with_boxes(img, min_conf=50, custom_config=r'--oem 3 --psm 6', return_b
 def extract_text_from_image(image_path, min_conf=50):
     """Extract text from an image using region-based OCR"""
     try:
-        img = cv2.imread(image_path)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
+        with metrics.span('preprocess', ENGINE_NAME):
+            img = cv2.imread(image_path)
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
         text = _ocr_with_boxes(binary, min_conf=min_conf)
         return text.strip()
     except Exception as e:
         return f"Error processing image with region-based OCR: {e}"
 
 
-def extract_text_from_pdf(pdf_path, min_conf=50):
+def extract_text_from_pdf(pdf_path, min_conf=50, first_page=None, last_page=None):
     """Extract text from a PDF by converting pages to images and doing region-based OCR"""
     try:
-        images = pdf2image.convert_from_path(pdf_path)
         all_text = []
-        for i, page in enumerate(images):
-            opencv_img = cv2.cvtColor(np.array(page), cv2.COLOR_RGB2BGR)
-            gray = cv2.cvtColor(opencv_img, cv2.COLOR_BGR2GRAY)
-            _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
+        # pages are rasterized a small window at a time to keep memory flat
+        for page_number, gray in pdf_page_arrays(pdf_path, first_page, last_page, RASTER_PROFILE):
+            with metrics.span('preprocess', ENGINE_NAME):
+                _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
             text = _ocr_with_boxes(binary, min_conf=min_conf)
-            all_text.append(f"--- Page {i+1} ---\n" + text)
+            all_text.append(f"--- Page {page_number} ---\n" + text)
         return "\n\n".join(all_text)
     except Exception as e:
         return f"Error processing PDF with region-based OCR: {e}"
@@ -78,12 +88,13 @@ def extract_text_from_pdf(pdf_path, min_conf=50):
 def recognize_handwriting(image_path, min_conf=40):
     """Recognize handwritten text from an image with preprocessing + region-based OCR"""
     try:
-        img = cv2.imread(image_path)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        bin_img = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                        cv2.THRESH_BINARY_INV, 11, 2)
-        kernel = np.ones((1, 1), np.uint8)
-        bin_img = cv2.morphologyEx(bin_img, cv2.MORPH_CLOSE, kernel)
+        with metrics.span('preprocess', ENGINE_NAME):
+            img = cv2.imread(image_path)
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            bin_img = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                            cv2.THRESH_BINARY_INV, 11, 2)
+            kernel = np.ones((1, 1), np.uint8)
+            bin_img = cv2.morphologyEx(bin_img, cv2.MORPH_CLOSE, kernel)
         text = _ocr_with_boxes(bin_img, min_conf=min_conf, custom_config=r'--oem 3 --psm 6 -l eng')
         return text.strip()
     except Exception as e:
@@ -93,24 +104,26 @@ def recognize_handwriting(image_path, min_conf=40):
 def extract_invoice_data(image_path, min_conf=50):
     """Extract structured invoice fields using region-based OCR"""
     try:
-        img = cv2.imread(image_path)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
+        with metrics.span('preprocess', ENGINE_NAME):
+            img = cv2.imread(image_path)
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
         text = _ocr_with_boxes(binary, min_conf=min_conf)
 
-        invoice_data = {'invoice_number': None, 'date': None, 'total_amount': None, 'vendor': None, 'items': []}
-        invoice_match = re.search(r'(?i)invoice\s*(?:#|number|num|no|no\.)\s*[:\s]?([A-Za-z0-9\-]+)', text)
-        if invoice_match:
-            invoice_data['invoice_number'] = invoice_match.group(1)
-        date_match = re.search(r'(?i)(?:date|dated)?\s*[:\s]?(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})', text)
-        if date_match:
-            invoice_data['date'] = date_match.group(1)
-        amount_match = re.search(r'(?i)(?:total|amount|sum)?\s*(?:due|:)?\s*[\$£€]?(\d+[\.,]\d{2})', text)
-        if amount_match:
-            invoice_data['total_amount'] = amount_match.group(1)
-        lines = [l.strip() for l in text.split('\n') if l.strip()]
-        if lines:
-            invoice_data['vendor'] = lines[0]
+        with metrics.span('parse', ENGINE_NAME):
+            invoice_data = {'invoice_number': None, 'date': None, 'total_amount': None, 'vendor': None, 'items': []}
+            invoice_match = re.search(r'(?i)invoice\s*(?:#|number|num|no|no\.)\s*[:\s]?([A-Za-z0-9\-]+)', text)
+            if invoice_match:
+                invoice_data['invoice_number'] = invoice_match.group(1)
+            date_match = re.search(r'(?i)(?:date|dated)?\s*[:\s]?(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})', text)
+            if date_match:
+                invoice_data['date'] = date_match.group(1)
+            amount_match = re.search(r'(?i)(?:total|amount|sum)?\s*(?:due|:)?\s*[\$£€]?(\d+[\.,]\d{2})', text)
+            if amount_match:
+                invoice_data['total_amount'] = amount_match.group(1)
+            lines = [l.strip() for l in text.split('\n') if l.strip()]
+            if lines:
+                invoice_data['vendor'] = lines[0]
         return json.dumps(invoice_data, indent=2)
     except Exception as e:
         return f"Error extracting invoice data with region-based OCR: {e}"
@@ -120,8 +133,11 @@ def highlight_text_regions(image_path, output_path=None, min_conf=50, custom_con
     """Highlight text blocks detected by OCR on the image and save the annotated image."""
     img = cv2.imread(image_path)
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
+    # OCR at the engine's target text height, then map the boxes back onto the original
+    rescale = resolution.govern(gray, ENGINE_NAME)
+    _, binary = cv2.threshold(rescale.image, 150, 255, cv2.THRESH_BINARY_INV)
     boxes = _ocr_with_boxes(binary, min_conf=min_conf, custom_config=custom_config, return_boxes=True)
+    boxes = resolution.map_boxes(boxes, rescale.scale)
     for x, y, w, h, _ in boxes:
         cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
     # always save annotated image